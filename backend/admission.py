@@ -0,0 +1,203 @@
+"""
+Admission control for checkout during sales spikes.
+
+Each worker lets at most ADMISSION_CHECKOUT_CONCURRENCY checkout requests
+(order placement, payment order creation) run at once. Size it well below
+the Mongo connection pool so browsing always finds free connections however
+hard checkout is hammered; checkout then runs at the rate the database
+sustains instead of timing everyone out.
+
+Requests beyond the limit wait in a per-worker queue ordered by their queue
+ticket, up to ADMISSION_HOLD_SECONDS. A ticket is an HMAC-signed token,
+bound to the user, recording when they first joined the line. A request
+still waiting at the end of the hold, or arriving when ADMISSION_CHECKOUT_QUEUE
+requests are already waiting, gets 503 with Retry-After, its position, an
+ETA and the ticket (body and X-Queue-Ticket header). Presenting the ticket
+on retry keeps the original place in line, so clients that back off are not
+overtaken by newcomers.
+
+The ETA is the position times the recent average checkout duration divided
+by the concurrency limit.
+"""
+import asyncio
+import base64
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import math
+import os
+import time
+
+from fastapi import HTTPException, Request
+
+from metrics import registry
+from rate_limit import client_ip
+
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_CHECKOUT_CONCURRENCY = int(os.environ.get('ADMISSION_CHECKOUT_CONCURRENCY', '16'))
+ADMISSION_CHECKOUT_QUEUE = int(os.environ.get('ADMISSION_CHECKOUT_QUEUE', '200'))
+ADMISSION_HOLD_SECONDS = float(os.environ.get('ADMISSION_HOLD_SECONDS', '5'))
+ADMISSION_TICKET_TTL_SECONDS = float(os.environ.get('ADMISSION_TICKET_TTL_SECONDS', '900'))
+
+admission_in_flight = registry.gauge("admission_in_flight", "Admitted requests still running", ("gate",))
+admission_waiting = registry.gauge("admission_waiting", "Requests waiting for a slot", ("gate",))
+admission_decisions = registry.counter(
+    "admission_decisions_total", "Admission outcomes (admitted, queued, timed_out, shed)", ("gate", "outcome"))
+admission_wait_seconds = registry.histogram(
+    "admission_wait_seconds", "Time admitted requests spent waiting for a slot", ("gate",),
+    (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def issue_ticket(subject, joined_at, secret):
+    payload = _b64(json.dumps({"s": subject, "j": joined_at}, separators=(",", ":")).encode())
+    signature = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()[:16]
+    return f"{payload}.{_b64(signature)}"
+
+
+def read_ticket(ticket, subject, secret, ttl=ADMISSION_TICKET_TTL_SECONDS):
+    """When the holder joined the line, or None for a missing, forged, expired or borrowed ticket"""
+    try:
+        payload, signature = ticket.split(".", 1)
+        expected = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()[:16]
+        if not hmac.compare_digest(_unb64(signature), expected):
+            return None
+        data = json.loads(_unb64(payload))
+        joined_at = float(data["j"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+    if data.get("s") != subject or not 0 <= time.time() - joined_at <= ttl:
+        return None
+    return joined_at
+
+
+class AdmissionGate:
+    """Concurrency limit with a bounded queue ordered by join time; single event loop, so no locking"""
+
+    def __init__(self, name, max_concurrent, max_queue, hold_seconds, enabled=ADMISSION_ENABLED):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.hold_seconds = hold_seconds
+        self.enabled = enabled
+        self.in_flight = 0
+        self.service_seconds = 0.5  # EWMA of admitted request duration
+        self._waiters = []  # heap of (joined_at, seq, future); abandoned entries are skipped lazily
+        self._waiting = 0
+        self._seq = itertools.count()
+
+    def position(self, joined_at):
+        """1-based place in line for someone who joined at joined_at"""
+        return 1 + sum(1 for entry in self._waiters if entry[0] < joined_at and not entry[2].done())
+
+    def eta(self, position):
+        return math.ceil(position * self.service_seconds / max(1, self.max_concurrent))
+
+    def _someone_ahead(self, joined_at):
+        return any(entry[0] <= joined_at and not entry[2].done() for entry in self._waiters)
+
+    async def acquire(self, joined_at):
+        """'admitted' or 'queued' once a slot is held; 'timed_out' or 'shed' otherwise"""
+        if self.in_flight < self.max_concurrent and not self._someone_ahead(joined_at):
+            self.in_flight += 1
+            admission_in_flight.set(self.in_flight, gate=self.name)
+            return "admitted"
+        if self._waiting >= self.max_queue:
+            return "shed"
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (joined_at, next(self._seq), future))
+        self._waiting += 1
+        admission_waiting.set(self._waiting, gate=self.name)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.hold_seconds)
+            return "queued"
+        except asyncio.TimeoutError:
+            # release() may have handed us the slot in the same loop iteration as the timeout
+            if future.done() and not future.cancelled():
+                return "queued"
+            future.cancel()
+            return "timed_out"
+        except asyncio.CancelledError:
+            # Client went away; pass on a slot we were given
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+        finally:
+            self._waiting -= 1
+            admission_waiting.set(self._waiting, gate=self.name)
+
+    def release(self, elapsed=None):
+        if elapsed is not None:
+            self.service_seconds = 0.8 * self.service_seconds + 0.2 * elapsed
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # Hand the slot straight to the longest-waiting ticket; in_flight is unchanged
+                future.set_result(True)
+                return
+        self.in_flight -= 1
+        admission_in_flight.set(self.in_flight, gate=self.name)
+
+    def guard(self, secret, subject_func=None):
+        """
+        Route dependency holding a slot for the duration of the request.
+        subject_func(request) returns the user id (or None, falling back to
+        the client IP) that queue tickets are bound to.
+        """
+        async def admit(request: Request):
+            if not self.enabled:
+                yield
+                return
+            subject = (await subject_func(request) if subject_func else None) or client_ip(request)
+            joined_at = read_ticket(request.headers.get("x-queue-ticket", ""), subject, secret) or time.time()
+            started = time.perf_counter()
+            outcome = await self.acquire(joined_at)
+            admission_decisions.inc(gate=self.name, outcome=outcome)
+            if outcome in ("timed_out", "shed"):
+                position = self.position(joined_at) if outcome == "timed_out" else self._waiting + 1
+                eta = self.eta(position)
+                ticket = issue_ticket(subject, joined_at, secret)
+                raise HTTPException(
+                    status_code=503,
+                    detail={
+                        "message": "Checkout is busy, you are in line",
+                        "position": position,
+                        "eta_seconds": eta,
+                        "ticket": ticket,
+                    },
+                    headers={"Retry-After": str(max(1, eta)), "X-Queue-Ticket": ticket},
+                )
+            admission_wait_seconds.observe(time.perf_counter() - started, gate=self.name)
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.release(time.perf_counter() - started)
+
+        admit.__name__ = f"admission_{self.name}"
+        return admit
+
+    def status(self):
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self._waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "avg_service_seconds": round(self.service_seconds, 3),
+        }
+
+
+checkout_gate = AdmissionGate(
+    "checkout", ADMISSION_CHECKOUT_CONCURRENCY, ADMISSION_CHECKOUT_QUEUE, ADMISSION_HOLD_SECONDS)
@@ -0,0 +1,76 @@
+"""
+Expiry and compaction for `db.cart`.
+
+* Abandoned carts expire through a TTL index on `added_at`, which every cart
+  write refreshes, so a line lives CART_TTL_DAYS after the user last touched it.
+* A periodic compaction job removes lines whose product was deleted or
+  deactivated. It walks the distinct product ids in the cart in batches of
+  CART_COMPACTION_BATCH_SIZE, resolving each batch with one $in query.
+"""
+import asyncio
+import os
+import time
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+from metrics import registry
+
+CART_TTL_DAYS = float(os.environ.get('CART_TTL_DAYS', '30'))
+CART_COMPACTION_BATCH_SIZE = int(os.environ.get('CART_COMPACTION_BATCH_SIZE', '500'))
+CART_COMPACTION_PAUSE_SECONDS = float(os.environ.get('CART_COMPACTION_PAUSE_SECONDS', '0.2'))
+CART_COMPACTION_INTERVAL = float(os.environ.get('CART_COMPACTION_INTERVAL', '21600'))  # 0 disables the schedule
+
+cart_lines_reclaimed = registry.counter(
+    "cart_lines_reclaimed_total", "Cart lines removed by compaction", ("reason",))
+cart_compaction_duration = registry.histogram(
+    "cart_compaction_batch_duration_seconds", "Time to check and purge one batch of cart products", (),
+    (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+
+async def ensure_cart_indexes(db, ttl_days=CART_TTL_DAYS):
+    await db.cart.create_index([("user_id", ASCENDING), ("product_id", ASCENDING)])
+    await db.cart.create_index("product_id")
+    ttl_seconds = int(ttl_days * 86400)
+    try:
+        await db.cart.create_index("added_at", expireAfterSeconds=ttl_seconds)
+    except OperationFailure:
+        # The index exists with another TTL (or none): change it in place
+        await db.command("collMod", "cart", index={"keyPattern": {"added_at": 1}, "expireAfterSeconds": ttl_seconds})
+
+
+async def _product_id_batches(db, batch_size):
+    # Aggregation cursor rather than distinct(), which is capped at 16MB of ids
+    batch = []
+    async for row in db.cart.aggregate([{"$group": {"_id": "$product_id"}}], allowDiskUse=True):
+        batch.append(row["_id"])
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def compact_cart(db, batch_size=CART_COMPACTION_BATCH_SIZE, pause=CART_COMPACTION_PAUSE_SECONDS):
+    """Purge cart lines for deleted or inactive products; returns counts by reason"""
+    reclaimed = {"orphaned": 0, "inactive": 0}
+    checked = 0
+
+    async for batch in _product_id_batches(db, batch_size):
+        started = time.perf_counter()
+        checked += len(batch)
+        active = set()
+        inactive = set()
+        async for product in db.products.find({"id": {"$in": batch}}, {"_id": 0, "id": 1, "is_active": 1}):
+            (active if product.get("is_active", True) else inactive).add(product["id"])
+        orphaned = [product_id for product_id in batch if product_id not in active and product_id not in inactive]
+
+        for reason, ids in (("orphaned", orphaned), ("inactive", list(inactive))):
+            if ids:
+                result = await db.cart.delete_many({"product_id": {"$in": ids}})
+                reclaimed[reason] += result.deleted_count
+                cart_lines_reclaimed.inc(result.deleted_count, reason=reason)
+        cart_compaction_duration.observe(time.perf_counter() - started)
+        await asyncio.sleep(pause)
+
+    return {"products_checked": checked, "reclaimed": reclaimed}
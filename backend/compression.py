@@ -0,0 +1,185 @@
+"""
+Content-negotiated response compression (brotli and gzip).
+
+CompressionMiddleware compresses compressible responses above
+COMPRESSION_MIN_SIZE. Single-message bodies are compressed in one shot;
+streaming bodies are compressed chunk by chunk with a flush after each one, so
+clients still see data as soon as the app sends it. Responses that already
+carry a Content-Encoding (e.g. precompressed cache entries) pass through
+untouched.
+"""
+import gzip
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '5'))
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "text/", "application/javascript", "application/xml", "image/svg+xml",
+)
+# Never compress these even if they look textual: SSE must reach the client unbuffered
+EXCLUDED_TYPES = ("text/event-stream",)
+
+
+def supported_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick the best encoding we support from an Accept-Encoding header"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if token:
+            weights[token] = q
+
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return body
+
+
+class StreamCompressor:
+    """Incremental compressor that flushes after every chunk"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data):
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def is_compressible(content_type):
+    content_type = content_type.lower()
+    if any(content_type.startswith(excluded) for excluded in EXCLUDED_TYPES):
+        return False
+    return any(content_type.startswith(prefix) for prefix in COMPRESSIBLE_TYPES)
+
+
+def _add_vary(headers):
+    for i, (name, value) in enumerate(headers):
+        if name.lower() == b"vary":
+            if b"accept-encoding" not in value.lower():
+                headers[i] = (name, value + b", Accept-Encoding")
+            return
+    headers.append((b"vary", b"Accept-Encoding"))
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware; buffers only the first body message"""
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = dict(scope.get("headers") or [])
+        encoding = negotiate_encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = {name.lower(): value for name, value in message.get("headers", [])}
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                passthrough = (
+                    b"content-encoding" in headers
+                    or b"content-range" in headers
+                    or message["status"] in (204, 206, 304)
+                    or not is_compressible(content_type)
+                )
+                if passthrough:
+                    await send(message)
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None and start_message is not None:
+                headers = [(name, value) for name, value in start_message.get("headers", [])
+                           if name.lower() != b"content-length"]
+                if not more_body:
+                    # Whole body in one message: compress once with a correct Content-Length
+                    if len(body) < self.minimum_size:
+                        await send(start_message)
+                        start_message = None
+                        await send(message)
+                        return
+                    compressed = compress(body, encoding)
+                    headers += [(b"content-encoding", encoding.encode()),
+                                (b"content-length", str(len(compressed)).encode())]
+                    _add_vary(headers)
+                    await send({**start_message, "headers": headers})
+                    start_message = None
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+
+                compressor = StreamCompressor(encoding)
+                headers.append((b"content-encoding", encoding.encode()))
+                _add_vary(headers)
+                await send({**start_message, "headers": headers})
+                start_message = None
+
+            if compressor is None:
+                await send(message)
+                return
+
+            data = compressor.chunk(body) if body else b""
+            if not more_body:
+                data += compressor.finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
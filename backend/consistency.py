@@ -0,0 +1,307 @@
+"""
+Per-route read preference, read concern and write concern.
+
+Every route is mapped to a named profile (ROUTE_CONSISTENCY in server.py;
+the app refuses to start with an unmapped route). ConsistencyMiddleware
+matches the route before it runs and makes its profile current for the
+whole request, including dependencies such as get_current_user.
+`ProfiledDatabase` wraps the Motor database, and each collection it hands
+out carries the current profile's options. Code outside a request, like
+background jobs and startup, gets the client defaults.
+
+Profiles:
+
+* catalog: public catalogue reads from a secondary when one is within
+  CONSISTENCY_CATALOG_MAX_STALENESS seconds of the primary. Response cache
+  fills run on the primary instead (server.on_primary): a fill right after
+  an invalidation must see the write, or the cache would hold the stale
+  copy for RESPONSE_CACHE_TTL.
+* analytics: admin lists, on secondaries within
+  CONSISTENCY_ANALYTICS_MAX_STALENESS seconds, in a causal session. An
+  admin who sends back the token from their own write reads it, because
+  the secondary waits until it has applied that write.
+* cart: primary reads, w:1 writes. A lost cart line after a failover is an
+  annoyance, not a lost sale.
+* orders: majority reads and writes in a causally consistent session.
+* payments: like orders, with journaled majority writes.
+* primary: the client defaults, for auth, admin edits and health checks.
+
+Causal profiles give read-your-writes across requests. The response carries
+X-Causal-Token, the session's signed cluster and operation time. A client
+that sends it back on its next request has that session advanced past its
+own writes first, so a read sees them even after an election.
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+import bson
+from pymongo import ReadPreference, WriteConcern
+from pymongo.errors import PyMongoError
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import SecondaryPreferred
+from starlette.routing import Match
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+CONSISTENCY_ENABLED = os.environ.get('CONSISTENCY_ENABLED', 'true').lower() == 'true'
+# Drivers reject max staleness below 90 seconds
+CONSISTENCY_CATALOG_MAX_STALENESS = max(90, int(os.environ.get('CONSISTENCY_CATALOG_MAX_STALENESS', '90')))
+CONSISTENCY_ANALYTICS_MAX_STALENESS = max(90, int(os.environ.get('CONSISTENCY_ANALYTICS_MAX_STALENESS', '300')))
+
+CAUSAL_TOKEN_HEADER = "X-Causal-Token"
+
+consistency_requests = registry.counter(
+    "consistency_requests_total", "Requests by consistency profile", ("profile",))
+causal_sessions = registry.counter(
+    "consistency_causal_sessions_total", "Causal session outcomes (started, resumed, unavailable)", ("result",))
+
+
+class Profile:
+    def __init__(self, name, read_preference=None, read_concern=None, write_concern=None, causal=False):
+        self.name = name
+        self.causal = causal
+        self.options = {
+            key: value for key, value in (
+                ("read_preference", read_preference),
+                ("read_concern", read_concern),
+                ("write_concern", write_concern),
+            ) if value is not None
+        }
+
+
+PROFILES = {profile.name: profile for profile in (
+    Profile("primary"),
+    Profile("catalog", SecondaryPreferred(max_staleness=CONSISTENCY_CATALOG_MAX_STALENESS), ReadConcern("local")),
+    Profile("analytics", SecondaryPreferred(max_staleness=CONSISTENCY_ANALYTICS_MAX_STALENESS), ReadConcern("local"),
+            causal=True),
+    Profile("cart", ReadPreference.PRIMARY, ReadConcern("local"), WriteConcern(w=1)),
+    Profile("orders", ReadPreference.PRIMARY, ReadConcern("majority"), WriteConcern(w="majority"), causal=True),
+    Profile("payments", ReadPreference.PRIMARY, ReadConcern("majority"), WriteConcern(w="majority", j=True),
+            causal=True),
+)}
+DEFAULT_PROFILE = PROFILES["primary"]
+
+
+class _RequestConsistency:
+    __slots__ = ("profile", "session")
+
+    def __init__(self, profile, session=None):
+        self.profile = profile
+        self.session = session
+
+
+_current = ContextVar("consistency", default=None)
+
+
+def current_profile():
+    state = _current.get()
+    return state.profile if state is not None else DEFAULT_PROFILE
+
+
+@contextmanager
+def use_profile(name, session=None):
+    """Run a block under a profile outside a request, e.g. a job reading for a report"""
+    token = _current.set(_RequestConsistency(PROFILES[name], session))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+# Collection methods that take session=; everything else passes through untouched
+SESSION_METHODS = frozenset((
+    "find", "find_one", "find_one_and_update", "find_one_and_replace", "find_one_and_delete",
+    "insert_one", "insert_many", "update_one", "update_many", "replace_one", "delete_one", "delete_many",
+    "bulk_write", "aggregate", "count_documents", "distinct",
+))
+
+
+class SessionCollection:
+    """A collection that runs every CRUD call in the request's causal session"""
+
+    __slots__ = ("_collection", "_session")
+
+    def __init__(self, collection, session):
+        self._collection = collection
+        self._session = session
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        return partial(attr, session=self._session) if name in SESSION_METHODS else attr
+
+
+class ProfiledDatabase:
+    """
+    Drop-in wrapper for an AsyncIOMotorDatabase: `db.orders` and `db["orders"]`
+    return the collection with the current request's profile applied.
+    Database-level calls (command, create_collection, ...) pass through.
+    """
+
+    def __init__(self, database):
+        self._database = database
+        self._collections = {}
+
+    def _collection(self, name):
+        state = _current.get()
+        profile = state.profile if state is not None else DEFAULT_PROFILE
+        key = (name, profile.name)
+        collection = self._collections.get(key)
+        if collection is None:
+            collection = self._collections[key] = self._database.get_collection(name, **profile.options)
+        if state is not None and state.session is not None:
+            return SessionCollection(collection, state.session)
+        return collection
+
+    def __getitem__(self, name):
+        return self._collection(name)
+
+    def __getattr__(self, name):
+        attr = getattr(self._database, name)
+        if hasattr(attr, "insert_one"):
+            return self._collection(name)
+        return attr
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def issue_causal_token(session, secret):
+    """The session's position in the cluster's history, signed so clients cannot forge one"""
+    if session.cluster_time is None and session.operation_time is None:
+        return None
+    payload = _b64(bson.encode({"c": session.cluster_time, "o": session.operation_time}))
+    signature = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()[:16]
+    return f"{payload}.{_b64(signature)}"
+
+
+def read_causal_token(token, secret):
+    """(cluster_time, operation_time), or None for a missing or forged token"""
+    try:
+        payload, signature = token.split(".", 1)
+        expected = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()[:16]
+        if not hmac.compare_digest(_unb64(signature), expected):
+            return None
+        data = bson.decode(_unb64(payload))
+    except (AttributeError, TypeError, ValueError, bson.errors.BSONError):
+        return None
+    return data.get("c"), data.get("o")
+
+
+def match_route(routes, scope):
+    """The route a request will be dispatched to, matched the way the router does"""
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
+
+
+def route_keys(routes):
+    """"METHOD /path" for every HTTP route the app serves (docs and websockets excluded)"""
+    keys = set()
+    for route in routes:
+        # APIRoutes have a dependant; the docs are plain starlette routes
+        if not hasattr(route, "dependant") or not getattr(route, "methods", None):
+            continue
+        keys.update(f"{method} {route.path}" for method in route.methods if method != "HEAD")
+    return keys
+
+
+def check_route_profiles(routes, route_profiles):
+    """Fail fast when a route has no profile, a mapping names no route, or a profile does not exist"""
+    served = route_keys(routes)
+    problems = []
+    unmapped = sorted(served - route_profiles.keys())
+    if unmapped:
+        problems.append(f"routes without a consistency profile: {', '.join(unmapped)}")
+    stale = sorted(route_profiles.keys() - served)
+    if stale:
+        problems.append(f"profiles mapped to routes that do not exist: {', '.join(stale)}")
+    unknown = sorted({name for name in route_profiles.values() if name not in PROFILES})
+    if unknown:
+        problems.append(f"unknown consistency profiles: {', '.join(unknown)}")
+    if problems:
+        raise RuntimeError("; ".join(problems))
+
+
+class ConsistencyMiddleware:
+    """Pure ASGI middleware, so the profile and session also cover streaming responses"""
+
+    def __init__(self, app, routes, route_profiles, client, secret, enabled=CONSISTENCY_ENABLED):
+        self.app = app
+        self.routes = routes
+        self.route_profiles = route_profiles
+        self.client = client  # callable, so tests can swap the client after import
+        self.secret = secret
+        self.enabled = enabled
+
+    def _profile(self, scope):
+        route = match_route(self.routes, scope)
+        if route is None:
+            return DEFAULT_PROFILE
+        return PROFILES[self.route_profiles.get(f"{scope['method']} {route.path}", DEFAULT_PROFILE.name)]
+
+    async def _start_session(self, scope):
+        try:
+            session = await self.client().start_session(causal_consistency=True)
+        except (NotImplementedError, PyMongoError) as e:
+            # Standalone test doubles have no sessions; run without causal guarantees
+            causal_sessions.inc(result="unavailable")
+            logger.debug("Causal session unavailable: %s", e)
+            return None
+        token = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-causal-token":
+                token = read_causal_token(value.decode("latin-1"), self.secret)
+                break
+        if token is not None:
+            cluster_time, operation_time = token
+            try:
+                if cluster_time is not None:
+                    session.advance_cluster_time(cluster_time)
+                if operation_time is not None:
+                    session.advance_operation_time(operation_time)
+                causal_sessions.inc(result="resumed")
+                return session
+            except (TypeError, ValueError):
+                pass
+        causal_sessions.inc(result="started")
+        return session
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        profile = self._profile(scope)
+        consistency_requests.inc(profile=profile.name)
+        session = await self._start_session(scope) if profile.causal else None
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and session is not None:
+                causal_token = issue_causal_token(session, self.secret)
+                if causal_token:
+                    message["headers"] = [
+                        *message.get("headers", ()), (b"x-causal-token", causal_token.encode("latin-1"))
+                    ]
+            await send(message)
+
+        try:
+            with use_profile(profile.name, session):
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            if session is not None:
+                await session.end_session()
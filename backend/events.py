@@ -0,0 +1,219 @@
+"""
+Per-process fan-out of order changes: Server-Sent Events for customers and a
+WebSocket feed for admins.
+
+Each SSE client owns one small asyncio.Queue and nothing else: no polling,
+no per-connection tasks, so thousands of idle streams cost only their
+sockets and queues. Publishers call `publish()` synchronously from the
+request that changed the order.
+
+Event ids are "<boot id>-<sequence>". A reconnecting client's Last-Event-ID
+is replayed from a bounded in-memory history; if it comes from another
+process or has already been evicted, the client gets a `resync` event and
+should refetch its orders once.
+"""
+import asyncio
+import json
+import os
+import secrets
+from collections import deque
+
+from fastapi.encoders import jsonable_encoder
+
+from metrics import registry
+
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_HISTORY_SIZE = int(os.environ.get('SSE_HISTORY_SIZE', '5000'))
+SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', '100'))
+SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS', '3000'))
+
+sse_connections = registry.gauge("sse_connections", "Open Server-Sent Events streams")
+sse_events_published = registry.counter("sse_events_published_total", "Events published to SSE streams", ("event",))
+sse_dropped_subscribers = registry.counter(
+    "sse_dropped_subscribers_total", "SSE streams closed because the client could not keep up")
+
+
+def format_sse(data, event=None, event_id=None, retry=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    if retry is not None:
+        lines.append(f"retry: {retry}")
+    for line in data.splitlines() or [""]:
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
+
+
+class _Subscriber:
+    __slots__ = ("queue", "overflowed")
+
+    def __init__(self, maxsize=SSE_QUEUE_SIZE):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+
+class EventHub:
+    def __init__(self, history_size=SSE_HISTORY_SIZE):
+        self.boot_id = secrets.token_hex(4)
+        self._sequence = 0
+        self._history = deque(maxlen=history_size)
+        self._subscribers = {}
+
+    def _next_id(self):
+        self._sequence += 1
+        return self._sequence
+
+    def publish(self, user_id, event, data):
+        """Record an event for one user and push it to their open streams"""
+        sequence = self._next_id()
+        entry = (sequence, user_id, event, json.dumps(jsonable_encoder(data)))
+        self._history.append(entry)
+        sse_events_published.inc(event=event)
+        for subscriber in self._subscribers.get(user_id, ()):
+            if subscriber.overflowed:
+                continue
+            try:
+                subscriber.queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                # Slow reader: close its stream; it will resume from Last-Event-ID
+                subscriber.overflowed = True
+                sse_dropped_subscribers.inc()
+
+    def _replay(self, user_id, last_event_id):
+        """Events after last_event_id for this user, or None if we cannot tell"""
+        boot_id, _, sequence = (last_event_id or "").partition("-")
+        if boot_id != self.boot_id or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if self._history and sequence < self._history[0][0] - 1:
+            return None
+        return [entry for entry in self._history if entry[0] > sequence and entry[1] == user_id]
+
+    def _render(self, entry):
+        sequence, _, event, data = entry
+        return format_sse(data, event=event, event_id=f"{self.boot_id}-{sequence}")
+
+    async def stream(self, user_id, last_event_id=None, heartbeat=SSE_HEARTBEAT_SECONDS):
+        """Async generator of SSE frames for one user's connection"""
+        subscriber = _Subscriber()
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        # Snapshot the backlog before the first yield; anything published after
+        # this point arrives through the queue, so nothing is sent twice
+        missed = self._replay(user_id, last_event_id) if last_event_id else []
+        sse_connections.inc()
+        try:
+            yield format_sse(json.dumps({"boot_id": self.boot_id}), event="ready", retry=SSE_RETRY_MS)
+            if last_event_id:
+                if missed is None:
+                    yield format_sse("{}", event="resync", event_id=f"{self.boot_id}-{self._sequence}")
+                else:
+                    for entry in missed:
+                        yield self._render(entry)
+
+            while not subscriber.overflowed:
+                try:
+                    entry = await asyncio.wait_for(subscriber.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield self._render(entry)
+        finally:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[user_id]
+            sse_connections.dec()
+
+    def connection_count(self):
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+order_events = EventHub()
+
+
+ws_connections = registry.gauge("admin_feed_connections", "Open admin order feed WebSockets")
+WS_HEARTBEAT_SECONDS = float(os.environ.get('WS_HEARTBEAT_SECONDS', '30'))
+WS_QUEUE_SIZE = int(os.environ.get('WS_QUEUE_SIZE', '500'))
+
+
+class AdminOrderFeed:
+    """
+    WebSocket fan-out of order changes to admin dashboards.
+
+    A client receives one `snapshot` message and then diffs:
+    `order.created` (full order), `order.updated` (order_id + changed fields)
+    and `order.deleted` (order_ids). Every message carries an increasing
+    `version`. Diffs published while the snapshot was loading may already be
+    reflected in it, so clients apply them idempotently (upsert by id, merge
+    fields, delete if present). A client that falls WS_QUEUE_SIZE messages
+    behind is closed with 1013 and reconnects for a fresh snapshot.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._connections = set()
+
+    def _broadcast(self, message_type, payload):
+        self.version += 1
+        if not self._connections:
+            return
+        message = json.dumps(jsonable_encoder({"type": message_type, "version": self.version, **payload}))
+        for connection in self._connections:
+            if connection.overflowed:
+                continue
+            try:
+                connection.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                connection.overflowed = True
+
+    def order_created(self, order):
+        self._broadcast("order.created", {"order": order})
+
+    def order_updated(self, order_id, changes):
+        self._broadcast("order.updated", {"order_id": order_id, "changes": changes})
+
+    def orders_deleted(self, order_ids):
+        if order_ids:
+            self._broadcast("order.deleted", {"order_ids": list(order_ids)})
+
+    async def _send_loop(self, websocket, connection, heartbeat):
+        while not connection.overflowed:
+            try:
+                message = await asyncio.wait_for(connection.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                message = json.dumps({"type": "heartbeat", "version": self.version})
+            await websocket.send_text(message)
+        await websocket.close(code=1013, reason="Feed overflow, reconnect for a fresh snapshot")
+
+    async def serve(self, websocket, load_snapshot, heartbeat=WS_HEARTBEAT_SECONDS):
+        """Run one accepted admin connection until the client goes away"""
+        connection = _Subscriber(WS_QUEUE_SIZE)
+        # Subscribe before loading so no change between load and send is lost
+        self._connections.add(connection)
+        ws_connections.inc()
+        sender = None
+        try:
+            snapshot_version = self.version
+            orders = await load_snapshot()
+            await websocket.send_text(json.dumps(jsonable_encoder({
+                "type": "snapshot", "version": snapshot_version, "orders": orders
+            })))
+            sender = asyncio.ensure_future(self._send_loop(websocket, connection, heartbeat))
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+        finally:
+            self._connections.discard(connection)
+            ws_connections.dec()
+            if sender is not None:
+                sender.cancel()
+
+    def connection_count(self):
+        return len(self._connections)
+
+
+admin_order_feed = AdminOrderFeed()
@@ -0,0 +1,85 @@
+"""
+Signed, client-held carts for anonymous visitors.
+
+The whole cart travels with the client as a compact token:
+
+    base64url(json {"i": [[product_id, quantity], ...], "t": issued_at}) "." base64url(hmac)
+
+Tokens are verified with HMAC-SHA256 and never touch MongoDB; the cart is
+only written to `db.cart` once, in bulk, when the visitor logs in or
+registers.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+GUEST_CART_MAX_ITEMS = int(os.environ.get('GUEST_CART_MAX_ITEMS', '50'))
+GUEST_CART_MAX_QUANTITY = int(os.environ.get('GUEST_CART_MAX_QUANTITY', '99'))
+GUEST_CART_TTL_SECONDS = int(os.environ.get('GUEST_CART_TTL_DAYS', '30')) * 86400
+
+
+class InvalidGuestCart(ValueError):
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _signature(payload, secret):
+    return hmac.new(secret.encode(), b"guest-cart." + payload, hashlib.sha256).digest()[:16]
+
+
+def encode_cart(items, secret):
+    """items: {product_id: quantity} -> signed token"""
+    lines = [[product_id, quantity] for product_id, quantity in items.items() if quantity > 0]
+    payload = json.dumps({"i": lines, "t": int(time.time())}, separators=(",", ":")).encode()
+    return f"{_b64encode(payload)}.{_b64encode(_signature(payload, secret))}"
+
+
+def decode_cart(token, secret, ttl=GUEST_CART_TTL_SECONDS):
+    """Signed token -> {product_id: quantity}; an empty/missing token is an empty cart"""
+    if not token:
+        return {}
+    try:
+        payload_part, signature_part = token.split(".", 1)
+        payload = _b64decode(payload_part)
+        signature = _b64decode(signature_part)
+    except (ValueError, TypeError):
+        raise InvalidGuestCart("Malformed guest cart")
+    if not hmac.compare_digest(signature, _signature(payload, secret)):
+        raise InvalidGuestCart("Guest cart signature mismatch")
+
+    data = json.loads(payload)
+    if ttl and time.time() - data.get("t", 0) > ttl:
+        return {}
+    items = {}
+    for product_id, quantity in data.get("i", []):
+        items[str(product_id)] = int(quantity)
+    return items
+
+
+def add_item(items, product_id, quantity):
+    items = dict(items)
+    if product_id not in items and len(items) >= GUEST_CART_MAX_ITEMS:
+        raise InvalidGuestCart(f"Guest carts hold at most {GUEST_CART_MAX_ITEMS} products")
+    items[product_id] = min(GUEST_CART_MAX_QUANTITY, items.get(product_id, 0) + quantity)
+    return items
+
+
+def set_quantity(items, product_id, quantity):
+    items = dict(items)
+    if product_id not in items:
+        raise KeyError(product_id)
+    if quantity <= 0:
+        del items[product_id]
+    else:
+        items[product_id] = min(GUEST_CART_MAX_QUANTITY, quantity)
+    return items
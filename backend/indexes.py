@@ -0,0 +1,67 @@
+"""
+Index definitions, created once per worker at startup.
+
+create_index is a no-op when the index already exists, so this is cheap on
+every boot. An index that cannot be built (e.g. a unique index over existing
+duplicates) is logged and skipped rather than keeping the worker down.
+"""
+import logging
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from cart_maintenance import ensure_cart_indexes
+from order_archive import ensure_archive_indexes
+from popularity import ensure_popularity_indexes
+from promotion_limits import ensure_promotion_indexes
+from recommendations import ensure_recommendation_indexes
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "users": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("email", ASCENDING)], {"unique": True}),
+    ],
+    "products": [
+        ([("id", ASCENDING)], {"unique": True}),
+        # Partial indexes hold only the live catalogue; soft-deleted products add no index entries
+        ([("category", ASCENDING), ("created_at", DESCENDING)], {
+            "name": "active_category_created_at", "partialFilterExpression": {"is_active": True}}),
+        ([("is_active", ASCENDING)], {
+            "name": "active_products", "partialFilterExpression": {"is_active": True}}),
+    ],
+    "orders": [
+        ([("id", ASCENDING)], {"unique": True}),
+        # Serves keyset-paginated history and every other per-user order lookup
+        ([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        # Newest-first admin list and order feed snapshot
+        ([("created_at", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    "promotions": [
+        ([("code", ASCENDING), ("is_active", ASCENDING)], {}),
+    ],
+    "settings": [
+        ([("store_id", ASCENDING)], {}),
+    ],
+}
+
+
+async def ensure_indexes(db):
+    """Create every index the API relies on; returns the names that failed"""
+    failed = []
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                failed.append(f"{collection}.{'_'.join(key for key, _ in keys)}")
+                logger.warning("Could not create index %s on %s: %s", keys, collection, e)
+    for ensure in (ensure_archive_indexes, ensure_cart_indexes, ensure_recommendation_indexes,
+                   ensure_popularity_indexes, ensure_promotion_indexes):
+        try:
+            await ensure(db)
+        except OperationFailure as e:
+            failed.append(ensure.__name__)
+            logger.warning("%s failed: %s", ensure.__name__, e)
+    return failed
@@ -0,0 +1,209 @@
+"""
+Cross-worker cache invalidation bus.
+
+In-process caches (the response cache, and anything registered later) only
+see writes made by their own worker. The bus broadcasts invalidations to
+every worker and node through MongoDB:
+
+* `publish(namespace)` bumps the namespace's version in `cache_versions`,
+  applies the invalidation locally, and appends an event to the capped
+  `cache_invalidations` collection.
+* Each worker follows that collection with a change stream when the
+  deployment supports one (replica set / sharded), or otherwise by polling
+  the capped collection with a tailable-await cursor that waits up to
+  INVALIDATION_POLL_INTERVAL seconds per round trip.
+* Events are versioned per namespace and applied only when newer than what
+  the worker has seen. A periodic reconcile against `cache_versions` catches
+  anything a transport missed, so workers converge within
+  INVALIDATION_RECONCILE_INTERVAL even across restarts or stream errors.
+
+Lag between publish and apply is exported as a histogram.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+
+from pymongo import CursorType, ReturnDocument
+from pymongo.errors import CollectionInvalid, OperationFailure, PyMongoError
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_TRANSPORT = os.environ.get('INVALIDATION_TRANSPORT', 'auto')  # auto, changestream, poll, local
+INVALIDATION_POLL_INTERVAL = float(os.environ.get('INVALIDATION_POLL_INTERVAL', '1.0'))
+INVALIDATION_RECONCILE_INTERVAL = float(os.environ.get('INVALIDATION_RECONCILE_INTERVAL', '30'))
+INVALIDATION_CAPPED_BYTES = int(os.environ.get('INVALIDATION_CAPPED_BYTES', str(1024 * 1024)))
+INVALIDATION_CAPPED_DOCS = int(os.environ.get('INVALIDATION_CAPPED_DOCS', '10000'))
+
+EVENTS_COLLECTION = "cache_invalidations"
+VERSIONS_COLLECTION = "cache_versions"
+
+invalidation_lag = registry.histogram(
+    "cache_invalidation_lag_seconds", "Delay between publishing an invalidation and applying it on this worker",
+    ("transport",), (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0))
+invalidations_applied = registry.counter(
+    "cache_invalidations_applied_total", "Invalidations applied on this worker", ("namespace", "source"))
+invalidations_published = registry.counter(
+    "cache_invalidations_published_total", "Invalidations published by this worker", ("namespace",))
+invalidation_publish_errors = registry.counter(
+    "cache_invalidation_publish_errors_total", "Invalidations that could not be broadcast")
+invalidation_version = registry.gauge(
+    "cache_invalidation_version", "Latest namespace version applied on this worker", ("namespace",))
+
+
+class InvalidationBus:
+    def __init__(self, transport=INVALIDATION_TRANSPORT, poll_interval=INVALIDATION_POLL_INTERVAL,
+                 reconcile_interval=INVALIDATION_RECONCILE_INTERVAL):
+        self.node_id = f"{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(3)}"
+        self.requested_transport = transport
+        self.transport = "local"
+        self.poll_interval = poll_interval
+        self.reconcile_interval = reconcile_interval
+        self._handlers = []
+        self._versions = {}
+        self._db = None
+        self._tasks = []
+
+    def register(self, handler):
+        """handler(namespace) is called whenever a namespace is invalidated"""
+        self._handlers.append(handler)
+
+    def _apply(self, namespace, version, source, published_at=None):
+        if version is not None and version <= self._versions.get(namespace, 0):
+            return False
+        if version is not None:
+            self._versions[namespace] = version
+            invalidation_version.set(version, namespace=namespace)
+        for handler in self._handlers:
+            try:
+                handler(namespace)
+            except Exception:
+                logger.exception("Invalidation handler failed for %s", namespace)
+        invalidations_applied.inc(namespace=namespace, source=source)
+        if published_at is not None:
+            invalidation_lag.observe(max(0.0, time.time() - published_at), transport=source)
+        return True
+
+    async def publish(self, *namespaces):
+        """Invalidate namespaces here and on every other worker"""
+        for namespace in namespaces:
+            invalidations_published.inc(namespace=namespace)
+            if self._db is None:
+                self._apply(namespace, None, "local")
+                continue
+            try:
+                counter = await self._db[VERSIONS_COLLECTION].find_one_and_update(
+                    {"_id": namespace},
+                    {"$inc": {"version": 1}, "$set": {"updated_at": time.time()}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+                version = counter["version"]
+                self._apply(namespace, version, "local")
+                await self._db[EVENTS_COLLECTION].insert_one({
+                    "namespace": namespace,
+                    "version": version,
+                    "origin": self.node_id,
+                    "published_at": time.time(),
+                })
+            except PyMongoError as e:
+                # Local caches are still correct; peers converge on reconcile or TTL
+                invalidation_publish_errors.inc()
+                logger.warning("Could not broadcast invalidation of %s: %s", namespace, e)
+                self._apply(namespace, None, "local")
+
+    def _handle_event(self, event, source):
+        if event.get("origin") == self.node_id:
+            return
+        self._apply(event["namespace"], event.get("version"), source, event.get("published_at"))
+
+    async def start(self, db):
+        """Attach to the database and start following invalidations"""
+        if self.requested_transport == "local":
+            return
+        self._db = db
+        try:
+            await db.create_collection(EVENTS_COLLECTION, capped=True, size=INVALIDATION_CAPPED_BYTES,
+                                       max=INVALIDATION_CAPPED_DOCS)
+        except (CollectionInvalid, OperationFailure):
+            pass  # already exists
+
+        # Start from the current versions so old events are not replayed
+        async for counter in db[VERSIONS_COLLECTION].find():
+            self._versions[counter["_id"]] = counter["version"]
+            invalidation_version.set(counter["version"], namespace=counter["_id"])
+
+        self._tasks = [asyncio.ensure_future(self._follow()), asyncio.ensure_future(self._reconcile_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._tasks = []
+
+    async def _follow(self):
+        if self.requested_transport in ("auto", "changestream"):
+            try:
+                self.transport = "changestream"
+                await self._follow_change_stream()
+                return
+            except OperationFailure as e:
+                if self.requested_transport == "changestream":
+                    raise
+                logger.info("Change streams unavailable (%s); polling %s instead", e, EVENTS_COLLECTION)
+        self.transport = "poll"
+        await self._follow_polling()
+
+    async def _follow_change_stream(self):
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        resume_token = None
+        while True:
+            try:
+                async with self._db[EVENTS_COLLECTION].watch(pipeline, resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self._handle_event(change["fullDocument"], "changestream")
+            except OperationFailure:
+                raise
+            except PyMongoError as e:
+                logger.warning("Invalidation change stream interrupted: %s", e)
+                await asyncio.sleep(self.poll_interval)
+
+    async def _follow_polling(self):
+        collection = self._db[EVENTS_COLLECTION]
+        last = await collection.find_one({}, sort=[("$natural", -1)])
+        last_id = last["_id"] if last else None
+        while True:
+            try:
+                # A tailable cursor keeps its place in insertion order; _id is only
+                # used to reposition after the cursor dies (reconcile covers the gap)
+                query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+                cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                cursor.max_await_time_ms(int(self.poll_interval * 1000))
+                while cursor.alive:
+                    async for event in cursor:
+                        last_id = event["_id"]
+                        self._handle_event(event, "poll")
+            except PyMongoError as e:
+                logger.warning("Invalidation poll failed: %s", e)
+            await asyncio.sleep(self.poll_interval)
+
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                async for counter in self._db[VERSIONS_COLLECTION].find():
+                    self._apply(counter["_id"], counter["version"], "reconcile", counter.get("updated_at"))
+            except PyMongoError as e:
+                logger.warning("Invalidation reconcile failed: %s", e)
+
+
+invalidation_bus = InvalidationBus()
@@ -0,0 +1,183 @@
+"""
+Periodic background jobs shared by every worker.
+
+Jobs are registered with an interval and started with the app. One
+document per job in `job_leases` coordinates workers and nodes:
+
+* `running_until` is the lease of a run in progress. A worker may only
+  start a run when it is unset or expired, and renews it every third of
+  JOB_LEASE_SECONDS while the job runs. A long run keeps its lease, and a
+  run on a crashed worker frees it within JOB_LEASE_SECONDS;
+* `next_run_at` is when the schedule is next due. A successful run pushes
+  it out by most of the interval, so workers whose timers fire shortly
+  after do not rerun the job.
+
+A job can also be triggered on demand (admin endpoint or script) with
+`run()`. Manual runs ignore `next_run_at` and only conflict with a run that
+is actually in progress. Within a worker a per-job lock keeps one run at a
+time.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+from datetime import datetime, timezone
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+LEASES_COLLECTION = "job_leases"
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '60'))
+
+job_runs = registry.counter("background_job_runs_total", "Background job runs", ("job", "outcome"))
+job_duration = registry.histogram(
+    "background_job_duration_seconds", "Background job run time", ("job",),
+    (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0))
+job_last_success = registry.gauge(
+    "background_job_last_success_timestamp_seconds", "Unix time of the last successful run", ("job",))
+
+
+class JobRunner:
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(3)}"
+        self._jobs = {}
+        self._last_results = {}
+        self._locks = {}
+        self._tasks = []
+        self._db = None
+
+    def register(self, name, func, interval, lease_seconds=JOB_LEASE_SECONDS):
+        """func(db) is awaited every `interval` seconds (0 disables scheduling)"""
+        self._jobs[name] = {
+            "func": func,
+            "interval": interval,
+            "lease_seconds": lease_seconds,
+        }
+        self._locks[name] = asyncio.Lock()
+
+    @staticmethod
+    def _expires(seconds):
+        return datetime.fromtimestamp(time.time() + seconds, timezone.utc)
+
+    async def _acquire(self, db, name, run_id, lease_seconds, scheduled):
+        now = datetime.now(timezone.utc)
+        conditions = [{"$or": [{"running_until": None}, {"running_until": {"$lte": now}}]}]
+        if scheduled:
+            conditions.append({"$or": [{"next_run_at": None}, {"next_run_at": {"$lte": now}}]})
+        try:
+            await db[LEASES_COLLECTION].find_one_and_update(
+                {"_id": name, "$and": conditions},
+                {"$set": {"owner": self.owner, "run_id": run_id, "acquired_at": now,
+                          "running_until": self._expires(lease_seconds)}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            return False  # running elsewhere, or (for the schedule) not due yet
+
+    async def _renew(self, db, name, run_id, lease_seconds):
+        """Keep the running lease alive for as long as the job runs"""
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            try:
+                result = await db[LEASES_COLLECTION].update_one(
+                    {"_id": name, "run_id": run_id},
+                    {"$set": {"running_until": self._expires(lease_seconds)}},
+                )
+            except PyMongoError as e:
+                logger.warning("Could not renew the lease of job %s: %s", name, e)
+                continue
+            if result.matched_count == 0:
+                logger.warning("Job %s lost its lease while running; another worker may start it", name)
+                return
+
+    async def _release(self, db, name, run_id, next_run_at=None):
+        update = {"$set": {"running_until": None}}
+        if next_run_at is not None:
+            update["$set"]["next_run_at"] = datetime.fromtimestamp(next_run_at, timezone.utc)
+        await db[LEASES_COLLECTION].update_one({"_id": name, "run_id": run_id}, update)
+
+    def has_job(self, name):
+        return name in self._jobs
+
+    async def run(self, name, db=None, scheduled=False, **kwargs):
+        """
+        Run a job now unless a run is already in progress (here or on another
+        worker); returns its result, or None if skipped. Scheduled runs are
+        also skipped until the job is due.
+        """
+        job = self._jobs[name]
+        if db is None:
+            db = self._db
+        lock = self._locks[name]
+        if lock.locked():
+            job_runs.inc(job=name, outcome="skipped")
+            return None
+        async with lock:
+            run_id = secrets.token_hex(8)
+            if not await self._acquire(db, name, run_id, job["lease_seconds"], scheduled):
+                job_runs.inc(job=name, outcome="skipped")
+                return None
+
+            renewer = asyncio.ensure_future(self._renew(db, name, run_id, job["lease_seconds"]))
+            started = time.perf_counter()
+            try:
+                result = await job["func"](db, **kwargs)
+            except Exception:
+                job_runs.inc(job=name, outcome="error")
+                # Leave next_run_at alone so the next slot retries
+                await self._release(db, name, run_id)
+                raise
+            finally:
+                renewer.cancel()
+                job_duration.observe(time.perf_counter() - started, job=name)
+            job_runs.inc(job=name, outcome="success")
+            job_last_success.set(time.time(), job=name)
+            self._last_results[name] = {"finished_at": datetime.now(timezone.utc), "result": result}
+            # Peers whose timers fire shortly after this run skip their slot
+            await self._release(db, name, run_id, time.time() + job["interval"] * 0.9)
+            return result
+
+    async def _schedule(self, name, interval):
+        # Stagger the first run so workers booting together do not all race for the lease
+        await asyncio.sleep(interval * (0.1 + 0.2 * secrets.randbelow(1000) / 1000))
+        while True:
+            try:
+                await self.run(name, scheduled=True)
+            except PyMongoError as e:
+                logger.warning("Background job %s could not run: %s", name, e)
+            except Exception:
+                logger.exception("Background job %s failed", name)
+            await asyncio.sleep(interval)
+
+    def start(self, db):
+        self._db = db
+        self._tasks = [
+            asyncio.ensure_future(self._schedule(name, job["interval"]))
+            for name, job in self._jobs.items() if job["interval"] > 0
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._tasks = []
+
+    def status(self):
+        return [
+            {"name": name, "interval": job["interval"], "running_here": self._locks[name].locked(),
+             "last_run": self._last_results.get(name)}
+            for name, job in self._jobs.items()
+        ]
+
+
+job_runner = JobRunner()
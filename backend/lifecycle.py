@@ -0,0 +1,95 @@
+"""
+Startup bookkeeping for the app's lifespan.
+
+Startup runs as named phases (connect, indexes, prime, services). Each
+phase is timed, logged and exported as `app_startup_phase_seconds`, and the
+worker only reports ready on /readyz once every phase has finished, so a
+load balancer never routes shoppers to a cold worker. On shutdown the worker
+turns unready first, letting the balancer drain it before connections close.
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from pymongo.errors import PyMongoError
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+MONGO_STARTUP_TIMEOUT = float(os.environ.get('MONGO_STARTUP_TIMEOUT', '30'))
+MONGO_WARM_CONNECTIONS = int(os.environ.get('MONGO_WARM_CONNECTIONS', '4'))
+READINESS_PING_TIMEOUT = float(os.environ.get('READINESS_PING_TIMEOUT', '2'))
+
+startup_phase_seconds = registry.gauge(
+    "app_startup_phase_seconds", "Time spent in each startup phase", ("phase",))
+app_ready = registry.gauge("app_ready", "1 once startup has finished and until shutdown begins")
+
+
+class Lifecycle:
+    def __init__(self):
+        self.ready = False
+        self.phases = {}
+        self.started_at = None
+        self.startup_seconds = None
+
+    @contextmanager
+    def phase(self, name):
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.phases[name] = round(elapsed * 1000, 1)
+            startup_phase_seconds.set(elapsed, phase=name)
+            logger.info("Startup phase %s took %.1f ms", name, elapsed * 1000)
+
+    def mark_ready(self):
+        self.startup_seconds = time.perf_counter() - (self.started_at or time.perf_counter())
+        self.ready = True
+        app_ready.set(1)
+        logger.info("Worker ready after %.1f ms", self.startup_seconds * 1000)
+
+    def mark_draining(self):
+        self.ready = False
+        app_ready.set(0)
+
+    def report(self):
+        return {
+            "ready": self.ready,
+            "startup_ms": round(self.startup_seconds * 1000, 1) if self.startup_seconds is not None else None,
+            "phases": self.phases,
+        }
+
+
+async def verify_mongo(db, timeout=MONGO_STARTUP_TIMEOUT, warm_connections=MONGO_WARM_CONNECTIONS):
+    """Wait for MongoDB to answer, then open a few pooled connections up front"""
+    deadline = time.monotonic() + timeout
+    delay = 0.25
+    while True:
+        try:
+            await db.command("ping")
+            break
+        except PyMongoError as e:
+            if time.monotonic() + delay > deadline:
+                raise
+            logger.warning("MongoDB not reachable yet (%s); retrying in %.2fs", e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5.0)
+    # Concurrent pings force the driver to open that many sockets now rather than on first traffic
+    await asyncio.gather(*(db.command("ping") for _ in range(warm_connections)))
+
+
+async def ping(db, timeout=READINESS_PING_TIMEOUT):
+    try:
+        await asyncio.wait_for(db.command("ping"), timeout)
+        return True
+    except (PyMongoError, asyncio.TimeoutError):
+        return False
+
+
+lifecycle = Lifecycle()
@@ -0,0 +1,256 @@
+"""
+Local media storage for product images.
+
+Starlette spools a multipart upload to a temporary file before the handler
+runs, so the size limit is enforced while the body arrives:
+UploadLimitMiddleware answers 413 as soon as Content-Length, or the bytes
+received so far, exceed MEDIA_MAX_UPLOAD_BYTES. The handler then copies the
+file into the store and resizes it into fixed variants (thumb, card, zoom)
+in a process pool so Pillow never blocks the event loop.
+Each upload gets a fresh id, which makes every stored file immutable: they
+are served with year-long cache headers, ETags and byte-range support.
+
+Layout: MEDIA_ROOT/<image_id>/original.<ext> and <variant>.jpg
+"""
+import asyncio
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+MEDIA_ROOT = Path(os.environ.get('MEDIA_ROOT', Path(__file__).parent / 'media'))
+MEDIA_BASE_URL = os.environ.get('MEDIA_BASE_URL', '/api/media')
+MEDIA_MAX_UPLOAD_BYTES = int(os.environ.get('MEDIA_MAX_UPLOAD_MB', '15')) * 1024 * 1024
+MULTIPART_OVERHEAD_BYTES = 64 * 1024  # boundaries and part headers around the file
+MEDIA_WORKERS = int(os.environ.get('MEDIA_WORKERS', '2'))
+MEDIA_JPEG_QUALITY = int(os.environ.get('MEDIA_JPEG_QUALITY', '82'))
+
+# Longest edge in pixels for each generated variant
+VARIANTS = {"thumb": 160, "card": 480, "zoom": 1600}
+ALLOWED_EXTENSIONS = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}
+CHUNK_SIZE = 1024 * 1024
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_IMAGE_ID = re.compile(r"^[0-9a-f]{32}$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_executor = None
+
+
+def _process_pool():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=MEDIA_WORKERS)
+    return _executor
+
+
+def shutdown_media_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def media_urls(image_id):
+    """Public URLs of every variant of an uploaded image"""
+    return {variant: f"{MEDIA_BASE_URL}/{image_id}/{variant}" for variant in VARIANTS}
+
+
+def image_exists(image_id):
+    return bool(image_id and _IMAGE_ID.match(image_id) and (MEDIA_ROOT / image_id).is_dir())
+
+
+def generate_variants(original_path, output_dir, quality=MEDIA_JPEG_QUALITY):
+    """Resize the original into every variant; runs in a worker process"""
+    from PIL import Image, ImageOps
+
+    results = {}
+    with Image.open(original_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.convert("RGBA").split()[-1])
+            image = background
+        elif image.mode == "L":
+            image = image.convert("RGB")
+        original_size = image.size
+
+        # Largest first so each step resamples from the smallest sufficient source
+        source = image
+        for name, edge in sorted(VARIANTS.items(), key=lambda item: -item[1]):
+            variant = source.copy()
+            variant.thumbnail((edge, edge), Image.LANCZOS)
+            path = Path(output_dir) / f"{name}.jpg"
+            variant.save(path, "JPEG", quality=quality, optimize=True, progressive=True)
+            results[name] = {"width": variant.width, "height": variant.height, "bytes": path.stat().st_size}
+            source = variant
+    return {"width": original_size[0], "height": original_size[1], "variants": results}
+
+
+def _verify_image(path):
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image.verify()
+
+
+async def save_upload(upload):
+    """Copy a (size-checked, already spooled) UploadFile into the store and build its variants"""
+    extension = Path(upload.filename or "").suffix.lower()
+    if extension not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Unsupported image type")
+
+    image_id = uuid.uuid4().hex
+    image_dir = MEDIA_ROOT / image_id
+    image_dir.mkdir(parents=True, exist_ok=False)
+    original_path = image_dir / f"original{extension}"
+    loop = asyncio.get_running_loop()
+
+    try:
+        size = 0
+        with open(original_path, "wb") as f:
+            while chunk := await upload.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > MEDIA_MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="Image is too large")
+                await loop.run_in_executor(None, f.write, chunk)
+
+        pool = _process_pool()
+        try:
+            await loop.run_in_executor(pool, _verify_image, str(original_path))
+        except Exception:
+            raise HTTPException(status_code=400, detail="File is not a valid image")
+        info = await loop.run_in_executor(pool, generate_variants, str(original_path), str(image_dir))
+    except BaseException:
+        shutil.rmtree(image_dir, ignore_errors=True)
+        raise
+    finally:
+        await upload.close()
+
+    return {
+        "image_id": image_id,
+        "width": info["width"],
+        "height": info["height"],
+        "bytes": size,
+        "variants": info["variants"],
+        "images": media_urls(image_id),
+    }
+
+
+def _media_path(image_id, variant):
+    if not _IMAGE_ID.match(image_id):
+        raise HTTPException(status_code=404, detail="Image not found")
+    if variant in VARIANTS:
+        path = MEDIA_ROOT / image_id / f"{variant}.jpg"
+        return path, "image/jpeg"
+    if variant == "original":
+        for extension, media_type in ALLOWED_EXTENSIONS.items():
+            path = MEDIA_ROOT / image_id / f"original{extension}"
+            if path.exists():
+                return path, media_type
+    raise HTTPException(status_code=404, detail="Image not found")
+
+
+def _parse_range(header, file_size):
+    """(start, end) inclusive for a single byte range, None to send the whole file"""
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None  # multi-range or malformed: ignoring Range is allowed
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise HTTPException(status_code=416, detail="Range not satisfiable",
+                                headers={"Content-Range": f"bytes */{file_size}"})
+        return max(0, file_size - length), file_size - 1
+    start = int(first)
+    end = min(int(last), file_size - 1) if last else file_size - 1
+    if start >= file_size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{file_size}"})
+    return start, end
+
+
+async def _read_file(path, start, length):
+    loop = asyncio.get_running_loop()
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await loop.run_in_executor(None, f.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def serve_media(request, image_id, variant):
+    """Serve a stored image with caching headers and single-range support"""
+    path, media_type = _media_path(image_id, variant)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    etag = '"' + hashlib.blake2b(f"{image_id}/{variant}/{stat.st_size}/{stat.st_mtime_ns}".encode(), digest_size=12).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        byte_range = _parse_range(range_header, stat.st_size)
+
+    if byte_range is None:
+        headers["Content-Length"] = str(stat.st_size)
+        return StreamingResponse(_read_file(path, 0, stat.st_size), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    length = end - start + 1
+    headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    headers["Content-Length"] = str(length)
+    return StreamingResponse(_read_file(path, start, length), status_code=206, media_type=media_type, headers=headers)
+
+
+class UploadLimitMiddleware:
+    """Reject oversized upload bodies while they arrive instead of after Starlette has spooled them"""
+
+    def __init__(self, app, path_prefixes, max_bytes=MEDIA_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES):
+        self.app = app
+        self.path_prefixes = tuple(path_prefixes)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", ()):
+            if name == b"content-length":
+                if value.isdigit() and int(value) > self.max_bytes:
+                    response = JSONResponse({"detail": "Image is too large"}, status_code=413)
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive():
+            # Chunked uploads carry no Content-Length; count what actually arrives
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="Image is too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
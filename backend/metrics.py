@@ -0,0 +1,299 @@
+"""
+Request and MongoDB instrumentation.
+
+MetricsMiddleware records per-route latency, response size, in-flight
+requests and the number of Mongo commands each request issued. Mongo
+commands are counted by a pymongo CommandListener; motor runs pymongo on an
+executor but copies the caller's contextvars, so the listener can attribute
+every command to the request that triggered it.
+
+Everything is kept in-process and rendered in Prometheus text format by
+`registry.render()`.
+"""
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+DB_CALL_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def snapshot(self, **labels):
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return None if series is None else {**series, "counts": list(series["counts"])}
+
+    def samples(self):
+        with self._lock:
+            items = [(key, {**series, "counts": list(series["counts"])}) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_number(float(bound))}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            yield f"{self.name}_bucket{labels} {series['count']}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(series['sum'])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {series['count']}"
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them in Prometheus exposition format"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests handled", ("method", "route", "status"))
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+http_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served")
+http_response_size = registry.histogram(
+    "http_response_size_bytes", "HTTP response body size", ("method", "route"), SIZE_BUCKETS)
+http_db_commands = registry.histogram(
+    "http_request_db_commands", "MongoDB commands issued per HTTP request", ("method", "route"), DB_CALL_BUCKETS)
+http_db_budget_exceeded = registry.counter(
+    "http_db_budget_exceeded_total", "Requests that issued more MongoDB commands than their budget", ("method", "route"))
+mongo_commands = registry.counter(
+    "mongodb_commands_total", "MongoDB commands issued", ("command",))
+mongo_command_failures = registry.counter(
+    "mongodb_command_failures_total", "MongoDB commands that failed", ("command",))
+mongo_command_duration = registry.histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ("command",))
+
+
+class RequestStats:
+    """Per-request counters shared with the Mongo command listener"""
+
+    __slots__ = ("db_commands", "db_time")
+
+    def __init__(self):
+        self.db_commands = 0
+        self.db_time = 0.0
+
+
+_request_stats = ContextVar("request_stats", default=None)
+
+
+def current_request_stats():
+    return _request_stats.get()
+
+
+class DBCommandListener(monitoring.CommandListener):
+    """Counts Mongo commands globally and against the current request"""
+
+    def started(self, event):
+        mongo_commands.inc(command=event.command_name)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.db_commands += 1
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        mongo_command_duration.observe(seconds, command=event.command_name)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.db_time += seconds
+
+    def failed(self, event):
+        mongo_command_failures.inc(command=event.command_name)
+        mongo_command_duration.observe(event.duration_micros / 1e6, command=event.command_name)
+
+
+db_command_listener = DBCommandListener()
+
+
+def _parse_budgets(spec):
+    """Parse 'GET /api/cart=3,GET /api/admin/customers=5' into a dict"""
+    budgets = {}
+    for part in filter(None, (item.strip() for item in spec.split(","))):
+        route, _, limit = part.rpartition("=")
+        if route and limit.isdigit():
+            budgets[route.strip()] = int(limit)
+    return budgets
+
+
+DB_CALL_BUDGET = int(os.environ.get('METRICS_DB_CALL_BUDGET', '0'))  # 0 disables budget alerts
+DB_CALL_BUDGETS = _parse_budgets(os.environ.get('METRICS_DB_CALL_BUDGETS', ''))
+
+
+def route_label(scope):
+    """The route template FastAPI matched, e.g. /api/products/{product_id}"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware so streaming responses are measured without buffering"""
+
+    def __init__(self, app, db_call_budget=None, db_call_budgets=None):
+        self.app = app
+        self.db_call_budget = DB_CALL_BUDGET if db_call_budget is None else db_call_budget
+        self.db_call_budgets = DB_CALL_BUDGETS if db_call_budgets is None else db_call_budgets
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status_code = 500
+        response_size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        http_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_in_flight.dec()
+            _request_stats.reset(token)
+            self._record(scope, status_code, elapsed, response_size, stats)
+
+    def _record(self, scope, status_code, elapsed, response_size, stats):
+        method = scope["method"]
+        route = route_label(scope)
+        http_requests.inc(method=method, route=route, status=str(status_code))
+        http_request_duration.observe(elapsed, method=method, route=route)
+        http_response_size.observe(response_size, method=method, route=route)
+        http_db_commands.observe(stats.db_commands, method=method, route=route)
+
+        budget = self.db_call_budgets.get(f"{method} {route}", self.db_call_budget)
+        if budget and stats.db_commands > budget:
+            http_db_budget_exceeded.inc(method=method, route=route)
+            logger.warning(
+                "DB call budget exceeded: %s %s issued %d Mongo commands (budget %d, %.1f ms in Mongo)",
+                method, route, stats.db_commands, budget, stats.db_time * 1000,
+            )
@@ -0,0 +1,153 @@
+"""
+Hot/cold tiering for orders.
+
+Finished orders (delivered, cancelled, rejected) that have not changed for
+ORDER_ARCHIVE_AFTER_DAYS move from `orders` to `orders_archive` in batches of
+ORDER_ARCHIVE_BATCH_SIZE, pausing ORDER_ARCHIVE_PAUSE_SECONDS between batches
+so the job never competes with checkout traffic. Each batch is upserted into
+the archive before it is deleted from `orders`, so an interrupted run leaves
+at worst a duplicate that the next run overwrites, never a lost order.
+
+Readers query the archive only when asked (`include_archived=true`) and
+skip archived copies of orders that are still in the hot collection.
+Customer order history is keyset-paginated newest-first over
+(user_id, created_at, id), merging both collections when the archive is
+included, so page N costs the same as page 1.
+"""
+import asyncio
+import base64
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+
+from metrics import registry
+
+ORDER_ARCHIVE_AFTER_DAYS = float(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS', '180'))
+ORDER_ARCHIVE_BATCH_SIZE = int(os.environ.get('ORDER_ARCHIVE_BATCH_SIZE', '500'))
+ORDER_ARCHIVE_PAUSE_SECONDS = float(os.environ.get('ORDER_ARCHIVE_PAUSE_SECONDS', '1.0'))
+ORDER_ARCHIVE_INTERVAL = float(os.environ.get('ORDER_ARCHIVE_INTERVAL', '3600'))  # 0 disables the schedule
+
+ARCHIVE_COLLECTION = "orders_archive"
+ARCHIVABLE_STATUSES = ["delivered", "cancelled", "rejected"]
+NEWEST_FIRST = [("created_at", DESCENDING), ("id", DESCENDING)]
+
+orders_archived = registry.counter("orders_archived_total", "Orders moved to the archive collection")
+archive_batch_duration = registry.histogram(
+    "orders_archive_batch_duration_seconds", "Time to copy and delete one archive batch", (),
+    (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+
+
+async def ensure_archive_indexes(db):
+    await db.orders.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+    archive = db[ARCHIVE_COLLECTION]
+    await archive.create_index("id", unique=True)
+    await archive.create_index([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)])
+
+
+def archivable_filter(cutoff):
+    return {
+        "status": {"$in": ARCHIVABLE_STATUSES},
+        "created_at": {"$lt": cutoff},
+        "$or": [{"updated_at": None}, {"updated_at": {"$lt": cutoff}}],
+    }
+
+
+async def archive_orders(db, older_than_days=ORDER_ARCHIVE_AFTER_DAYS, batch_size=ORDER_ARCHIVE_BATCH_SIZE,
+                         pause=ORDER_ARCHIVE_PAUSE_SECONDS, max_batches=None):
+    """Move finished orders older than the cutoff into the archive; returns a run summary"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    query = archivable_filter(cutoff)
+    archive = db[ARCHIVE_COLLECTION]
+    moved = batches = 0
+
+    while max_batches is None or batches < max_batches:
+        started = time.perf_counter()
+        orders = await db.orders.find(query, {"_id": 0}).limit(batch_size).to_list(length=batch_size)
+        if not orders:
+            break
+        archived_at = datetime.now(timezone.utc)
+        await archive.bulk_write(
+            [ReplaceOne({"id": order["id"]}, {**order, "archived_at": archived_at}, upsert=True) for order in orders],
+            ordered=False,
+        )
+        # Re-check the filter so an order touched since it was read stays hot
+        result = await db.orders.delete_many({**query, "id": {"$in": [order["id"] for order in orders]}})
+        moved += result.deleted_count
+        batches += 1
+        orders_archived.inc(result.deleted_count)
+        archive_batch_duration.observe(time.perf_counter() - started)
+        if len(orders) < batch_size:
+            break
+        await asyncio.sleep(pause)
+
+    return {"archived": moved, "batches": batches, "cutoff": cutoff}
+
+
+async def find_orders(db, query, include_archived=False, limit=100):
+    """Newest orders matching query from the hot collection, then the archive if requested"""
+    orders = await db.orders.find(query).sort(NEWEST_FIRST).to_list(length=limit)
+    if include_archived and len(orders) < limit:
+        remaining = limit - len(orders)
+        # An order mid-archival can briefly exist in both collections; the hot copy wins
+        seen = {order["id"] for order in orders}
+        archived = {"$and": [query, {"id": {"$nin": list(seen)}}]} if seen else query
+        async for order in db[ARCHIVE_COLLECTION].find(archived).sort(NEWEST_FIRST).limit(remaining):
+            if order["id"] not in seen:
+                seen.add(order["id"])
+                orders.append(order)
+    return orders
+
+
+def encode_cursor(order):
+    position = [order["created_at"].isoformat(), order["id"]]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from an opaque cursor; ValueError if it was tampered with"""
+    try:
+        created_at, order_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), str(order_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+async def page_orders(db, query, limit=20, cursor=None, include_archived=False):
+    """One page of orders newest first; returns (orders, next cursor or None)"""
+    if cursor:
+        created_at, order_id = decode_cursor(cursor)
+        query = {**query, "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": order_id}},
+        ]}
+    sort = NEWEST_FIRST
+    # Fetch one extra row to learn whether another page exists
+    orders = await db.orders.find(query).sort(sort).limit(limit + 1).to_list(length=limit + 1)
+    if include_archived:
+        orders += await db[ARCHIVE_COLLECTION].find(query).sort(sort).limit(limit + 1).to_list(length=limit + 1)
+        # An order mid-archival can briefly exist in both collections
+        orders = list({order["id"]: order for order in orders}.values())
+        orders.sort(key=lambda order: (order["created_at"], order["id"]), reverse=True)
+    page = orders[:limit]
+    return page, encode_cursor(page[-1]) if len(orders) > limit else None
+
+
+async def order_counts(db, include_archived=False):
+    """{user_id: order count} with one aggregation per collection"""
+    by_user = {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+    pipelines = [(db.orders, [by_user])]
+    if include_archived:
+        # Skip archived copies of orders still in the hot collection (joined on its unique id index)
+        pipelines.append((db[ARCHIVE_COLLECTION], [
+            {"$lookup": {"from": "orders", "localField": "id", "foreignField": "id", "as": "hot"}},
+            {"$match": {"hot": {"$size": 0}}},
+            by_user,
+        ]))
+    counts = {}
+    for collection, pipeline in pipelines:
+        async for row in collection.aggregate(pipeline):
+            counts[row["_id"]] = counts.get(row["_id"], 0) + row["count"]
+    return counts
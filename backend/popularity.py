@@ -0,0 +1,165 @@
+"""
+Trending and bestseller rankings from exponentially time-decayed counters.
+
+Every product and category has one document in `popularity` holding two
+decayed scores: `trending` (half-life POPULARITY_TRENDING_HALF_LIFE_HOURS)
+and `bestseller` (half-life POPULARITY_BESTSELLER_HALF_LIFE_DAYS). A score is
+stored together with the time it was last brought up to date (`anchor_at`);
+its current value is score * exp(-rate * (now - anchor_at)). Order events
+update both scores with a single atomic pipeline upsert that decays the old
+value to "now" and adds the event's weight, so concurrent writers from any
+worker never need a shared clock or lock.
+
+Each worker keeps the top POPULARITY_CANDIDATES documents per kind in
+memory, reloaded every POPULARITY_SYNC_SECONDS and bumped locally on its own
+events, and serves rankings from that without touching MongoDB. A nightly
+job re-anchors every document to the current time and drops those that have
+decayed to nothing.
+"""
+import heapq
+import math
+import os
+import time
+
+from pymongo import UpdateOne
+
+from metrics import registry
+
+POPULARITY_TRENDING_HALF_LIFE_HOURS = float(os.environ.get('POPULARITY_TRENDING_HALF_LIFE_HOURS', '48'))
+POPULARITY_BESTSELLER_HALF_LIFE_DAYS = float(os.environ.get('POPULARITY_BESTSELLER_HALF_LIFE_DAYS', '30'))
+POPULARITY_PLACED_WEIGHT = float(os.environ.get('POPULARITY_PLACED_WEIGHT', '1'))
+POPULARITY_ACCEPTED_WEIGHT = float(os.environ.get('POPULARITY_ACCEPTED_WEIGHT', '2'))
+POPULARITY_CANDIDATES = int(os.environ.get('POPULARITY_CANDIDATES', '200'))
+POPULARITY_SYNC_SECONDS = float(os.environ.get('POPULARITY_SYNC_SECONDS', '30'))
+POPULARITY_REANCHOR_INTERVAL = float(os.environ.get('POPULARITY_REANCHOR_INTERVAL', '86400'))  # 0 disables
+POPULARITY_PRUNE_BELOW = float(os.environ.get('POPULARITY_PRUNE_BELOW', '0.001'))
+
+POPULARITY_COLLECTION = "popularity"
+RANKINGS = {
+    "trending": math.log(2) / (POPULARITY_TRENDING_HALF_LIFE_HOURS * 3600),
+    "bestseller": math.log(2) / (POPULARITY_BESTSELLER_HALF_LIFE_DAYS * 86400),
+}
+
+popularity_events = registry.counter("popularity_events_total", "Order events folded into popularity", ("event",))
+popularity_pruned = registry.counter("popularity_pruned_total", "Popularity documents dropped after decaying out")
+
+
+def _decayed(field, rate, now):
+    return {"$multiply": [
+        {"$ifNull": [f"${field}", 0]},
+        {"$exp": {"$multiply": [-rate, {"$subtract": [now, {"$ifNull": ["$anchor_at", now]}]}]}},
+    ]}
+
+
+def _increment(doc_id, kind, key, weight, now, category=None):
+    fields = {ranking: {"$add": [_decayed(ranking, rate, now), weight]} for ranking, rate in RANKINGS.items()}
+    fields.update({"kind": kind, "key": key, "anchor_at": now})
+    if category is not None:
+        fields["category"] = category
+    return UpdateOne({"_id": doc_id}, [{"$set": fields}], upsert=True)
+
+
+class PopularityTracker:
+    def __init__(self, candidates=POPULARITY_CANDIDATES, sync_seconds=POPULARITY_SYNC_SECONDS):
+        self.candidates = candidates
+        self.sync_seconds = sync_seconds
+        # kind -> key -> {"trending", "bestseller", "anchor_at", "category"}
+        self._entries = {"product": {}, "category": {}}
+        self._synced_at = 0.0
+
+    async def record(self, db, lines, event):
+        """
+        Fold order lines into the counters.
+        lines: iterable of (product_id, category, quantity).
+        """
+        weight = POPULARITY_ACCEPTED_WEIGHT if event == "accepted" else POPULARITY_PLACED_WEIGHT
+        products = {}
+        categories = {}
+        for product_id, category, quantity in lines:
+            amount = weight * quantity
+            previous = products.get(product_id, (category, 0))[1]
+            products[product_id] = (category, previous + amount)
+            if category:
+                categories[category] = categories.get(category, 0) + amount
+        if not products:
+            return
+
+        now = time.time()
+        requests = [_increment(f"product:{product_id}", "product", product_id, amount, now, category)
+                    for product_id, (category, amount) in products.items()]
+        requests += [_increment(f"category:{category}", "category", category, amount, now)
+                     for category, amount in categories.items()]
+        await db[POPULARITY_COLLECTION].bulk_write(requests, ordered=False)
+        popularity_events.inc(event=event)
+
+        # Reflect our own writes immediately; other workers' arrive with the next sync
+        for product_id, (category, amount) in products.items():
+            self._bump("product", product_id, amount, now, category)
+        for category, amount in categories.items():
+            self._bump("category", category, amount, now)
+
+    def _bump(self, kind, key, amount, now, category=None):
+        entry = self._entries[kind].get(key)
+        if entry is None:
+            entry = self._entries[kind][key] = {ranking: 0.0 for ranking in RANKINGS}
+            entry["anchor_at"] = now
+        for ranking, rate in RANKINGS.items():
+            entry[ranking] = entry[ranking] * math.exp(-rate * (now - entry["anchor_at"])) + amount
+        entry["anchor_at"] = now
+        if category is not None:
+            entry["category"] = category
+
+    async def sync(self, db):
+        """Reload the best candidates of each kind and ranking from MongoDB"""
+        now = time.time()
+        entries = {"product": {}, "category": {}}
+        for kind in entries:
+            for ranking, rate in RANKINGS.items():
+                pipeline = [
+                    {"$match": {"kind": kind}},
+                    {"$set": {"current": _decayed(ranking, rate, now)}},
+                    {"$sort": {"current": -1}},
+                    {"$limit": self.candidates},
+                    {"$project": {"current": 0}},
+                ]
+                async for doc in db[POPULARITY_COLLECTION].aggregate(pipeline):
+                    entries[kind][doc["key"]] = {
+                        **{name: doc.get(name, 0.0) for name in RANKINGS},
+                        "anchor_at": doc["anchor_at"],
+                        "category": doc.get("category"),
+                    }
+        self._entries = entries
+        self._synced_at = time.monotonic()
+
+    async def top(self, db, kind="product", ranking="trending", limit=10, category=None):
+        """[(key, current score)] best first, served from memory"""
+        if time.monotonic() - self._synced_at > self.sync_seconds:
+            await self.sync(db)
+        rate = RANKINGS[ranking]
+        now = time.time()
+        scored = (
+            (key, entry[ranking] * math.exp(-rate * (now - entry["anchor_at"])))
+            for key, entry in self._entries[kind].items()
+            if category is None or entry.get("category") == category
+        )
+        return [(key, round(score, 4)) for key, score in heapq.nlargest(limit, scored, key=lambda item: item[1])
+                if score > 0]
+
+
+async def reanchor_popularity(db, prune_below=POPULARITY_PRUNE_BELOW):
+    """Decay every counter to now (bounding drift and float growth) and drop negligible ones"""
+    now = time.time()
+    fields = {ranking: _decayed(ranking, rate, now) for ranking, rate in RANKINGS.items()}
+    result = await db[POPULARITY_COLLECTION].update_many({}, [{"$set": {**fields, "anchor_at": now}}])
+    pruned = await db[POPULARITY_COLLECTION].delete_many(
+        {ranking: {"$lt": prune_below} for ranking in RANKINGS}
+    )
+    popularity_pruned.inc(pruned.deleted_count)
+    return {"reanchored": result.modified_count, "pruned": pruned.deleted_count}
+
+
+async def ensure_popularity_indexes(db):
+    await db[POPULARITY_COLLECTION].create_index("kind")
+
+
+popularity = PopularityTracker()
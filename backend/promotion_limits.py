@@ -0,0 +1,98 @@
+"""
+Redemption caps for promotion codes.
+
+A promotion may cap total redemptions (`max_redemptions`) and redemptions
+per customer (`max_redemptions_per_user`). Both caps are enforced at order
+time with conditional atomic increments rather than check-then-write, so
+they hold under any number of concurrent checkouts across workers:
+
+* the global counter (`redemption_count`) lives on the promotion and is
+  only incremented by an update whose filter requires it to be below the
+  cap. Raising or lowering the cap takes effect on the next checkout;
+* per-customer counters live in `promotion_redemptions`, one document per
+  (promotion, user) keyed by _id and incremented with a filtered upsert.
+  At the cap the filter misses and the upsert tries to insert an _id that
+  already exists. A DuplicateKeyError can also mean another checkout of the
+  same customer inserted the document first, so it is retried once as a
+  plain conditional increment; only if that misses is the limit reached.
+
+A reservation that cannot complete is rolled back. Cancelling or rejecting
+an order releases both counters.
+"""
+from pymongo.errors import DuplicateKeyError
+
+from metrics import registry
+
+REDEMPTIONS_COLLECTION = "promotion_redemptions"
+
+promotion_redemptions = registry.counter(
+    "promotion_redemptions_total", "Promotion redemption attempts by outcome", ("result",))
+
+
+class PromotionLimitReached(ValueError):
+    def __init__(self, scope):
+        super().__init__(f"Promotion {scope} redemption limit reached")
+        self.scope = scope  # "global" or "user"
+
+
+def _redemption_id(promotion_id, user_id):
+    return f"{promotion_id}:{user_id}"
+
+
+def _below_cap(promotion_id):
+    return {"id": promotion_id, "$or": [
+        {"max_redemptions": None},
+        {"$expr": {"$lt": [{"$ifNull": ["$redemption_count", 0]}, "$max_redemptions"]}},
+    ]}
+
+
+async def redeem_promotion(db, promotion, user_id):
+    """Reserve one redemption for user_id; raises PromotionLimitReached if either cap is used up"""
+    per_user = promotion.get("max_redemptions_per_user")
+    if per_user is not None:
+        below_user_cap = {"_id": _redemption_id(promotion["id"], user_id), "count": {"$lt": per_user}}
+        try:
+            await db[REDEMPTIONS_COLLECTION].update_one(
+                below_user_cap,
+                {"$inc": {"count": 1}, "$setOnInsert": {"promotion_id": promotion["id"], "user_id": user_id}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Either at the cap or a concurrent first redemption won the insert;
+            # the document exists now, so a plain conditional update decides
+            result = await db[REDEMPTIONS_COLLECTION].update_one(below_user_cap, {"$inc": {"count": 1}})
+            if result.modified_count == 0:
+                promotion_redemptions.inc(result="user_limit")
+                raise PromotionLimitReached("user")
+
+    result = await db.promotions.update_one(_below_cap(promotion["id"]), {"$inc": {"redemption_count": 1}})
+    if result.modified_count == 0:
+        if per_user is not None:
+            await _release_user(db, promotion["id"], user_id)
+        promotion_redemptions.inc(result="global_limit")
+        raise PromotionLimitReached("global")
+    promotion_redemptions.inc(result="redeemed")
+
+
+async def _release_user(db, promotion_id, user_id):
+    await db[REDEMPTIONS_COLLECTION].update_one(
+        {"_id": _redemption_id(promotion_id, user_id), "count": {"$gt": 0}}, {"$inc": {"count": -1}}
+    )
+
+
+async def release_promotion(db, promotion_id, user_id):
+    """Give back a redemption reserved by an order that will not go ahead"""
+    await db.promotions.update_one(
+        {"id": promotion_id, "redemption_count": {"$gt": 0}}, {"$inc": {"redemption_count": -1}}
+    )
+    await _release_user(db, promotion_id, user_id)
+    promotion_redemptions.inc(result="released")
+
+
+async def redemptions_used(db, promotion_id, user_id):
+    doc = await db[REDEMPTIONS_COLLECTION].find_one({"_id": _redemption_id(promotion_id, user_id)})
+    return doc["count"] if doc else 0
+
+
+async def ensure_promotion_indexes(db):
+    await db[REDEMPTIONS_COLLECTION].create_index("promotion_id")
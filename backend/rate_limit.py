@@ -0,0 +1,163 @@
+"""
+Token-bucket rate limiting for abuse-prone endpoints.
+
+Limits are declared per route as route-level dependencies, which FastAPI
+resolves before any parameter dependency (such as get_current_user), so a
+rejected request never reaches MongoDB. Each limit is a bucket of `burst`
+tokens refilled at `per_minute / 60` tokens per second, keyed by client IP,
+authenticated user or a request field (e.g. the login email).
+
+Buckets live in process memory by default. RATE_LIMIT_BACKEND=mongo keeps
+them in the `rate_limits` collection instead, updated with a single atomic
+pipeline upsert per check, so all workers share one budget.
+
+The client IP is the socket peer as uvicorn reports it. serve.py runs with
+proxy_headers, so uvicorn has already replaced the peer with the
+X-Forwarded-For address when (and only when) the connection came from a proxy
+listed in FORWARDED_ALLOW_IPS; the header itself is never read here, or any
+client could pick its own bucket.
+"""
+import math
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from metrics import registry
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # memory, mongo
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+
+rate_limit_checks = registry.counter(
+    "rate_limit_checks_total", "Requests checked against a rate limit", ("limit", "scope"))
+rate_limit_rejections = registry.counter(
+    "rate_limit_rejections_total", "Requests rejected by a rate limit", ("limit", "scope"))
+rate_limit_backend_errors = registry.counter(
+    "rate_limit_backend_errors_total", "Shared rate limit checks that failed open")
+
+
+class MemoryBuckets:
+    """Token buckets in a bounded LRU dict; single event loop, so no locking"""
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def take(self, key, rate, burst):
+        """Consume a token; return 0 if allowed, otherwise seconds until one is available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = 0.0
+        else:
+            retry_after = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+
+class MongoBuckets:
+    """Token buckets shared by every worker, one atomic upsert per check"""
+
+    def __init__(self, db, collection="rate_limits"):
+        self.collection = db[collection]
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key, rate, burst):
+        now = time.time()
+        refilled = {"$min": [burst, {"$add": [
+            {"$ifNull": ["$tokens", burst]},
+            {"$multiply": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, rate]},
+        ]}]}
+        doc = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    # Drop idle buckets once they would have refilled completely
+                    "expires_at": {"$toDate": (now + burst / rate) * 1000},
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc["allowed"]:
+            return 0.0
+        return (1 - doc["tokens"]) / rate
+
+
+def client_ip(request: Request):
+    return request.client.host if request.client else "unknown"
+
+
+class RateLimiter:
+    def __init__(self, enabled=RATE_LIMIT_ENABLED):
+        self.enabled = enabled
+        self.buckets = MemoryBuckets()
+        self._memory = self.buckets
+
+    async def use_shared_backend(self, db):
+        """Switch to MongoDB-backed buckets (RATE_LIMIT_BACKEND=mongo)"""
+        buckets = MongoBuckets(db)
+        await buckets.ensure_indexes()
+        self.buckets = buckets
+
+    async def _take(self, key, rate, burst):
+        try:
+            return await self.buckets.take(key, rate, burst)
+        except PyMongoError:
+            # Fail open on the shared store but keep a per-worker limit in place
+            rate_limit_backend_errors.inc()
+            return await self._memory.take(key, rate, burst)
+
+    def limit(self, name, per_minute, burst, scope="ip", key_func=None):
+        """
+        Route dependency enforcing one bucket.
+
+        scope: "ip", "user" (key_func(request) returns the user id or None),
+        or any label with a key_func that extracts the key from the request.
+        Requests for which no key can be derived are not limited by this bucket.
+        """
+        rate = per_minute / 60.0
+
+        async def check(request: Request):
+            if not self.enabled:
+                return
+            key = client_ip(request) if scope == "ip" else await key_func(request)
+            if not key:
+                return
+            rate_limit_checks.inc(limit=name, scope=scope)
+            retry_after = await self._take(f"{name}:{scope}:{key}", rate, burst)
+            if retry_after > 0:
+                rate_limit_rejections.inc(limit=name, scope=scope)
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many requests, please try again later",
+                    headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+                )
+
+        check.__name__ = f"rate_limit_{name}_{scope}"
+        return check
+
+
+def limit_from_env(name, per_minute, burst):
+    """Defaults overridable with RATE_LIMIT_<NAME>_PER_MINUTE / _BURST"""
+    prefix = f"RATE_LIMIT_{name.upper()}"
+    return (
+        float(os.environ.get(f"{prefix}_PER_MINUTE", per_minute)),
+        int(os.environ.get(f"{prefix}_BURST", burst)),
+    )
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,305 @@
+"""
+"Frequently bought together" recommendations from order history.
+
+A background job turns orders into baskets of product indexes and counts
+co-purchases with NumPy: baskets of equal size are stacked into a matrix,
+every (i < j) column pair is taken at once with triu_indices, and pairs are
+encoded as i * n + j so np.unique counts the whole sparse co-occurrence
+matrix in one pass. Scores are normalized with cosine similarity
+(c_ij / sqrt(n_i * n_j)) or lift (c_ij * N / (n_i * n_j)), and the top
+RECOMMENDATIONS_TOP_K neighbours of every product are stored in
+`product_recommendations`, keyed by product id, for O(1) reads.
+
+Raw counts are kept in `co_purchase_items` / `co_purchase_pairs` so later
+runs only fold in orders placed since the last watermark and rescore the
+products those orders touched. Other workers can commit orders stamped at
+or slightly before the watermark after a run has read past it. So each run
+rereads RECOMMENDATIONS_LOOKBACK_SECONDS behind the watermark and skips the
+order ids already counted in that window (kept in the meta document).
+
+Incremental runs only add. An order cancelled or rejected after it was
+counted keeps contributing until the next full rebuild, every
+RECOMMENDATIONS_REBUILD_HOURS. So does a neighbour whose own popularity
+shifted: it is rescored then too.
+"""
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+
+from metrics import registry
+from order_archive import ARCHIVE_COLLECTION
+
+RECOMMENDATIONS_TOP_K = int(os.environ.get('RECOMMENDATIONS_TOP_K', '12'))
+RECOMMENDATIONS_METRIC = os.environ.get('RECOMMENDATIONS_METRIC', 'cosine')  # cosine, lift
+RECOMMENDATIONS_MIN_SUPPORT = int(os.environ.get('RECOMMENDATIONS_MIN_SUPPORT', '2'))
+RECOMMENDATIONS_MAX_BASKET = int(os.environ.get('RECOMMENDATIONS_MAX_BASKET', '50'))
+RECOMMENDATIONS_INTERVAL = float(os.environ.get('RECOMMENDATIONS_INTERVAL', '900'))  # 0 disables the schedule
+RECOMMENDATIONS_REBUILD_HOURS = float(os.environ.get('RECOMMENDATIONS_REBUILD_HOURS', '24'))
+RECOMMENDATIONS_LOOKBACK_SECONDS = float(os.environ.get('RECOMMENDATIONS_LOOKBACK_SECONDS', '300'))
+
+RECOMMENDATIONS_COLLECTION = "product_recommendations"
+ITEMS_COLLECTION = "co_purchase_items"
+PAIRS_COLLECTION = "co_purchase_pairs"
+META_COLLECTION = "recommendation_meta"
+META_ID = "co_purchase"
+WRITE_BATCH = 1000
+
+EXCLUDED_STATUSES = ["cancelled", "rejected"]
+
+recommendation_builds = registry.counter(
+    "recommendation_builds_total", "Recommendation refreshes", ("mode",))
+recommendation_products = registry.gauge(
+    "recommendation_products", "Products with stored recommendations after the last refresh")
+recommendation_pairs = registry.gauge(
+    "recommendation_pairs", "Distinct co-purchased product pairs counted in the last full rebuild")
+
+
+def order_basket(order):
+    return {item["product_id"] for item in order.get("items", []) if item.get("status") != "rejected"}
+
+
+def count_co_purchases(baskets, n_items, max_basket=RECOMMENDATIONS_MAX_BASKET):
+    """
+    baskets: iterable of lists of product indexes.
+    Returns (item_counts, pair_a, pair_b, pair_counts) with pair_a < pair_b.
+    """
+    by_size = defaultdict(list)
+    singles = []
+    for basket in baskets:
+        basket = sorted(set(basket))
+        singles.extend(basket)
+        if 2 <= len(basket) <= max_basket:
+            by_size[len(basket)].append(basket)
+
+    item_counts = np.bincount(np.asarray(singles, dtype=np.int64), minlength=n_items)
+    keys = []
+    for size, rows in by_size.items():
+        matrix = np.asarray(rows, dtype=np.int64)
+        first, second = np.triu_indices(size, 1)
+        keys.append(matrix[:, first].ravel() * n_items + matrix[:, second].ravel())
+    if not keys:
+        empty = np.empty(0, dtype=np.int64)
+        return item_counts, empty, empty, empty
+    unique, counts = np.unique(np.concatenate(keys), return_counts=True)
+    return item_counts, unique // n_items, unique % n_items, counts
+
+
+def score_pairs(pair_counts, count_a, count_b, total_orders, metric=RECOMMENDATIONS_METRIC):
+    pair_counts = pair_counts.astype(np.float64)
+    denominator = count_a.astype(np.float64) * count_b
+    if metric == "lift":
+        return pair_counts * total_orders / denominator
+    return pair_counts / np.sqrt(denominator)
+
+
+def top_neighbours(source, target, scores, counts, k=RECOMMENDATIONS_TOP_K):
+    """Best k targets per source; inputs are parallel arrays over directed pairs"""
+    if len(source) == 0:
+        return {}
+    order = np.lexsort((-scores, source))
+    source, target, scores, counts = source[order], target[order], scores[order], counts[order]
+    starts = np.flatnonzero(np.r_[True, source[1:] != source[:-1]])
+    rank = np.arange(len(source)) - np.repeat(starts, np.diff(np.r_[starts, len(source)]))
+    keep = rank < k
+    neighbours = defaultdict(list)
+    for src, dst, score, count in zip(source[keep].tolist(), target[keep].tolist(),
+                                      scores[keep].tolist(), counts[keep].tolist()):
+        neighbours[src].append((dst, round(score, 6), count))
+    return neighbours
+
+
+def rank_pairs(pair_a, pair_b, pair_counts, item_counts, total_orders, min_support=RECOMMENDATIONS_MIN_SUPPORT):
+    """Score undirected pairs (by index) and keep the top neighbours in both directions"""
+    supported = pair_counts >= min_support
+    pair_a, pair_b, pair_counts = pair_a[supported], pair_b[supported], pair_counts[supported]
+    scores = score_pairs(pair_counts, item_counts[pair_a], item_counts[pair_b], total_orders)
+    return top_neighbours(
+        np.concatenate([pair_a, pair_b]), np.concatenate([pair_b, pair_a]),
+        np.concatenate([scores, scores]), np.concatenate([pair_counts, pair_counts]),
+    )
+
+
+async def ensure_recommendation_indexes(db):
+    await db[PAIRS_COLLECTION].create_index("a")
+    await db[PAIRS_COLLECTION].create_index("b")
+    await db[RECOMMENDATIONS_COLLECTION].create_index([("updated_at", ASCENDING)])
+
+
+async def _bulk(collection, requests):
+    for start in range(0, len(requests), WRITE_BATCH):
+        await collection.bulk_write(requests[start:start + WRITE_BATCH], ordered=False)
+
+
+async def _store_recommendations(db, neighbours, product_ids, updated_at):
+    requests = [
+        ReplaceOne({"_id": product_ids[src]}, {
+            "related": [{"product_id": product_ids[dst], "score": score, "count": count} for dst, score, count in related],
+            "updated_at": updated_at,
+        }, upsert=True)
+        for src, related in neighbours.items()
+    ]
+    await _bulk(db[RECOMMENDATIONS_COLLECTION], requests)
+    return len(requests)
+
+
+async def _load_baskets(collection, query, skip_ids=()):
+    """Baskets of matching orders not in skip_ids, and the (id, created_at) of every order read"""
+    baskets = []
+    seen = []
+    projection = {"_id": 0, "id": 1, "items.product_id": 1, "items.status": 1, "created_at": 1}
+    async for order in collection.find(query, projection):
+        if order.get("id") in skip_ids:
+            continue
+        basket = order_basket(order)
+        if basket:
+            baskets.append(basket)
+        if order.get("created_at") is not None:
+            seen.append((order.get("id"), order["created_at"]))
+    return baskets, seen
+
+
+def _advance_watermark(seen, previous=None, recent=()):
+    """New watermark and the counted order ids inside the lookback window behind it"""
+    seen = list(recent) + seen
+    watermark = max([created_at for _, created_at in seen] + ([previous] if previous else []), default=None)
+    if watermark is None:
+        return None, []
+    window_start = watermark - timedelta(seconds=RECOMMENDATIONS_LOOKBACK_SECONDS)
+    recent_ids = {order_id: created_at for order_id, created_at in seen if created_at >= window_start}
+    return watermark, [{"id": order_id, "created_at": created_at} for order_id, created_at in recent_ids.items()]
+
+
+def _index_baskets(baskets):
+    index = {}
+    product_ids = []
+    indexed = []
+    for basket in baskets:
+        row = []
+        for product_id in basket:
+            if product_id not in index:
+                index[product_id] = len(product_ids)
+                product_ids.append(product_id)
+            row.append(index[product_id])
+        indexed.append(row)
+    return indexed, product_ids
+
+
+async def rebuild_recommendations(db):
+    """Recount every order and rewrite all stored recommendations"""
+    started_at = datetime.now(timezone.utc)
+    query = {"status": {"$nin": EXCLUDED_STATUSES}}
+    baskets, seen = await _load_baskets(db.orders, query)
+    archived, archived_seen = await _load_baskets(db[ARCHIVE_COLLECTION], query)
+    baskets += archived
+    watermark, recent = _advance_watermark(seen + archived_seen)
+
+    indexed, product_ids = _index_baskets(baskets)
+    item_counts, pair_a, pair_b, pair_counts = count_co_purchases(indexed, len(product_ids))
+    neighbours = rank_pairs(pair_a, pair_b, pair_counts, item_counts, len(baskets))
+
+    await db[ITEMS_COLLECTION].delete_many({})
+    await _bulk(db[ITEMS_COLLECTION], [
+        ReplaceOne({"_id": product_ids[i]}, {"count": int(count)}, upsert=True)
+        for i, count in enumerate(item_counts.tolist())
+    ])
+    await db[PAIRS_COLLECTION].delete_many({})
+    await _bulk(db[PAIRS_COLLECTION], [
+        ReplaceOne({"_id": f"{product_ids[a]}|{product_ids[b]}"},
+                   {"a": product_ids[a], "b": product_ids[b], "count": count}, upsert=True)
+        for a, b, count in zip(pair_a.tolist(), pair_b.tolist(), pair_counts.tolist())
+    ])
+    stored = await _store_recommendations(db, neighbours, product_ids, started_at)
+    # Products that lost every neighbour since the last build
+    await db[RECOMMENDATIONS_COLLECTION].delete_many({"updated_at": {"$lt": started_at}})
+    await db[META_COLLECTION].replace_one({"_id": META_ID}, {
+        "total_orders": len(baskets),
+        "watermark": watermark,
+        "recent": recent,
+        "rebuilt_at": started_at,
+    }, upsert=True)
+
+    recommendation_builds.inc(mode="full")
+    recommendation_products.set(stored)
+    recommendation_pairs.set(len(pair_counts))
+    return {"mode": "full", "orders": len(baskets), "pairs": len(pair_counts), "products": stored}
+
+
+async def refresh_recommendations(db, full=False):
+    """Fold in orders placed since the last run; falls back to a full rebuild when due"""
+    meta = await db[META_COLLECTION].find_one({"_id": META_ID})
+    rebuild_due = datetime.now(timezone.utc) - timedelta(hours=RECOMMENDATIONS_REBUILD_HOURS)
+    if full or meta is None or meta.get("watermark") is None or _aware(meta["rebuilt_at"]) < rebuild_due:
+        return await rebuild_recommendations(db)
+
+    started = time.perf_counter()
+    # >= plus a lookback: late commits stamped at or just before the watermark are still picked up
+    since = meta["watermark"] - timedelta(seconds=RECOMMENDATIONS_LOOKBACK_SECONDS)
+    recent = [(entry["id"], entry["created_at"]) for entry in meta.get("recent", [])]
+    query = {"status": {"$nin": EXCLUDED_STATUSES}, "created_at": {"$gte": since}}
+    baskets, seen = await _load_baskets(db.orders, query, skip_ids={order_id for order_id, _ in recent})
+    watermark, recent = _advance_watermark(seen, meta["watermark"], recent)
+    if not baskets:
+        await db[META_COLLECTION].update_one({"_id": META_ID}, {"$set": {"watermark": watermark, "recent": recent}})
+        return {"mode": "incremental", "orders": 0, "products": 0}
+
+    indexed, product_ids = _index_baskets(baskets)
+    item_counts, pair_a, pair_b, pair_counts = count_co_purchases(indexed, len(product_ids))
+    await db[ITEMS_COLLECTION].bulk_write([
+        UpdateOne({"_id": product_ids[i]}, {"$inc": {"count": int(count)}}, upsert=True)
+        for i, count in enumerate(item_counts.tolist()) if count
+    ], ordered=False)
+    if len(pair_counts):
+        await _bulk(db[PAIRS_COLLECTION], [
+            UpdateOne({"_id": f"{product_ids[a]}|{product_ids[b]}"},
+                      {"$inc": {"count": count}, "$set": {"a": product_ids[a], "b": product_ids[b]}}, upsert=True)
+            for a, b, count in zip(pair_a.tolist(), pair_b.tolist(), pair_counts.tolist())
+        ])
+    total_orders = meta["total_orders"] + len(baskets)
+    await db[META_COLLECTION].update_one(
+        {"_id": META_ID}, {"$set": {"total_orders": total_orders, "watermark": watermark, "recent": recent}}
+    )
+
+    stored = await rescore_products(db, product_ids, total_orders)
+    recommendation_builds.inc(mode="incremental")
+    return {"mode": "incremental", "orders": len(baskets), "products": stored,
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+async def rescore_products(db, affected, total_orders):
+    """Recompute stored neighbours for the given product ids from the raw counts"""
+    affected = list(affected)
+    pairs = await db[PAIRS_COLLECTION].find(
+        {"$or": [{"a": {"$in": affected}}, {"b": {"$in": affected}}]}, {"_id": 0}
+    ).to_list(length=None)
+    index = {}
+    product_ids = []
+    for product_id in affected + [pair["a"] for pair in pairs] + [pair["b"] for pair in pairs]:
+        if product_id not in index:
+            index[product_id] = len(product_ids)
+            product_ids.append(product_id)
+    counts = np.zeros(len(product_ids), dtype=np.int64)
+    async for item in db[ITEMS_COLLECTION].find({"_id": {"$in": product_ids}}):
+        counts[index[item["_id"]]] = item["count"]
+
+    pair_a = np.asarray([index[pair["a"]] for pair in pairs], dtype=np.int64)
+    pair_b = np.asarray([index[pair["b"]] for pair in pairs], dtype=np.int64)
+    pair_counts = np.asarray([pair["count"] for pair in pairs], dtype=np.int64)
+    neighbours = rank_pairs(pair_a, pair_b, pair_counts, counts, total_orders)
+    affected_indexes = {index[product_id] for product_id in affected}
+    neighbours = {src: related for src, related in neighbours.items() if src in affected_indexes}
+    return await _store_recommendations(db, neighbours, product_ids, datetime.now(timezone.utc))
+
+
+def _aware(value):
+    # Mongo returns naive UTC datetimes unless the client is tz_aware
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+async def related_product_ids(db, product_id, limit=RECOMMENDATIONS_TOP_K):
+    """Stored neighbours of a product, best first: a single _id lookup"""
+    doc = await db[RECOMMENDATIONS_COLLECTION].find_one({"_id": product_id}, {"related": {"$slice": limit}})
+    return doc["related"] if doc else []
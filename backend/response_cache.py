@@ -0,0 +1,146 @@
+"""
+In-process cache of serialized JSON responses.
+
+Entries are grouped into namespaces (catalog, categories, settings) that the
+write endpoints invalidate. Each entry keeps the JSON body together with its
+gzip/brotli encodings, computed the first time a client asks for them, so
+compression CPU is paid once per change instead of once per request. Cached
+responses carry an ETag and answer If-None-Match with 304.
+
+Keys come partly from the client (a category filter, a product id), so the
+store is an LRU capped at RESPONSE_CACHE_MAX_ENTRIES; requests for
+arbitrary keys evict cold entries instead of growing worker memory.
+"""
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import Response
+
+from compression import COMPRESSION_MIN_SIZE, compress, negotiate_encoding, supported_encodings
+from metrics import registry
+
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', '300'))  # seconds; 0 disables expiry
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '2000'))
+
+cache_requests = registry.counter(
+    "response_cache_requests_total", "Response cache lookups", ("namespace", "result"))
+cache_invalidations = registry.counter(
+    "response_cache_invalidations_total", "Response cache namespace invalidations", ("namespace",))
+cache_evictions = registry.counter(
+    "response_cache_evictions_total", "Entries dropped to stay under RESPONSE_CACHE_MAX_ENTRIES", ("namespace",))
+
+
+def dump_json(content):
+    """Serialize the same way FastAPI's JSONResponse does"""
+    return json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class CacheEntry:
+    __slots__ = ("body", "etag", "created_at", "encoded")
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        self.created_at = time.monotonic()
+        self.encoded = {}
+
+    def encode(self, encoding):
+        data = self.encoded.get(encoding)
+        if data is None:
+            data = self.encoded[encoding] = compress(self.body, encoding)
+        return data
+
+
+class ResponseCache:
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # least recently used first
+        self._versions = {}
+        self._ttls = {}
+        self._dependents = {}
+
+    def configure(self, namespace, ttl=None, depends_on=()):
+        """Per-namespace TTL, and namespaces whose invalidation also invalidates this one"""
+        if ttl is not None:
+            self._ttls[namespace] = ttl
+        for source in depends_on:
+            self._dependents.setdefault(source, set()).add(namespace)
+
+    def version(self, namespace):
+        return self._versions.get(namespace, 0)
+
+    def get(self, namespace, key):
+        entry = self._entries.get((namespace, key))
+        ttl = self._ttls.get(namespace, self.ttl)
+        if entry is not None and ttl and time.monotonic() - entry.created_at > ttl:
+            self._entries.pop((namespace, key), None)
+            return None
+        if entry is not None:
+            self._entries.move_to_end((namespace, key))
+        return entry
+
+    def put(self, namespace, key, body, version=None):
+        """Store a body unless the namespace was invalidated while it was being built"""
+        entry = CacheEntry(body)
+        if version is None or version == self.version(namespace):
+            self._entries[(namespace, key)] = entry
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                (evicted_namespace, _), _ = self._entries.popitem(last=False)
+                cache_evictions.inc(namespace=evicted_namespace)
+        return entry
+
+    async def prime(self, namespace, key, build):
+        """Build and store an entry ahead of the first request, with its compressed variants"""
+        version = self.version(namespace)
+        entry = self.put(namespace, key, dump_json(await build()), version)
+        if len(entry.body) >= COMPRESSION_MIN_SIZE:
+            for encoding in supported_encodings():
+                entry.encode(encoding)
+        return entry
+
+    def invalidate(self, *namespaces):
+        namespaces = set(namespaces)
+        for namespace in list(namespaces):
+            namespaces.update(self._dependents.get(namespace, ()))
+        for namespace in namespaces:
+            self._versions[namespace] = self.version(namespace) + 1
+            cache_invalidations.inc(namespace=namespace)
+        self._entries = OrderedDict(
+            (cache_key, entry) for cache_key, entry in self._entries.items() if cache_key[0] not in namespaces
+        )
+
+    def clear(self):
+        for namespace in {namespace for namespace, _ in self._entries}:
+            self._versions[namespace] = self.version(namespace) + 1
+        self._entries.clear()
+
+    async def respond(self, request, namespace, key, build, cache_control="no-cache"):
+        """Serve `build()`'s result from cache, negotiated against Accept-Encoding"""
+        entry = self.get(namespace, key)
+        if entry is None:
+            cache_requests.inc(namespace=namespace, result="miss")
+            version = self.version(namespace)
+            entry = self.put(namespace, key, dump_json(await build()), version)
+        else:
+            cache_requests.inc(namespace=namespace, result="hit")
+
+        headers = {"ETag": entry.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if request.headers.get("if-none-match") == entry.etag:
+            return Response(status_code=304, headers=headers)
+
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+        if encoding is None or len(entry.body) < COMPRESSION_MIN_SIZE:
+            return Response(entry.body, media_type="application/json", headers=headers)
+        headers["Content-Encoding"] = encoding
+        return Response(entry.encode(encoding), media_type="application/json", headers=headers)
+
+
+response_cache = ResponseCache()
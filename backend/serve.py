@@ -0,0 +1,152 @@
+"""
+Production launcher for the API.
+
+    python backend/serve.py
+
+Runs uvicorn with one worker process per available CPU (WEB_CONCURRENCY
+overrides), the uvloop event loop and httptools parser when they are
+installed (`pip install uvloop httptools`), and HTTP settings from the
+environment:
+
+    SERVER_HOST, SERVER_PORT          bind address (0.0.0.0:8001)
+    SERVER_BACKLOG                    listen queue length (2048)
+    SERVER_KEEPALIVE_SECONDS          idle keep-alive; keep it above the load
+                                      balancer's idle timeout (65)
+    SERVER_LIMIT_CONCURRENCY          per-worker connection cap before 503 (unset)
+    SERVER_LIMIT_MAX_REQUESTS         recycle a worker after N requests (unset)
+    SERVER_GRACEFUL_TIMEOUT           seconds to drain on shutdown (30)
+    SERVER_ACCESS_LOG                 per-request logging (false)
+    FORWARDED_ALLOW_IPS               proxies trusted for X-Forwarded-* (127.0.0.1)
+
+Every worker opens its own Mongo pool, so MONGO_MAX_CONNECTIONS is a budget
+for the whole server: each worker gets an equal share as
+MONGO_MAX_POOL_SIZE (at least MONGO_MIN_POOL_PER_WORKER) unless that is set
+explicitly. The worker count is capped so the pools never add up to more
+than the budget, and the launcher refuses to start if one explicitly sized
+pool alone exceeds it. Keep the budget under the server's connection limit,
+minus what other clients and replicas use.
+
+Some state is per process, and more than one worker changes what it means:
+
+* rate limits: in-memory buckets would give each worker its own budget, so
+  the launcher defaults RATE_LIMIT_BACKEND to mongo when workers > 1 and
+  warns if it is explicitly set to memory;
+* order events (events.py): a customer's SSE stream and the admin WebSocket
+  feed only receive changes made by the worker they are connected to.
+  Changes made through another worker show up on the next reload;
+* /internal/metrics: each scrape is answered by whichever worker accepts
+  it, so counters jump between workers' values.
+
+The launcher logs a warning for the last two. Where live order updates or
+exact metrics matter, run WEB_CONCURRENCY=1 per container and scale out
+with more containers behind the load balancer.
+"""
+import importlib.util
+import logging
+import os
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent
+
+logger = logging.getLogger("serve")
+
+MONGO_MAX_CONNECTIONS = int(os.environ.get('MONGO_MAX_CONNECTIONS', '400'))
+MONGO_MIN_POOL_PER_WORKER = int(os.environ.get('MONGO_MIN_POOL_PER_WORKER', '10'))
+
+
+def available_cpus():
+    """CPUs this process may run on, which respects taskset and cgroup cpusets"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def worker_count():
+    """Requested workers, capped so every worker's pool fits in MONGO_MAX_CONNECTIONS"""
+    requested = max(1, int(os.environ.get('WEB_CONCURRENCY', available_cpus())))
+    pool_floor = int(os.environ.get('MONGO_MAX_POOL_SIZE') or MONGO_MIN_POOL_PER_WORKER)
+    budget_workers = MONGO_MAX_CONNECTIONS // pool_floor
+    if budget_workers < 1:
+        raise SystemExit(f"A Mongo pool of {pool_floor} does not fit in MONGO_MAX_CONNECTIONS={MONGO_MAX_CONNECTIONS}")
+    if requested > budget_workers:
+        logger.warning("Capping workers at %d (requested %d): MONGO_MAX_CONNECTIONS=%d allows %d pools of %d",
+                       budget_workers, requested, MONGO_MAX_CONNECTIONS, budget_workers, pool_floor)
+    return min(requested, budget_workers)
+
+
+def event_loop():
+    return os.environ.get('SERVER_LOOP') or ("uvloop" if importlib.util.find_spec("uvloop") else "asyncio")
+
+
+def http_protocol():
+    return os.environ.get('SERVER_HTTP') or ("httptools" if importlib.util.find_spec("httptools") else "h11")
+
+
+def pool_size_per_worker(workers):
+    return max(MONGO_MIN_POOL_PER_WORKER, MONGO_MAX_CONNECTIONS // workers)
+
+
+def optional_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def share_worker_state(workers):
+    """Environment defaults and warnings for state that each worker would otherwise keep to itself"""
+    if workers == 1:
+        return
+    # Workers inherit the environment, like MONGO_MAX_POOL_SIZE below
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'mongo')
+    if os.environ['RATE_LIMIT_BACKEND'] != 'mongo':
+        logger.warning("RATE_LIMIT_BACKEND=%s with %d workers: each worker keeps its own buckets, "
+                       "so every rate limit is effectively %d times higher",
+                       os.environ['RATE_LIMIT_BACKEND'], workers, workers)
+    logger.warning("Running %d workers: order event streams and /internal/metrics are per worker "
+                   "(see serve.py); use WEB_CONCURRENCY=1 per container where that matters", workers)
+
+
+def uvicorn_config(workers):
+    return {
+        "app": "server:app",
+        "app_dir": str(BACKEND_DIR),
+        "host": os.environ.get('SERVER_HOST', '0.0.0.0'),
+        "port": int(os.environ.get('SERVER_PORT', '8001')),
+        "workers": workers,
+        "loop": event_loop(),
+        "http": http_protocol(),
+        "backlog": int(os.environ.get('SERVER_BACKLOG', '2048')),
+        "timeout_keep_alive": int(os.environ.get('SERVER_KEEPALIVE_SECONDS', '65')),
+        "limit_concurrency": optional_int('SERVER_LIMIT_CONCURRENCY'),
+        "limit_max_requests": optional_int('SERVER_LIMIT_MAX_REQUESTS'),
+        "timeout_graceful_shutdown": int(os.environ.get('SERVER_GRACEFUL_TIMEOUT', '30')),
+        "access_log": os.environ.get('SERVER_ACCESS_LOG', 'false').lower() == 'true',
+        "proxy_headers": True,
+        "forwarded_allow_ips": os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1'),
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    import uvicorn
+
+    workers = worker_count()
+    share_worker_state(workers)
+    # Workers inherit the environment, so this is how each one learns its pool size
+    os.environ.setdefault('MONGO_MAX_POOL_SIZE', str(pool_size_per_worker(workers)))
+    pool_size = int(os.environ['MONGO_MAX_POOL_SIZE'])
+    checkout_slots = int(os.environ.get('ADMISSION_CHECKOUT_CONCURRENCY', '16'))
+    if checkout_slots >= pool_size:
+        logger.warning("ADMISSION_CHECKOUT_CONCURRENCY (%d) is not below the per-worker Mongo pool (%d); "
+                       "checkout spikes can starve browsing of connections", checkout_slots, pool_size)
+
+    config = uvicorn_config(workers)
+    logger.info("Starting %d worker(s) on %s:%d with loop=%s http=%s, Mongo pool %d per worker (%d total)",
+                workers, config["host"], config["port"], config["loop"], config["http"],
+                pool_size, pool_size * workers)
+    uvicorn.run(**config)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,46 +1,95 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, Response, UploadFile, File, WebSocket, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional
 import uuid
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 import jwt
 # Removed passlib import to avoid bcrypt issues
 import secrets
+from metrics import MetricsMiddleware, db_command_listener, registry as metrics_registry
+from slow_queries import slow_query_sampler
+from tracing import TracingMiddleware, TracingSession, tracer, tracing_command_listener
+from compression import CompressionMiddleware
+from response_cache import response_cache
+from media import UploadLimitMiddleware, image_exists, media_urls, save_upload, serve_media, shutdown_media_pool
+from events import admin_order_feed, order_events
+from invalidation import invalidation_bus
+from rate_limit import RATE_LIMIT_BACKEND, limit_from_env, rate_limiter
+from admission import checkout_gate
+from consistency import CAUSAL_TOKEN_HEADER, ConsistencyMiddleware, ProfiledDatabase, check_route_profiles, use_profile
+import guest_cart
+from jobs import job_runner
+from cart_maintenance import CART_COMPACTION_INTERVAL, compact_cart
+from indexes import ensure_indexes
+from lifecycle import lifecycle, ping, verify_mongo
+from popularity import POPULARITY_REANCHOR_INTERVAL, RANKINGS, popularity, reanchor_popularity
+from recommendations import RECOMMENDATIONS_INTERVAL, RECOMMENDATIONS_TOP_K, refresh_recommendations, related_product_ids
+from promotion_limits import PromotionLimitReached, redeem_promotion, redemptions_used, release_promotion
+from order_archive import ARCHIVE_COLLECTION, ORDER_ARCHIVE_INTERVAL, archive_orders, find_orders, order_counts, page_orders
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))  # Per worker; serve.py splits MONGO_MAX_CONNECTIONS
+client = AsyncIOMotorClient(mongo_url, maxPoolSize=MONGO_MAX_POOL_SIZE,
+                            event_listeners=[db_command_listener, slow_query_sampler, tracing_command_listener])
+# Collections carry the read/write settings of the route's consistency profile (see ROUTE_CONSISTENCY)
+db = ProfiledDatabase(client[os.environ['DB_NAME']])
 
 # Security setup
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 import hashlib
-import razorpay
 SECRET_KEY = os.environ.get('SECRET_KEY', secrets.token_urlsafe(32))
 ALGORITHM = "HS256"
 
 # Razorpay Configuration
 RAZORPAY_KEY_ID = os.environ.get('RAZORPAY_KEY_ID', 'your_test_key_id')
 RAZORPAY_KEY_SECRET = os.environ.get('RAZORPAY_KEY_SECRET', 'your_test_key_secret')
-razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
+_razorpay_client = None
+
+def get_razorpay_client():
+    """Razorpay SDK client, imported on the first payment call to keep worker boot fast"""
+    global _razorpay_client
+    if _razorpay_client is None:
+        import razorpay
+        _razorpay_client = razorpay.Client(session=TracingSession(), auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
+    return _razorpay_client
+
+# Application lifecycle: see start_background_services/stop_background_services below
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_background_services()
+    yield
+    await stop_background_services()
 
 # Create the main app
-app = FastAPI(title="Manira Jewellery API", version="1.0.0")
+app = FastAPI(title="Manira Jewellery API", version="1.0.0", lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 # Pydantic Models
+class OrderStats(BaseModel):
+    """Per-user order summary, kept current with atomic $inc on every order write"""
+    order_count: int = 0
+    lifetime_spend: float = 0  # Totals of orders that were not cancelled or rejected
+    last_order_at: Optional[datetime] = None
+
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     email: EmailStr
@@ -48,6 +97,7 @@ class User(BaseModel):
     full_name: str
     address: Optional[str] = None
     is_admin: bool = False
+    order_stats: OrderStats = Field(default_factory=OrderStats)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class UserCreate(BaseModel):
@@ -56,10 +106,12 @@ class UserCreate(BaseModel):
     phone: str
     full_name: str
     address: Optional[str] = None
+    guest_cart: Optional[str] = None  # Signed guest cart token to merge into the new account
 
 class UserLogin(BaseModel):
     email: EmailStr
     password: str
+    guest_cart: Optional[str] = None  # Signed guest cart token to merge on login
 
 class Product(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -71,9 +123,12 @@ class Product(BaseModel):
     size: Optional[str] = None
     weight: Optional[str] = None
     image_url: str
+    image_id: Optional[str] = None  # Uploaded image in the local media store
+    images: Optional[dict] = None  # Variant URLs: thumb, card, zoom
     inventory_count: int = 0
     sku: Optional[str] = None  # SKU for inventory management
     is_active: bool = True
+    deleted_at: Optional[datetime] = None  # Set when soft-deleted; the document is kept for carts and orders
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class ProductCreate(BaseModel):
@@ -84,7 +139,8 @@ class ProductCreate(BaseModel):
     material: str
     size: Optional[str] = None
     weight: Optional[str] = None
-    image_url: str
+    image_url: str = ""
+    image_id: Optional[str] = None
     inventory_count: int = 0
     sku: Optional[str] = None
 
@@ -96,6 +152,9 @@ class Promotion(BaseModel):
     discount_amount: Optional[float] = None
     applicable_products: List[str] = []  # Product IDs
     min_order_amount: Optional[float] = None
+    max_redemptions: Optional[int] = None  # Across all customers; None means unlimited
+    max_redemptions_per_user: Optional[int] = None
+    redemption_count: int = 0  # Maintained atomically at checkout, see promotion_limits
     start_date: datetime
     end_date: datetime
     is_active: bool = True
@@ -108,13 +167,26 @@ class PromotionCreate(BaseModel):
     discount_amount: Optional[float] = None
     applicable_products: List[str] = []
     min_order_amount: Optional[float] = None
+    max_redemptions: Optional[int] = Field(None, ge=1)
+    max_redemptions_per_user: Optional[int] = Field(None, ge=1)
     start_date: str
     end_date: str
 
+class OrderLine(BaseModel):
+    """Line item snapshot taken at checkout, so orders render without product lookups"""
+    product_id: str
+    name: str = ""
+    sku: Optional[str] = None
+    image: Optional[str] = None  # Thumbnail URL at the time of purchase
+    price: float = 0  # Unit price from the catalogue, never from the client
+    quantity: int = 1
+    status: Optional[str] = None  # accepted/rejected after admin review
+    available: Optional[bool] = None  # Resolved on read: False once the product is deleted
+
 class Order(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
-    items: List[dict]  # [{product_id, quantity, price, status: accepted/rejected}]
+    items: List[OrderLine]
     total_amount: float
     original_amount: Optional[float] = None  # Store original amount for partial orders
     status: str = "pending"  # pending, review, accepted, partially_accepted, rejected, cancelled, shipped, delivered
@@ -124,6 +196,7 @@ class Order(BaseModel):
     payment_status: str = "pending"  # pending, completed, failed
     admin_notes: Optional[str] = None
     promotion_code: Optional[str] = None  # Applied promotion code
+    promotion_id: Optional[str] = None  # Redemption to release if the order is cancelled or rejected
     discount_amount: Optional[float] = 0  # Discount amount applied
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: Optional[datetime] = None
@@ -143,6 +216,13 @@ class CartItem(BaseModel):
     quantity: int = 1
     added_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class GuestCartLine(BaseModel):
+    product_id: str = Field(..., min_length=1)
+    quantity: int = Field(1, ge=1)
+
+class CartQuantity(BaseModel):
+    quantity: int = 1  # 0 or less removes the line
+
 # Helper Functions
 def hash_password(password: str) -> str:
     # Simple SHA256 hash for demo purposes
@@ -151,32 +231,214 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return hashlib.sha256(plain_password.encode()).hexdigest() == hashed_password
 
+def product_image_fields(product_data: ProductCreate) -> dict:
+    """Resolve image_url/images for a product from its uploaded image, if any"""
+    fields = product_data.dict()
+    if product_data.image_id:
+        if not image_exists(product_data.image_id):
+            raise HTTPException(status_code=400, detail="Unknown image_id")
+        fields["images"] = media_urls(product_data.image_id)
+        if not fields["image_url"]:
+            fields["image_url"] = fields["images"]["zoom"]
+    else:
+        fields["images"] = None
+    if not fields["image_url"]:
+        raise HTTPException(status_code=400, detail="image_url or image_id is required")
+    return fields
+
+def order_line(product: dict, quantity: int) -> OrderLine:
+    images = product.get("images") or {}
+    return OrderLine(
+        product_id=product["id"],
+        name=product["name"],
+        sku=product.get("sku"),
+        image=images.get("thumb") or product.get("image_url"),
+        price=product["price"],
+        quantity=quantity
+    )
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+async def user_from_token(token: str) -> User:
+    with tracer.span("auth.get_current_user"):
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            user_id: str = payload.get("sub")
+            if user_id is None:
+                raise HTTPException(status_code=401, detail="Invalid token")
+        except jwt.PyJWTError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        
+        user = await db.users.find_one({"id": user_id})
+        if user is None:
+            raise HTTPException(status_code=401, detail="User not found")
+        return User(**user)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await user_from_token(credentials.credentials)
+
+async def get_stream_user(token: Optional[str] = None, credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """Auth for EventSource/WebSocket clients, which cannot set headers: accept ?token= too"""
+    if credentials:
+        return await user_from_token(credentials.credentials)
+    if token:
+        return await user_from_token(token)
+    raise HTTPException(status_code=401, detail="Not authenticated")
+
+async def record_popularity(items: list, event: str, categories: Optional[dict] = None):
+    """Feed order lines into the trending/bestseller counters; never fails the order itself"""
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    
-    user = await db.users.find_one({"id": user_id})
-    if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
-    return User(**user)
+        if categories is None:
+            product_ids = list({item["product_id"] for item in items})
+            categories = {
+                product["id"]: product.get("category")
+                for product in await db.products.find(
+                    {"id": {"$in": product_ids}}, {"_id": 0, "id": 1, "category": 1}
+                ).to_list(length=len(product_ids))
+            }
+        await popularity.record(
+            db, [(item["product_id"], categories.get(item["product_id"]), item["quantity"]) for item in items], event
+        )
+    except PyMongoError as e:
+        logger.warning("Could not record %s popularity: %s", event, e)
+
+async def adjust_order_stats(user_id: str, count: int = 0, spend: float = 0, placed_at: Optional[datetime] = None):
+    if placed_at is None:
+        await db.users.update_one(
+            {"id": user_id}, {"$inc": {"order_stats.order_count": count, "order_stats.lifetime_spend": spend}}
+        )
+        return
+    # A conditional $set rather than $max: new users store last_order_at as null,
+    # and the filter treats null, missing and older dates alike on every backend
+    await db.users.bulk_write([
+        UpdateOne({"id": user_id}, {"$inc": {"order_stats.order_count": count, "order_stats.lifetime_spend": spend}}),
+        UpdateOne(
+            {"id": user_id, "$or": [
+                {"order_stats.last_order_at": None}, {"order_stats.last_order_at": {"$lt": placed_at}},
+            ]},
+            {"$set": {"order_stats.last_order_at": placed_at}},
+        ),
+    ], ordered=False)
+
+async def release_deleted_order_stats(orders: list):
+    """Take deleted orders out of their owners' summaries, one bulk write for all users"""
+    deltas = {}
+    for order in orders:
+        count, spend = deltas.get(order["user_id"], (0, 0))
+        refunded = order["status"] in ("cancelled", "rejected")
+        deltas[order["user_id"]] = (count - 1, spend - (0 if refunded else order.get("total_amount", 0)))
+    if deltas:
+        await db.users.bulk_write([
+            UpdateOne({"id": user_id}, {"$inc": {"order_stats.order_count": count, "order_stats.lifetime_spend": spend}})
+            for user_id, (count, spend) in deltas.items()
+        ], ordered=False)
+
+def publish_order_change(user_id: str, order_id: str, changes: dict):
+    """Push an order status/payment change to the customer's streams and the admin feed"""
+    order_events.publish(user_id, "order.updated", {"order_id": order_id, **changes})
+    admin_order_feed.order_updated(order_id, changes)
 
 async def get_admin_user(current_user: User = Depends(get_current_user)):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
+async def token_subject(request: Request) -> Optional[str]:
+    """User id from the bearer token, without a database lookup"""
+    authorization = request.headers.get("authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        return jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except jwt.PyJWTError:
+        return None
+
+async def request_email(request: Request) -> Optional[str]:
+    """Email field of a JSON body (the body is cached for the endpoint)"""
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    if not isinstance(body, dict) or not body.get("email"):
+        return None
+    return str(body["email"]).strip().lower()
+
+async def hydrate_cart(quantities: dict) -> list:
+    """[{product, quantity, available}] for {product_id: quantity}, with one batched product query"""
+    if not quantities:
+        return []
+    products = await db.products.find({"id": {"$in": list(quantities)}}).to_list(length=len(quantities))
+    by_id = {product["id"]: product for product in products}
+    return [
+        {
+            "product": Product(**by_id[product_id]),
+            "quantity": quantity,
+            "available": by_id[product_id].get("is_active", True)
+        }
+        for product_id, quantity in quantities.items()
+        if product_id in by_id
+    ]
+
+async def resolve_line_availability(orders: list) -> list:
+    """Flag order lines whose product has been deleted, with one query for all orders"""
+    product_ids = {item["product_id"] for order in orders for item in order["items"]}
+    if not product_ids:
+        return orders
+    active = {
+        product["id"]
+        for product in await db.products.find(
+            {"id": {"$in": list(product_ids)}, "is_active": True}, {"_id": 0, "id": 1}
+        ).to_list(length=len(product_ids))
+    }
+    for order in orders:
+        for item in order["items"]:
+            item["available"] = item["product_id"] in active
+    return orders
+
+async def get_guest_cart(x_guest_cart: Optional[str] = Header(None)) -> dict:
+    """Guest cart from the X-Guest-Cart header; verified by signature only"""
+    try:
+        return guest_cart.decode_cart(x_guest_cart, SECRET_KEY)
+    except guest_cart.InvalidGuestCart as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def merge_guest_cart(user_id: str, token: Optional[str]) -> int:
+    """Fold a guest cart into db.cart in a single bulk write; returns the number of lines merged"""
+    try:
+        items = guest_cart.decode_cart(token, SECRET_KEY)
+    except guest_cart.InvalidGuestCart as e:
+        # A stale or tampered cart must never block authentication
+        logger.warning("Ignoring guest cart for user %s: %s", user_id, e)
+        return 0
+    if not items:
+        return 0
+    
+    now = datetime.now(timezone.utc)
+    await db.cart.bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "product_id": product_id},
+            {"$inc": {"quantity": quantity}, "$set": {"added_at": now}},
+            upsert=True,
+        )
+        for product_id, quantity in items.items()
+    ], ordered=False)
+    return len(items)
+
+# Rate limits: route-level dependencies run before get_current_user or any DB work
+login_ip_limit = Depends(rate_limiter.limit("login", *limit_from_env("login", 20, 10)))
+login_account_limit = Depends(rate_limiter.limit(
+    "login_account", *limit_from_env("login_account", 10, 5), scope="email", key_func=request_email))
+register_ip_limit = Depends(rate_limiter.limit("register", *limit_from_env("register", 5, 5)))
+promotion_user_limit = Depends(rate_limiter.limit(
+    "promotion", *limit_from_env("promotion", 10, 5), scope="user", key_func=token_subject))
+promotion_ip_limit = Depends(rate_limiter.limit("promotion_ip", *limit_from_env("promotion_ip", 30, 15)))
+checkout_admission = Depends(checkout_gate.guard(SECRET_KEY, token_subject))
+
 # Authentication Routes
-@api_router.post("/auth/register", response_model=dict)
+@api_router.post("/auth/register", response_model=dict, dependencies=[register_ip_limit])
 async def register(user_data: UserCreate):
     # Check if user already exists
     existing_user = await db.users.find_one({"email": user_data.email})
@@ -187,30 +449,43 @@ async def register(user_data: UserCreate):
     hashed_password = hash_password(user_data.password)
     user_dict = user_data.dict()
     del user_dict["password"]
+    del user_dict["guest_cart"]
     user = User(**user_dict)
     
     # Store in database
     user_doc = user.dict()
     user_doc["hashed_password"] = hashed_password
     await db.users.insert_one(user_doc)
+    merged = await merge_guest_cart(user.id, user_data.guest_cart)
     
     # Create token
     token = create_access_token(data={"sub": user.id})
-    return {"access_token": token, "token_type": "bearer", "user": user}
+    return {"access_token": token, "token_type": "bearer", "user": user, "guest_cart_merged": merged}
 
-@api_router.post("/auth/login", response_model=dict)
+@api_router.post("/auth/login", response_model=dict, dependencies=[login_ip_limit, login_account_limit])
 async def login(login_data: UserLogin):
     user_doc = await db.users.find_one({"email": login_data.email})
     if not user_doc or not verify_password(login_data.password, user_doc["hashed_password"]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     user = User(**user_doc)
+    merged = await merge_guest_cart(user.id, login_data.guest_cart)
     token = create_access_token(data={"sub": user.id})
-    return {"access_token": token, "token_type": "bearer", "user": user}
+    return {"access_token": token, "token_type": "bearer", "user": user, "guest_cart_merged": merged}
+
+def on_primary(build):
+    """
+    Cache fill for a catalog route: the route reads secondaries, but a fill after an
+    invalidation must see the write behind it, or the stale body is pinned for the TTL.
+    Fills are rare, so the primary only sees one read per key per change.
+    """
+    async def fill():
+        with use_profile("primary"):
+            return await build()
+    return fill
 
 # Product Routes
-@api_router.get("/products", response_model=List[Product])
-async def get_products(category: Optional[str] = None):
+async def load_products(category: Optional[str] = None):
     filter_dict = {"is_active": True}
     if category:
         filter_dict["category"] = category
@@ -218,17 +493,56 @@ async def get_products(category: Optional[str] = None):
     products = await db.products.find(filter_dict).to_list(length=100)
     return [Product(**product) for product in products]
 
-@api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
+@api_router.get("/products", response_model=List[Product])
+async def get_products(request: Request, category: Optional[str] = None):
+    return await response_cache.respond(request, "catalog", f"products:{category or ''}", on_primary(lambda: load_products(category)))
+
+async def load_product(product_id: str):
     product = await db.products.find_one({"id": product_id, "is_active": True})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     return Product(**product)
 
+# Declared before /products/{product_id} so "trending" is not taken for an id
+@api_router.get("/products/trending")
+async def get_trending_products(ranking: str = "trending", category: Optional[str] = None, limit: int = 10):
+    """Products ranked by time-decayed sales: ranking=trending (recent) or bestseller (long-run)"""
+    if ranking not in RANKINGS:
+        raise HTTPException(status_code=400, detail=f"ranking must be one of: {', '.join(RANKINGS)}")
+    return await load_trending(ranking, category, max(1, min(limit, 50)))
+
+async def load_trending(ranking: str = "trending", category: Optional[str] = None, limit: int = 10):
+    ranked = await popularity.top(db, "product", ranking, limit, category)
+    if not ranked:
+        return []
+    product_ids = [product_id for product_id, _ in ranked]
+    products = await db.products.find({"id": {"$in": product_ids}, "is_active": True}).to_list(length=len(product_ids))
+    by_id = {product["id"]: product for product in products}
+    return [
+        {"product": Product(**by_id[product_id]), "score": score}
+        for product_id, score in ranked if product_id in by_id
+    ]
+
+@api_router.get("/products/{product_id}", response_model=Product)
+async def get_product(product_id: str, request: Request):
+    return await response_cache.respond(request, "catalog", f"product:{product_id}", on_primary(lambda: load_product(product_id)))
+
+@api_router.get("/products/{product_id}/related", response_model=List[Product])
+async def get_related_products(product_id: str, limit: int = 8):
+    """Frequently bought together, from the precomputed co-purchase table"""
+    related = await related_product_ids(db, product_id, max(1, min(limit, RECOMMENDATIONS_TOP_K)))
+    if not related:
+        return []
+    related_ids = [entry["product_id"] for entry in related]
+    products = await db.products.find({"id": {"$in": related_ids}, "is_active": True}).to_list(length=len(related_ids))
+    by_id = {product["id"]: product for product in products}
+    return [Product(**by_id[related_id]) for related_id in related_ids if related_id in by_id]
+
 @api_router.post("/admin/products", response_model=Product)
 async def create_product(product_data: ProductCreate, admin_user: User = Depends(get_admin_user)):
-    product = Product(**product_data.dict())
+    product = Product(**product_image_fields(product_data))
     await db.products.insert_one(product.dict())
+    await invalidation_bus.publish("catalog")
     return product
 
 @api_router.put("/admin/products/{product_id}", response_model=Product)
@@ -237,12 +551,24 @@ async def update_product(product_id: str, product_data: ProductCreate, admin_use
     if not product_doc:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    updated_data = product_data.dict()
+    updated_data = product_image_fields(product_data)
     await db.products.update_one({"id": product_id}, {"$set": updated_data})
+    await invalidation_bus.publish("catalog")
     
     updated_product = await db.products.find_one({"id": product_id})
     return Product(**updated_product)
 
+# Media Routes
+@api_router.post("/admin/media")
+async def upload_media(file: UploadFile = File(...), admin_user: User = Depends(get_admin_user)):
+    """Upload a product image and generate its resized variants"""
+    return await save_upload(file)
+
+@api_router.get("/media/{image_id}/{variant}")
+async def get_media(image_id: str, variant: str, request: Request):
+    """Serve an image variant with long-lived caching and Range support"""
+    return serve_media(request, image_id, variant)
+
 # Cart Routes
 @api_router.post("/cart/add")
 async def add_to_cart(item: dict, current_user: User = Depends(get_current_user)):
@@ -251,42 +577,19 @@ async def add_to_cart(item: dict, current_user: User = Depends(get_current_user)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Check if item already in cart
-    existing_item = await db.cart.find_one({"user_id": current_user.id, "product_id": item["product_id"]})
-    
-    if existing_item:
-        # Update quantity
-        new_quantity = existing_item["quantity"] + item.get("quantity", 1)
-        await db.cart.update_one(
-            {"user_id": current_user.id, "product_id": item["product_id"]},
-            {"$set": {"quantity": new_quantity}}
-        )
-    else:
-        # Add new item
-        cart_item = CartItem(
-            user_id=current_user.id,
-            product_id=item["product_id"],
-            quantity=item.get("quantity", 1)
-        )
-        await db.cart.insert_one(cart_item.dict())
+    # Add the line or bump its quantity in one upsert; added_at tracks last activity for cart expiry
+    await db.cart.update_one(
+        {"user_id": current_user.id, "product_id": item["product_id"]},
+        {"$inc": {"quantity": item.get("quantity", 1)}, "$set": {"added_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
     
     return {"message": "Item added to cart"}
 
 @api_router.get("/cart")
 async def get_cart(current_user: User = Depends(get_current_user)):
     cart_items = await db.cart.find({"user_id": current_user.id}).to_list(length=100)
-    
-    # Get product details for each cart item
-    enriched_cart = []
-    for item in cart_items:
-        product = await db.products.find_one({"id": item["product_id"]})
-        if product:
-            enriched_cart.append({
-                "product": Product(**product),
-                "quantity": item["quantity"]
-            })
-    
-    return enriched_cart
+    return await hydrate_cart({item["product_id"]: item["quantity"] for item in cart_items})
 
 # Additional Cart Routes
 @api_router.delete("/cart/{product_id}")
@@ -304,7 +607,7 @@ async def update_cart_quantity(product_id: str, quantity_data: dict, current_use
     
     result = await db.cart.update_one(
         {"user_id": current_user.id, "product_id": product_id},
-        {"$set": {"quantity": quantity}}
+        {"$set": {"quantity": quantity, "added_at": datetime.now(timezone.utc)}}
     )
     
     if result.matched_count == 0:
@@ -312,51 +615,160 @@ async def update_cart_quantity(product_id: str, quantity_data: dict, current_use
     
     return {"message": "Quantity updated"}
 
+# Guest Cart Routes: the cart lives in a signed token the client sends back as X-Guest-Cart
+@api_router.get("/guest-cart")
+async def get_guest_cart_items(items: dict = Depends(get_guest_cart)):
+    return await hydrate_cart(items)
+
+@api_router.post("/guest-cart/add")
+async def add_to_guest_cart(item: GuestCartLine, items: dict = Depends(get_guest_cart)):
+    try:
+        items = guest_cart.add_item(items, item.product_id, item.quantity)
+    except guest_cart.InvalidGuestCart as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Item added to cart", "guest_cart": guest_cart.encode_cart(items, SECRET_KEY)}
+
+@api_router.delete("/guest-cart/{product_id}")
+async def remove_from_guest_cart(product_id: str, items: dict = Depends(get_guest_cart)):
+    try:
+        items = guest_cart.set_quantity(items, product_id, 0)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Item not found in cart")
+    return {"message": "Item removed from cart", "guest_cart": guest_cart.encode_cart(items, SECRET_KEY)}
+
+@api_router.put("/guest-cart/{product_id}")
+async def update_guest_cart_quantity(product_id: str, quantity_data: CartQuantity, items: dict = Depends(get_guest_cart)):
+    try:
+        items = guest_cart.set_quantity(items, product_id, quantity_data.quantity)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Item not found in cart")
+    return {"message": "Quantity updated", "guest_cart": guest_cart.encode_cart(items, SECRET_KEY)}
+
 # Order Routes
-@api_router.post("/orders", response_model=Order)
+@api_router.post("/orders", response_model=Order, dependencies=[checkout_admission])
 async def create_order(order_data: OrderCreate, current_user: User = Depends(get_current_user)):
-    # Calculate original total amount
-    original_total = 0
-    for item in order_data.items:
-        product = await db.products.find_one({"id": item["product_id"]})
-        if product:
-            original_total += product["price"] * item["quantity"]
-    
-    # Apply promotion discount if provided
-    final_total = original_total
-    discount_amount = order_data.discount_amount or 0
-    
-    if order_data.promotion_code and discount_amount > 0:
-        final_total = max(0, original_total - discount_amount)
+    # Snapshot every line from the catalogue in one query; prices never come from the client
+    with tracer.span("orders.price_items", items=len(order_data.items)):
+        quantities = {}
+        for item in order_data.items:
+            quantity = int(item.get("quantity", 1))
+            if quantity <= 0:
+                raise HTTPException(status_code=400, detail="Quantity must be positive")
+            quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + quantity
+        products = await db.products.find(
+            {"id": {"$in": list(quantities)}, "is_active": True}
+        ).to_list(length=len(quantities))
+        by_id = {product["id"]: product for product in products}
+        missing = [product_id for product_id in quantities if product_id not in by_id]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Products no longer available: {', '.join(missing)}")
+        lines = [order_line(by_id[product_id], quantity) for product_id, quantity in quantities.items()]
+        original_total = sum(line.price * line.quantity for line in lines)
+    
+    # Apply promotion discount if provided; the discount is recomputed here, never taken from the client
+    promotion = None
+    discount_amount = 0
+    if order_data.promotion_code:
+        promotion = await find_active_promotion(order_data.promotion_code)
+        if not promotion:
+            raise HTTPException(status_code=400, detail="Invalid or expired promotion code")
+        if promotion.get("min_order_amount") and original_total < promotion["min_order_amount"]:
+            raise HTTPException(status_code=400, detail=f"Minimum order amount is ₹{promotion['min_order_amount']}")
+        discount_amount = promotion_discount(promotion, original_total)
+    final_total = max(0, original_total - discount_amount)
     
     # Create order with promotion details
     order = Order(
         user_id=current_user.id,
-        items=order_data.items,
+        items=lines,
         total_amount=final_total,  # Final amount after discount
         original_amount=original_total if discount_amount > 0 else None,  # Original before discount
         shipping_address=order_data.shipping_address,
         phone=order_data.phone,
-        promotion_code=order_data.promotion_code,
+        promotion_code=promotion["code"] if promotion else None,
+        promotion_id=promotion["id"] if promotion else None,
         discount_amount=discount_amount
     )
     
-    await db.orders.insert_one(order.dict())
+    if promotion:
+        try:
+            await redeem_promotion(db, promotion, current_user.id)
+        except PromotionLimitReached as e:
+            detail = ("You have already used this promotion code the maximum number of times" if e.scope == "user"
+                      else "This promotion code has been fully redeemed")
+            raise HTTPException(status_code=400, detail=detail)
+    try:
+        await db.orders.insert_one(order.dict())
+    except PyMongoError:
+        if promotion:
+            await release_promotion(db, promotion["id"], current_user.id)
+        raise
+    await adjust_order_stats(current_user.id, 1, order.total_amount, order.created_at)
+    admin_order_feed.order_created(order)
+    await record_popularity(
+        [line.dict() for line in lines], "placed",
+        {product_id: product.get("category") for product_id, product in by_id.items()}
+    )
     
     # Clear cart after order
-    await db.cart.delete_many({"user_id": current_user.id})
+    with tracer.span("orders.clear_cart"):
+        await db.cart.delete_many({"user_id": current_user.id})
     
     return order
 
+@api_router.get("/orders/events")
+async def order_event_stream(request: Request, current_user: User = Depends(get_stream_user)):
+    """Server-Sent Events stream of status and payment changes to the user's orders"""
+    return StreamingResponse(
+        order_events.stream(current_user.id, request.headers.get("last-event-id")),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api_router.get("/orders", response_model=List[Order])
-async def get_user_orders(current_user: User = Depends(get_current_user)):
-    orders = await db.orders.find({"user_id": current_user.id}).to_list(length=100)
-    return [Order(**order) for order in orders]
+async def get_user_orders(response: Response, limit: int = 20, cursor: Optional[str] = None,
+                          include_archived: bool = False, current_user: User = Depends(get_current_user)):
+    """Order history newest first; pass the X-Next-Cursor header back as ?cursor= for the next page"""
+    try:
+        orders, next_cursor = await page_orders(
+            db, {"user_id": current_user.id}, max(1, min(limit, 100)), cursor, include_archived
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [Order(**order) for order in await resolve_line_availability(orders)]
+
+@api_router.get("/orders/summary", response_model=OrderStats)
+async def get_order_summary(current_user: User = Depends(get_current_user)):
+    """Order count, lifetime spend and last order date, straight from the user record"""
+    return current_user.order_stats
 
 @api_router.get("/admin/orders", response_model=List[Order])
-async def get_all_orders(admin_user: User = Depends(get_admin_user)):
-    orders = await db.orders.find().to_list(length=100)
-    return [Order(**order) for order in orders]
+async def get_all_orders(include_archived: bool = False, admin_user: User = Depends(get_admin_user)):
+    orders = await find_orders(db, {}, include_archived)
+    return [Order(**order) for order in await resolve_line_availability(orders)]
+
+@api_router.websocket("/admin/orders/feed")
+async def admin_orders_feed(websocket: WebSocket, token: Optional[str] = None):
+    """Live order feed for admins: a snapshot, then incremental diffs"""
+    try:
+        user = await user_from_token(token or "")
+    except HTTPException:
+        await websocket.close(code=1008, reason="Invalid token")
+        return
+    if not user.is_admin:
+        await websocket.close(code=1008, reason="Admin access required")
+        return
+    
+    await websocket.accept()
+    
+    async def load_snapshot():
+        # Same newest-first page as GET /api/admin/orders, so the dashboard shows the same list
+        orders = await find_orders(db, {})
+        return [Order(**order) for order in await resolve_line_availability(orders)]
+    
+    await admin_order_feed.serve(websocket, load_snapshot)
 
 # Order Management Endpoints
 @api_router.put("/admin/orders/{order_id}/review")
@@ -422,7 +834,26 @@ async def review_order(order_id: str, review_data: dict, admin_user: User = Depe
         update_data["original_amount"] = order["total_amount"]
         update_data["total_amount"] = new_total
     
-    await db.orders.update_one({"id": order_id}, {"$set": update_data})
+    result = await db.orders.update_one(
+        {"id": order_id, "status": {"$in": ["pending", "review"]}}, {"$set": update_data}
+    )
+    if result.modified_count == 0:
+        raise HTTPException(status_code=400, detail="Order cannot be modified in current status")
+    if action == "partial":
+        await adjust_order_stats(order["user_id"], spend=new_total - order["total_amount"])
+    elif action == "reject":
+        await adjust_order_stats(order["user_id"], spend=-order["total_amount"])
+        if order.get("promotion_id"):
+            await release_promotion(db, order["promotion_id"], order["user_id"])
+    await record_popularity([item for item in updated_items if item.get("status") == "accepted"], "accepted")
+    publish_order_change(order["user_id"], order_id, {
+        "status": new_status,
+        "items": updated_items,
+        "total_amount": update_data.get("total_amount", order["total_amount"]),
+        "original_amount": update_data.get("original_amount", order.get("original_amount")),
+        "admin_notes": admin_notes,
+        "updated_at": update_data["updated_at"]
+    })
     
     return {"message": f"Order {action}ed successfully", "new_total": new_total}
 
@@ -436,15 +867,22 @@ async def cancel_order(order_id: str, current_user: User = Depends(get_current_u
     if order["status"] not in ["pending", "review"]:
         raise HTTPException(status_code=400, detail="Order cannot be cancelled in current status")
     
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {"status": "cancelled", "updated_at": datetime.now(timezone.utc)}}
+    cancelled_at = datetime.now(timezone.utc)
+    result = await db.orders.update_one(
+        {"id": order_id, "status": {"$in": ["pending", "review"]}},
+        {"$set": {"status": "cancelled", "updated_at": cancelled_at}}
     )
+    if result.modified_count == 0:
+        raise HTTPException(status_code=400, detail="Order cannot be cancelled in current status")
+    await adjust_order_stats(current_user.id, spend=-order["total_amount"])
+    if order.get("promotion_id"):
+        await release_promotion(db, order["promotion_id"], current_user.id)
+    publish_order_change(current_user.id, order_id, {"status": "cancelled", "updated_at": cancelled_at})
     
     return {"message": "Order cancelled successfully"}
 
 # Razorpay Payment Integration
-@api_router.post("/payment/create-order/{order_id}")
+@api_router.post("/payment/create-order/{order_id}", dependencies=[checkout_admission])
 async def create_razorpay_order(order_id: str, current_user: User = Depends(get_current_user)):
     """Create Razorpay order for payment"""
     order = await db.orders.find_one({"id": order_id, "user_id": current_user.id})
@@ -459,12 +897,13 @@ async def create_razorpay_order(order_id: str, current_user: User = Depends(get_
     
     try:
         # Create Razorpay order
-        razorpay_order = razorpay_client.order.create({
-            "amount": int(order["total_amount"] * 100),  # Convert to paise
-            "currency": "INR",
-            "receipt": f"order_{order_id}",
-            "payment_capture": 1
-        })
+        with tracer.span("razorpay.order.create", kind="client"):
+            razorpay_order = get_razorpay_client().order.create({
+                "amount": int(order["total_amount"] * 100),  # Convert to paise
+                "currency": "INR",
+                "receipt": f"order_{order_id}",
+                "payment_capture": 1
+            })
         
         # Store Razorpay order ID in our database
         await db.orders.update_one(
@@ -492,16 +931,19 @@ async def verify_payment(order_id: str, payment_data: dict, current_user: User =
     if not all([razorpay_order_id, razorpay_payment_id, razorpay_signature]):
         raise HTTPException(status_code=400, detail="Missing payment verification data")
     
+    razorpay_client = get_razorpay_client()
+    from razorpay.errors import SignatureVerificationError
     try:
         # Verify payment signature
-        razorpay_client.utility.verify_payment_signature({
-            'razorpay_order_id': razorpay_order_id,
-            'razorpay_payment_id': razorpay_payment_id,
-            'razorpay_signature': razorpay_signature
-        })
+        with tracer.span("razorpay.verify_payment_signature"):
+            razorpay_client.utility.verify_payment_signature({
+                'razorpay_order_id': razorpay_order_id,
+                'razorpay_payment_id': razorpay_payment_id,
+                'razorpay_signature': razorpay_signature
+            })
         
         # Update order status
-        await db.orders.update_one(
+        result = await db.orders.update_one(
             {"id": order_id, "user_id": current_user.id},
             {"$set": {
                 "payment_status": "completed",
@@ -511,10 +953,16 @@ async def verify_payment(order_id: str, payment_data: dict, current_user: User =
                 "updated_at": datetime.now(timezone.utc)
             }}
         )
+        if result.matched_count:
+            publish_order_change(current_user.id, order_id, {
+                "status": "confirmed",
+                "payment_status": "completed",
+                "updated_at": datetime.now(timezone.utc)
+            })
         
         return {"message": "Payment verified and order confirmed successfully"}
         
-    except razorpay.errors.SignatureVerificationError:
+    except SignatureVerificationError:
         raise HTTPException(status_code=400, detail="Payment verification failed")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Payment verification error: {str(e)}")
@@ -540,6 +988,9 @@ async def update_payment_status(order_id: str, payment_data: dict, admin_user: U
         update_data["status"] = "confirmed"
     
     await db.orders.update_one({"id": order_id}, {"$set": update_data})
+    publish_order_change(order["user_id"], order_id, {
+        key: value for key, value in update_data.items() if key in ("status", "payment_status", "payment_method", "updated_at")
+    })
     
     return {"message": "Payment status updated successfully"}
 
@@ -573,8 +1024,7 @@ async def update_profile(profile_data: dict, current_user: User = Depends(get_cu
     return {"message": "Profile updated successfully", "user": User(**updated_user)}
 
 # Categories endpoint
-@api_router.get("/categories")
-async def get_categories():
+async def load_public_categories():
     return {
         "categories": [
             "necklaces",
@@ -586,9 +1036,61 @@ async def get_categories():
         ]
     }
 
+@api_router.get("/categories")
+async def get_categories(request: Request):
+    return await response_cache.respond(request, "categories", "public", on_primary(load_public_categories))
+
+@api_router.get("/categories/trending")
+async def get_trending_categories(ranking: str = "trending", limit: int = 10):
+    """Categories ranked by time-decayed sales"""
+    if ranking not in RANKINGS:
+        raise HTTPException(status_code=400, detail=f"ranking must be one of: {', '.join(RANKINGS)}")
+    ranked = await popularity.top(db, "category", ranking, max(1, min(limit, 50)))
+    return [{"category": category, "score": score} for category, score in ranked]
+
+# Storefront bootstrap: everything the homepage needs for first paint in one response
+STOREFRONT_FEATURED_COUNT = int(os.environ.get('STOREFRONT_FEATURED_COUNT', '4'))
+STOREFRONT_TRENDING_COUNT = int(os.environ.get('STOREFRONT_TRENDING_COUNT', '8'))
+# Settings safe to show anonymous visitors (never payment keys or notification config)
+PUBLIC_SETTINGS_PREFIXES = ("homepage_", "category_", "primary_button", "secondary_button")
+PUBLIC_SETTINGS_FIELDS = {"store_name", "store_email", "store_phone", "store_address",
+                          "currency", "free_shipping_threshold", "standard_shipping_cost"}
+
+async def load_category_counts():
+    categories = (await load_admin_categories())["categories"]
+    counts = {
+        row["_id"]: row["count"]
+        async for row in db.products.aggregate([
+            {"$match": {"is_active": True}},
+            {"$group": {"_id": "$category", "count": {"$sum": 1}}}
+        ])
+    }
+    return [{"name": category, "product_count": counts.get(category, 0)} for category in categories]
+
+async def load_storefront():
+    settings, featured, categories, trending = await asyncio.gather(
+        load_settings(),
+        db.products.find({"is_active": True}).limit(STOREFRONT_FEATURED_COUNT).to_list(length=STOREFRONT_FEATURED_COUNT),
+        load_category_counts(),
+        load_trending(limit=STOREFRONT_TRENDING_COUNT),
+    )
+    return {
+        "settings": {
+            key: value for key, value in settings.items()
+            if key.startswith(PUBLIC_SETTINGS_PREFIXES) or key in PUBLIC_SETTINGS_FIELDS
+        },
+        "featured_products": [Product(**product) for product in featured],
+        "categories": categories,
+        "trending": trending,
+    }
+
+@api_router.get("/storefront/bootstrap")
+async def get_storefront_bootstrap(request: Request):
+    """Settings, featured products, categories with counts and trending items in one cached response"""
+    return await response_cache.respond(request, "storefront", "bootstrap", on_primary(load_storefront))
+
 # Admin Category Management
-@api_router.get("/admin/categories")
-async def get_admin_categories(admin_user: User = Depends(get_admin_user)):
+async def load_admin_categories():
     # Get categories from database or return default ones
     categories = await db.categories.find().to_list(length=100)
     if not categories:
@@ -598,6 +1100,10 @@ async def get_admin_categories(admin_user: User = Depends(get_admin_user)):
     
     return {"categories": [cat["name"] for cat in categories]}
 
+@api_router.get("/admin/categories")
+async def get_admin_categories(request: Request, admin_user: User = Depends(get_admin_user)):
+    return await response_cache.respond(request, "categories", "admin", load_admin_categories, "private, no-cache")
+
 @api_router.post("/admin/categories")
 async def add_category(category_data: dict, admin_user: User = Depends(get_admin_user)):
     category_name = category_data.get("name", "").lower().strip()
@@ -614,6 +1120,7 @@ async def add_category(category_data: dict, admin_user: User = Depends(get_admin
         "name": category_name,
         "created_at": datetime.now(timezone.utc)
     })
+    await invalidation_bus.publish("categories")
     
     return {"message": "Category added successfully"}
 
@@ -627,19 +1134,21 @@ async def delete_category(category_name: str, admin_user: User = Depends(get_adm
     result = await db.categories.delete_one({"name": category_name})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Category not found")
+    await invalidation_bus.publish("categories")
     
     return {"message": "Category deleted successfully"}
 
 # Customer Management
 @api_router.get("/admin/customers")
-async def get_customers(admin_user: User = Depends(get_admin_user)):
+async def get_customers(include_archived: bool = False, admin_user: User = Depends(get_admin_user)):
     """Get all registered customers"""
     customers = await db.users.find().to_list(length=1000)
     
-    # Get order count for each customer
+    # Order counts for every customer in one aggregation per collection
+    counts = await order_counts(db, include_archived)
     customer_list = []
     for customer in customers:
-        order_count = await db.orders.count_documents({"user_id": customer["id"]})
+        order_count = counts.get(customer.get("id"), 0)
         customer_dict = {
             "id": customer.get("id"),
             "full_name": customer.get("full_name", ""),
@@ -721,18 +1230,29 @@ async def delete_promotion(promotion_id: str, admin_user: User = Depends(get_adm
     
     return {"message": "Promotion deleted successfully"}
 
-@api_router.post("/apply-promotion")
+async def find_active_promotion(code: str):
+    now = datetime.now(timezone.utc)
+    return await db.promotions.find_one({
+        "code": code,
+        "is_active": True,
+        "start_date": {"$lte": now},
+        "end_date": {"$gte": now}
+    })
+
+def promotion_discount(promotion: dict, order_amount: float) -> float:
+    if promotion.get("discount_percentage"):
+        return (order_amount * promotion["discount_percentage"]) / 100
+    if promotion.get("discount_amount"):
+        return min(promotion["discount_amount"], order_amount)
+    return 0
+
+@api_router.post("/apply-promotion", dependencies=[promotion_user_limit, promotion_ip_limit])
 async def apply_promotion(promotion_data: dict, current_user: User = Depends(get_current_user)):
     """Apply promotion code to calculate discount"""
     code = promotion_data.get("code")
     order_amount = promotion_data.get("order_amount", 0)
     
-    promotion = await db.promotions.find_one({
-        "code": code,
-        "is_active": True,
-        "start_date": {"$lte": datetime.now(timezone.utc)},
-        "end_date": {"$gte": datetime.now(timezone.utc)}
-    })
+    promotion = await find_active_promotion(code)
     
     if not promotion:
         raise HTTPException(status_code=404, detail="Invalid or expired promotion code")
@@ -740,12 +1260,14 @@ async def apply_promotion(promotion_data: dict, current_user: User = Depends(get
     if promotion.get("min_order_amount") and order_amount < promotion["min_order_amount"]:
         raise HTTPException(status_code=400, detail=f"Minimum order amount is ₹{promotion['min_order_amount']}")
     
-    # Calculate discount
-    discount = 0
-    if promotion.get("discount_percentage"):
-        discount = (order_amount * promotion["discount_percentage"]) / 100
-    elif promotion.get("discount_amount"):
-        discount = promotion["discount_amount"]
+    # Early feedback only; the limits are enforced atomically when the order is placed
+    if promotion.get("max_redemptions") is not None and promotion.get("redemption_count", 0) >= promotion["max_redemptions"]:
+        raise HTTPException(status_code=400, detail="This promotion code has been fully redeemed")
+    if (promotion.get("max_redemptions_per_user") is not None
+            and await redemptions_used(db, promotion["id"], current_user.id) >= promotion["max_redemptions_per_user"]):
+        raise HTTPException(status_code=400, detail="You have already used this promotion code the maximum number of times")
+    
+    discount = promotion_discount(promotion, order_amount)
     
     return {
         "promotion": Promotion(**promotion),
@@ -754,9 +1276,7 @@ async def apply_promotion(promotion_data: dict, current_user: User = Depends(get
     }
 
 # Settings Management
-@api_router.get("/admin/settings")
-async def get_settings(admin_user: User = Depends(get_admin_user)):
-    """Get store settings"""
+async def load_settings():
     settings = await db.settings.find_one({"store_id": "main"})
     if not settings:
         # Return default settings
@@ -793,6 +1313,11 @@ async def get_settings(admin_user: User = Depends(get_admin_user)):
         del settings['_id']
     return settings
 
+@api_router.get("/admin/settings")
+async def get_settings(request: Request, admin_user: User = Depends(get_admin_user)):
+    """Get store settings"""
+    return await response_cache.respond(request, "settings", "main", load_settings, "private, no-cache")
+
 @api_router.put("/admin/settings")
 async def update_settings(settings_data: dict, admin_user: User = Depends(get_admin_user)):
     """Update store settings"""
@@ -804,18 +1329,37 @@ async def update_settings(settings_data: dict, admin_user: User = Depends(get_ad
         {"$set": settings_data},
         upsert=True
     )
+    await invalidation_bus.publish("settings")
     
     return {"message": "Settings updated successfully"}
 
 # Enhanced Product Management
 @api_router.delete("/admin/products/{product_id}")
 async def delete_product(product_id: str, admin_user: User = Depends(get_admin_user)):
-    result = await db.products.delete_one({"id": product_id})
-    if result.deleted_count == 0:
+    """Soft-delete: hide the product from the catalogue but keep it for carts and order history"""
+    result = await db.products.update_one(
+        {"id": product_id, "is_active": True},
+        {"$set": {"is_active": False, "deleted_at": datetime.now(timezone.utc)}}
+    )
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    await invalidation_bus.publish("catalog")
     
     return {"message": "Product deleted successfully"}
 
+@api_router.post("/admin/products/{product_id}/restore", response_model=Product)
+async def restore_product(product_id: str, admin_user: User = Depends(get_admin_user)):
+    """Bring a soft-deleted product back into the catalogue"""
+    result = await db.products.update_one(
+        {"id": product_id, "is_active": False},
+        {"$set": {"is_active": True, "deleted_at": None}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Deleted product not found")
+    await invalidation_bus.publish("catalog")
+    
+    return Product(**await db.products.find_one({"id": product_id}))
+
 # Order Management - Delete Orders
 class BulkDeleteRequest(BaseModel):
     order_ids: List[str]
@@ -823,19 +1367,30 @@ class BulkDeleteRequest(BaseModel):
 @api_router.delete("/admin/orders/bulk")
 async def delete_orders_bulk(request: BulkDeleteRequest, admin_user: User = Depends(get_admin_user)):
     """Delete multiple orders by IDs"""
+    stats_fields = {"id": 1, "user_id": 1, "status": 1, "total_amount": 1}
+    existing = await db.orders.find({"id": {"$in": request.order_ids}}, stats_fields).to_list(length=None)
+    archived = await db[ARCHIVE_COLLECTION].find({"id": {"$in": request.order_ids}}, stats_fields).to_list(length=None)
     result = await db.orders.delete_many({"id": {"$in": request.order_ids}})
+    archived_result = await db[ARCHIVE_COLLECTION].delete_many({"id": {"$in": request.order_ids}})
+    await release_deleted_order_stats(list({order["id"]: order for order in archived + existing}.values()))
+    admin_order_feed.orders_deleted([order["id"] for order in existing])
+    deleted_count = result.deleted_count + archived_result.deleted_count
     
     return {
-        "message": f"{result.deleted_count} orders deleted successfully",
-        "deleted_count": result.deleted_count
+        "message": f"{deleted_count} orders deleted successfully",
+        "deleted_count": deleted_count
     }
 
 @api_router.delete("/admin/orders/{order_id}")
 async def delete_order(order_id: str, admin_user: User = Depends(get_admin_user)):
     """Delete a single order by ID"""
-    result = await db.orders.delete_one({"id": order_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Order not found")
+    order = await db.orders.find_one_and_delete({"id": order_id})
+    if order is None:
+        order = await db[ARCHIVE_COLLECTION].find_one_and_delete({"id": order_id})
+        if order is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+    await release_deleted_order_stats([order])
+    admin_order_feed.orders_deleted([order_id])
     
     return {"message": "Order deleted successfully"}
 
@@ -846,8 +1401,11 @@ async def delete_customer(user_id: str, delete_orders: bool = False, admin_user:
     
     if delete_orders:
         # First delete all orders associated with this customer
+        existing = await db.orders.find({"user_id": user_id}, {"id": 1}).to_list(length=None)
         orders_result = await db.orders.delete_many({"user_id": user_id})  # Fixed: use user_id instead of customer_id
-        orders_deleted = orders_result.deleted_count
+        archived_result = await db[ARCHIVE_COLLECTION].delete_many({"user_id": user_id})
+        orders_deleted = orders_result.deleted_count + archived_result.deleted_count
+        admin_order_feed.orders_deleted([order["id"] for order in existing])
     else:
         orders_deleted = 0
     
@@ -866,16 +1424,150 @@ async def delete_customer(user_id: str, delete_orders: bool = False, admin_user:
         "orders_deleted": orders_deleted
     }
 
+# Diagnostics
+@api_router.get("/admin/diagnostics/slow-queries")
+async def get_slow_queries(reset: bool = False, admin_user: User = Depends(get_admin_user)):
+    """Slow Mongo query shapes with their explain plans"""
+    report = slow_query_sampler.report()
+    if reset:
+        slow_query_sampler.reset()
+    return {
+        "threshold_ms": slow_query_sampler.threshold_ms,
+        "shapes": report,
+        "collscan_shapes": sum(1 for entry in report if entry["collscan"])
+    }
+
+@api_router.get("/admin/jobs")
+async def get_jobs(admin_user: User = Depends(get_admin_user)):
+    """Registered background jobs and their last result on this worker"""
+    return job_runner.status()
+
+@api_router.get("/admin/admission")
+async def get_admission(admin_user: User = Depends(get_admin_user)):
+    """Checkout admission gate on this worker: slots in use and queue length"""
+    return checkout_gate.status()
+
+@api_router.post("/admin/jobs/{job_name}/run")
+async def run_job(job_name: str, admin_user: User = Depends(get_admin_user)):
+    """Run a background job now, unless a run is already in progress on any worker"""
+    if not job_runner.has_job(job_name):
+        raise HTTPException(status_code=404, detail="Job not found")
+    result = await job_runner.run(job_name, db)
+    if result is None:
+        raise HTTPException(status_code=409, detail="Job is already running")
+    return {"job": job_name, "result": result}
+
+# Probes (off the /api prefix): liveness never touches MongoDB, readiness only passes on warm workers
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    report = lifecycle.report()
+    if not lifecycle.ready:
+        return JSONResponse(status_code=503, content={**report, "mongo": None})
+    mongo_ok = await ping(db)
+    return JSONResponse(status_code=200 if mongo_ok else 503, content={**report, "mongo": mongo_ok})
+
+# Internal metrics endpoint (kept off the /api prefix so it is not routed publicly)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+@app.get("/internal/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint"""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Consistency profile of every route (see consistency.py); startup fails if a route is missing
+ROUTE_CONSISTENCY = {
+    # Health, auth and admin edits: client defaults
+    "GET /healthz": "primary",
+    "GET /readyz": "primary",
+    "GET /internal/metrics": "primary",
+    "POST /api/auth/register": "primary",
+    "POST /api/auth/login": "primary",
+    "PUT /api/profile": "primary",
+    "POST /api/admin/products": "primary",
+    "PUT /api/admin/products/{product_id}": "primary",
+    "DELETE /api/admin/products/{product_id}": "primary",
+    "POST /api/admin/products/{product_id}/restore": "primary",
+    "POST /api/admin/media": "primary",
+    "GET /api/admin/categories": "primary",
+    "POST /api/admin/categories": "primary",
+    "DELETE /api/admin/categories/{category_name}": "primary",
+    "GET /api/admin/promotions": "primary",
+    "POST /api/admin/promotions": "primary",
+    "PUT /api/admin/promotions/{promotion_id}": "primary",
+    "DELETE /api/admin/promotions/{promotion_id}": "primary",
+    "GET /api/admin/settings": "primary",
+    "PUT /api/admin/settings": "primary",
+    "GET /api/admin/diagnostics/slow-queries": "primary",
+    "GET /api/admin/jobs": "primary",
+    "POST /api/admin/jobs/{job_name}/run": "primary",
+    "GET /api/admin/admission": "primary",
+    "POST /api/apply-promotion": "primary",
+    # Long-lived stream: a session would be held for the whole connection
+    "GET /api/orders/events": "primary",
+    # Public catalogue; cached routes fill from the primary (on_primary), so the
+    # admin's product list shows a save as soon as the invalidation reaches the worker
+    "GET /api/products": "catalog",
+    "GET /api/products/trending": "catalog",
+    "GET /api/products/{product_id}": "catalog",
+    "GET /api/products/{product_id}/related": "catalog",
+    "GET /api/media/{image_id}/{variant}": "catalog",
+    "GET /api/categories": "catalog",
+    "GET /api/categories/trending": "catalog",
+    "GET /api/storefront/bootstrap": "catalog",
+    # Admin lists, on secondaries. The admin writes they reload after (order review, delete
+    # and payment, customer delete) are causal and return X-Causal-Token; the dashboard sends
+    # it back, so the list waits for the secondary to apply the admin's own change
+    "GET /api/admin/orders": "analytics",
+    "GET /api/admin/customers": "analytics",
+    # Carts
+    "POST /api/cart/add": "cart",
+    "GET /api/cart": "cart",
+    "PUT /api/cart/{product_id}": "cart",
+    "DELETE /api/cart/{product_id}": "cart",
+    "GET /api/guest-cart": "cart",
+    "POST /api/guest-cart/add": "cart",
+    "PUT /api/guest-cart/{product_id}": "cart",
+    "DELETE /api/guest-cart/{product_id}": "cart",
+    # Orders (handlers run their Mongo calls one at a time, as a session requires)
+    "POST /api/orders": "orders",
+    "GET /api/orders": "orders",
+    "GET /api/orders/summary": "orders",
+    "PUT /api/orders/{order_id}/cancel": "orders",
+    "PUT /api/admin/orders/{order_id}/review": "orders",
+    "DELETE /api/admin/orders/bulk": "orders",
+    "DELETE /api/admin/orders/{order_id}": "orders",
+    "DELETE /api/admin/customers/{user_id}": "orders",
+    # Payments
+    "POST /api/payment/create-order/{order_id}": "payments",
+    "POST /api/payment/verify/{order_id}": "payments",
+    "PUT /api/admin/orders/{order_id}/payment": "payments",
+}
+check_route_profiles(app.routes, ROUTE_CONSISTENCY)
+
+app.add_middleware(ConsistencyMiddleware, routes=app.routes, route_profiles=ROUTE_CONSISTENCY,
+                   client=lambda: client, secret=SECRET_KEY)
+# Inside CORS so a browser can read the 413
+app.add_middleware(UploadLimitMiddleware, path_prefixes=["/api/admin/media"])
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
+    expose_headers=["X-Next-Cursor", "X-Queue-Ticket", "Retry-After", CAUSAL_TOKEN_HEADER],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -884,6 +1576,58 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+# Keep in-process caches coherent across workers
+invalidation_bus.register(response_cache.invalidate)
+# The bootstrap payload combines these namespaces; trending moves on its own, so it also expires
+response_cache.configure("storefront", ttl=float(os.environ.get('STOREFRONT_CACHE_TTL', '60')),
+                         depends_on=("catalog", "categories", "settings"))
+
+# Background jobs (one worker runs each, see jobs.py)
+job_runner.register("archive_orders", archive_orders, ORDER_ARCHIVE_INTERVAL)
+job_runner.register("compact_cart", compact_cart, CART_COMPACTION_INTERVAL)
+job_runner.register("recommendations", refresh_recommendations, RECOMMENDATIONS_INTERVAL)
+job_runner.register("reanchor_popularity", reanchor_popularity, POPULARITY_REANCHOR_INTERVAL)
+
+async def prime_caches():
+    """Fill the response cache for the hottest reads and touch the promotion working set"""
+    categories = (await load_public_categories())["categories"]
+    await response_cache.prime("catalog", "products:", load_products)
+    for category in categories:
+        await response_cache.prime("catalog", f"products:{category}", lambda: load_products(category))
+    await response_cache.prime("categories", "public", load_public_categories)
+    await response_cache.prime("categories", "admin", load_admin_categories)
+    await response_cache.prime("settings", "main", load_settings)
+    await response_cache.prime("storefront", "bootstrap", load_storefront)
+    now = datetime.now(timezone.utc)
+    await db.promotions.find(
+        {"is_active": True, "start_date": {"$lte": now}, "end_date": {"$gte": now}}
+    ).to_list(length=1000)
+
+async def start_background_services():
+    with lifecycle.phase("mongo"):
+        await verify_mongo(db)
+    with lifecycle.phase("indexes"):
+        await ensure_indexes(db)
+    with lifecycle.phase("services"):
+        slow_query_sampler.attach(client, asyncio.get_running_loop())
+        tracer.start()
+        await invalidation_bus.start(db)
+        if RATE_LIMIT_BACKEND == "mongo":
+            await rate_limiter.use_shared_backend(db)
+        job_runner.start(db)
+    with lifecycle.phase("prime"):
+        try:
+            await prime_caches()
+        except Exception:
+            # A cold cache is slower, not broken: serve anyway
+            logger.exception("Cache priming failed")
+    lifecycle.mark_ready()
+
+async def stop_background_services():
+    # Fail readiness first so the load balancer drains this worker
+    lifecycle.mark_draining()
+    await invalidation_bus.stop()
+    await job_runner.stop()
+    tracer.shutdown()
+    shutdown_media_pool()
+    client.close()
@@ -0,0 +1,235 @@
+"""
+Slow-query sampler.
+
+Watches Mongo command durations through a pymongo CommandListener. Commands
+slower than SLOW_QUERY_THRESHOLD_MS are grouped by query shape (collection,
+command and filter with every literal replaced by "?"), and each shape is
+explained out-of-band on the event loop so we can see whether it is
+collection-scanning. The aggregated view backs the admin diagnostics
+endpoint.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '100'))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', '300'))  # seconds per shape
+SLOW_QUERY_MAX_SHAPES = int(os.environ.get('SLOW_QUERY_MAX_SHAPES', '500'))
+
+# Commands we know how to pull a filter out of and explain
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+
+# Session/transport fields that explain rejects or that are meaningless out-of-band
+_STRIP_FIELDS = {
+    "lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern",
+    "$db", "$clusterTime", "$readPreference", "signature", "ordered", "bypassDocumentValidation",
+}
+
+
+def normalize_shape(value):
+    """Replace literals with '?' while keeping field names and operators"""
+    if isinstance(value, dict):
+        return {key: normalize_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return []
+        if all(not isinstance(item, (dict, list, tuple)) for item in value):
+            return ["?"]
+        return [normalize_shape(item) for item in value]
+    return "?"
+
+
+def extract_filter(command_name, command):
+    """The query predicate of a command, in the position each command keeps it"""
+    if command_name == "find":
+        return command.get("filter", {})
+    if command_name in ("count", "distinct", "findAndModify"):
+        return command.get("query", {})
+    if command_name == "aggregate":
+        pipeline = command.get("pipeline", [])
+        if pipeline and "$match" in pipeline[0]:
+            return pipeline[0]["$match"]
+        return {}
+    if command_name == "update":
+        updates = command.get("updates") or [{}]
+        return updates[0].get("q", {})
+    if command_name == "delete":
+        deletes = command.get("deletes") or [{}]
+        return deletes[0].get("q", {})
+    return {}
+
+
+def extract_sort(command_name, command):
+    if command_name in ("find", "findAndModify"):
+        return command.get("sort")
+    return None
+
+
+def explainable(command):
+    """A copy of the command without session fields, fit for {explain: ...}"""
+    return {key: value for key, value in command.items() if key not in _STRIP_FIELDS}
+
+
+def summarize_plan(explain_result):
+    """Pull the stages and indexes out of an explain's winning plan"""
+    planner = explain_result.get("queryPlanner")
+    if planner is None:
+        # aggregate explains nest the planner under the first $cursor stage
+        for stage in explain_result.get("stages", []):
+            if "$cursor" in stage:
+                planner = stage["$cursor"].get("queryPlanner")
+                break
+    winning = (planner or {}).get("winningPlan", {})
+    stages, indexes = [], []
+
+    def walk(node):
+        if not isinstance(node, dict):
+            return
+        stage = node.get("stage")
+        if stage:
+            stages.append(stage)
+        if node.get("indexName"):
+            indexes.append(node["indexName"])
+        for child_key in ("inputStage", "queryPlan", "winningPlan"):
+            walk(node.get(child_key))
+        for child in node.get("inputStages", []):
+            walk(child)
+
+    walk(winning)
+    return {"stages": stages, "indexes": indexes, "collscan": "COLLSCAN" in stages}
+
+
+class SlowQuerySampler(monitoring.CommandListener):
+    """Aggregates slow commands by shape and explains each shape out-of-band"""
+
+    def __init__(self, threshold_ms=SLOW_QUERY_THRESHOLD_MS, explain_interval=SLOW_QUERY_EXPLAIN_INTERVAL,
+                 max_shapes=SLOW_QUERY_MAX_SHAPES):
+        self.threshold_ms = threshold_ms
+        self.explain_interval = explain_interval
+        self.max_shapes = max_shapes
+        self._pending = {}
+        self._shapes = {}
+        self._lock = threading.Lock()
+        self._client = None
+        self._loop = None
+        self._explaining = set()
+
+    def attach(self, client, loop):
+        """Give the sampler a client and loop to run explains on"""
+        self._client = client
+        self._loop = loop
+
+    # CommandListener hooks (called on motor's executor threads)
+    def started(self, event):
+        if event.command_name in EXPLAINABLE_COMMANDS:
+            with self._lock:
+                self._pending[(event.connection_id, event.request_id)] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms:
+            return
+        database_name, command = pending
+        self.record(database_name, event.command_name, command, duration_ms)
+
+    def record(self, database_name, command_name, command, duration_ms):
+        collection = command.get(command_name)
+        query_filter = extract_filter(command_name, command)
+        shape = {"filter": normalize_shape(query_filter)}
+        sort = extract_sort(command_name, command)
+        if sort:
+            shape["sort"] = normalize_shape(sort)
+        key = f"{database_name}.{collection}:{command_name}:{json.dumps(shape, sort_keys=True, default=str)}"
+
+        now = time.time()
+        with self._lock:
+            entry = self._shapes.get(key)
+            if entry is None:
+                if len(self._shapes) >= self.max_shapes:
+                    return
+                entry = self._shapes[key] = {
+                    "shape_key": key,
+                    "database": database_name,
+                    "collection": collection,
+                    "command": command_name,
+                    "shape": shape,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "first_seen": datetime.now(timezone.utc),
+                    "last_seen": None,
+                    "collscan": None,
+                    "plan": None,
+                    "explained_at": 0.0,
+                }
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["last_seen"] = datetime.now(timezone.utc)
+            needs_explain = (
+                now - entry["explained_at"] >= self.explain_interval and key not in self._explaining
+            )
+            if needs_explain:
+                self._explaining.add(key)
+
+        if needs_explain and self._client is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._schedule_explain, key, database_name, explainable(command))
+
+    def _schedule_explain(self, key, database_name, command):
+        asyncio.ensure_future(self._explain(key, database_name, command))
+
+    async def _explain(self, key, database_name, command):
+        try:
+            result = await self._client[database_name].command(
+                {"explain": command, "verbosity": "queryPlanner"}
+            )
+            plan = summarize_plan(result)
+        except Exception as e:
+            logger.warning("Explain failed for slow query shape %s: %s", key, e)
+            plan = {"error": str(e)}
+        with self._lock:
+            self._explaining.discard(key)
+            entry = self._shapes.get(key)
+            if entry is not None:
+                entry["plan"] = plan
+                entry["collscan"] = plan.get("collscan")
+                entry["explained_at"] = time.time()
+        if plan.get("collscan"):
+            logger.warning("Slow query shape is collection-scanning: %s", key)
+
+    def report(self):
+        """Shapes ordered by total time spent, worst first"""
+        with self._lock:
+            entries = [dict(entry) for entry in self._shapes.values()]
+        for entry in entries:
+            entry["avg_ms"] = round(entry["total_ms"] / entry["count"], 2) if entry["count"] else 0.0
+            entry["total_ms"] = round(entry["total_ms"], 2)
+            entry["max_ms"] = round(entry["max_ms"], 2)
+            entry.pop("explained_at", None)
+        entries.sort(key=lambda entry: entry["total_ms"], reverse=True)
+        return entries
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+
+
+slow_query_sampler = SlowQuerySampler()
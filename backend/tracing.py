@@ -0,0 +1,372 @@
+"""
+Lightweight distributed tracing.
+
+TracingMiddleware opens a server span per request (continuing an incoming W3C
+`traceparent` when present) and echoes the trace context on the response.
+Code opens child spans with `tracer.span(...)`; the Mongo command listener
+turns every motor command into a child span; `TracingSession` is a requests
+session that propagates `traceparent` to outbound gateway calls.
+
+Sampling is decided once at the head of the trace (TRACE_SAMPLE_RATE, or the
+sampled flag of an incoming traceparent). Unsampled requests only carry ids
+around, so the cost at full traffic is a couple of contextvar lookups.
+
+Finished spans are exported on a background thread to a JSON-lines file
+(TRACING_EXPORTER=file) or POSTed as OTLP/JSON to a collector
+(TRACING_EXPORTER=otlp).
+"""
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import requests
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = os.environ.get('TRACING_SERVICE_NAME', 'manira-backend')
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.05'))
+TRACING_EXPORTER = os.environ.get('TRACING_EXPORTER', 'none')  # none, file, otlp
+TRACING_FILE = os.environ.get('TRACING_FILE', 'traces.jsonl')
+OTLP_ENDPOINT = os.environ.get('OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+TRACING_QUEUE_SIZE = int(os.environ.get('TRACING_QUEUE_SIZE', '10000'))
+TRACING_BATCH_SIZE = int(os.environ.get('TRACING_BATCH_SIZE', '512'))
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "sampled",
+                 "start_ns", "end_ns", "attributes", "status", "error")
+
+    def __init__(self, trace_id, span_id, parent_id, name, kind="internal", sampled=True, start_ns=None):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.status = "ok"
+        self.error = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key, value):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def set_error(self, error):
+        self.status = "error"
+        self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "attributes": self.attributes,
+            "status": self.status,
+            "error": self.error,
+            "service": SERVICE_NAME,
+        }
+
+
+def parse_traceparent(header):
+    """Return (trace_id, parent_span_id, sampled) or None for a malformed header"""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == "ff":
+        return None
+    _, trace_id, span_id, flags = parts[:4]
+    if len(trace_id) != 32 or len(span_id) != 16 or len(flags) != 2:
+        return None
+    try:
+        int(trace_id, 16), int(span_id, 16)
+        sampled = bool(int(flags, 16) & 0x01)
+    except ValueError:
+        return None
+    if trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return trace_id.lower(), span_id.lower(), sampled
+
+
+_current_span = ContextVar("current_span", default=None)
+
+
+def current_span():
+    return _current_span.get()
+
+
+class FileExporter:
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, spans):
+        with open(self.path, "a") as f:
+            for span in spans:
+                f.write(json.dumps(span, default=str) + "\n")
+
+
+class OTLPJsonExporter:
+    """Posts spans in OTLP/JSON to a collector (or any stand-in that accepts it)"""
+
+    KINDS = {"internal": 1, "server": 2, "client": 3}
+
+    def __init__(self, endpoint, timeout=5):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def _attribute(self, key, value):
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def export(self, spans):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [self._attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{
+                "scope": {"name": "manira.tracing"},
+                "spans": [{
+                    "traceId": span["trace_id"],
+                    "spanId": span["span_id"],
+                    "parentSpanId": span["parent_id"] or "",
+                    "name": span["name"],
+                    "kind": self.KINDS.get(span["kind"], 1),
+                    "startTimeUnixNano": str(span["start_ns"]),
+                    "endTimeUnixNano": str(span["end_ns"]),
+                    "attributes": [self._attribute(k, v) for k, v in span["attributes"].items()],
+                    "status": {"code": 2, "message": span["error"] or ""} if span["status"] == "error" else {"code": 1},
+                } for span in spans],
+            }],
+        }]}
+        body = json.dumps(payload).encode()
+        req = urllib.request.Request(self.endpoint, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self.timeout):
+            pass
+
+
+class Tracer:
+    """Creates spans and ships finished ones to the exporter on a worker thread"""
+
+    def __init__(self, sample_rate=TRACE_SAMPLE_RATE, exporter=None):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=TRACING_QUEUE_SIZE)
+        self._worker = None
+        self._stopped = threading.Event()
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def start(self):
+        if self.exporter is None or self._worker is not None:
+            return
+        self._stopped.clear()
+        self._worker = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._worker.start()
+
+    def shutdown(self):
+        if self._worker is None:
+            return
+        self._stopped.set()
+        self._worker.join(timeout=5)
+        self._worker = None
+
+    def _run(self):
+        while not (self._stopped.is_set() and self._queue.empty()):
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=1))
+                while len(batch) < TRACING_BATCH_SIZE:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                try:
+                    self.exporter.export(batch)
+                except Exception as e:
+                    logger.warning("Trace export of %d spans failed: %s", len(batch), e)
+
+    def start_trace(self, name, traceparent=None, kind="server"):
+        """Root (or remote-child) span for an incoming request"""
+        parent = parse_traceparent(traceparent)
+        if parent:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = secrets.token_hex(16), None
+            sampled = self.enabled and random.random() < self.sample_rate
+        return Span(trace_id, secrets.token_hex(8), parent_id, name, kind, sampled and self.enabled)
+
+    def child(self, name, kind="internal", parent=None, start_ns=None):
+        parent = parent or _current_span.get()
+        if parent is None or not parent.sampled:
+            return None
+        return Span(parent.trace_id, secrets.token_hex(8), parent.span_id, name, kind, True, start_ns)
+
+    def finish(self, span, end_ns=None):
+        span.end_ns = end_ns or time.time_ns()
+        if not span.sampled:
+            return
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    @contextmanager
+    def span(self, name, kind="internal", **attributes):
+        """Child span of the current span; a no-op when the trace is unsampled"""
+        span = self.child(name, kind)
+        if span is None:
+            yield None
+            return
+        span.attributes.update(attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.set_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.finish(span)
+
+
+def _build_exporter():
+    if TRACING_EXPORTER == "file":
+        return FileExporter(TRACING_FILE)
+    if TRACING_EXPORTER == "otlp":
+        return OTLPJsonExporter(OTLP_ENDPOINT)
+    return None
+
+
+tracer = Tracer(exporter=_build_exporter())
+
+
+class TracingMiddleware:
+    """Opens the request span and propagates W3C trace context"""
+
+    def __init__(self, app, tracer=tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(b"traceparent", b"").decode("latin-1") or None
+        span = self.tracer.start_trace(f"{scope['method']} {scope['path']}", traceparent)
+        token = _current_span.set(span)
+        tracestate = headers.get(b"tracestate")
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+                if message["status"] >= 500:
+                    span.status = "error"
+                response_headers = list(message.get("headers", []))
+                response_headers.append((b"traceparent", span.traceparent.encode()))
+                if tracestate:
+                    response_headers.append((b"tracestate", tracestate))
+                message = {**message, "headers": response_headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            span.set_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                span.name = f"{scope['method']} {route.path}"
+            span.set_attribute("http.method", scope["method"])
+            span.set_attribute("http.target", scope["path"])
+            self.tracer.finish(span)
+
+
+class TracingCommandListener(monitoring.CommandListener):
+    """One client span per Mongo command, parented to the active span"""
+
+    def __init__(self, tracer=tracer):
+        self.tracer = tracer
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        span = self.tracer.child(f"mongodb.{event.command_name}", kind="client")
+        if span is None:
+            return
+        span.attributes.update({
+            "db.system": "mongodb",
+            "db.name": event.database_name,
+            "db.operation": event.command_name,
+            "db.collection": str(event.command.get(event.command_name, "")),
+        })
+        with self._lock:
+            self._open[(event.connection_id, event.request_id)] = span
+
+    def _end(self, event, error=None):
+        with self._lock:
+            span = self._open.pop((event.connection_id, event.request_id), None)
+        if span is None:
+            return
+        if error is not None:
+            span.status = "error"
+            span.error = str(error)
+        self.tracer.finish(span, span.start_ns + event.duration_micros * 1000)
+
+    def succeeded(self, event):
+        self._end(event)
+
+    def failed(self, event):
+        self._end(event, event.failure.get("errmsg", "command failed"))
+
+
+tracing_command_listener = TracingCommandListener()
+
+
+class TracingSession(requests.Session):
+    """requests session that wraps every call in a client span and sends traceparent"""
+
+    def __init__(self, tracer=tracer):
+        super().__init__()
+        self.tracer = tracer
+
+    def request(self, method, url, *args, **kwargs):
+        parent = _current_span.get()
+        if parent is None:
+            return super().request(method, url, *args, **kwargs)
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        with self.tracer.span(f"http.{method.lower()}", kind="client", **{"http.url": url}) as span:
+            headers["traceparent"] = (span or parent).traceparent
+            response = super().request(method, url, *args, headers=headers, **kwargs)
+            if span is not None:
+                span.set_attribute("http.status_code", response.status_code)
+            return response
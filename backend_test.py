@@ -1,7 +1,13 @@
 import requests
+import asyncio
+import os
 import sys
 import json
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent / 'backend'
 
 class ManiraAPITester:
     def __init__(self, base_url="https://manira-sparkle.preview.emergentagent.com"):
@@ -720,6 +726,191 @@ class ManiraAPITester:
         
         return True
 
+    def test_promotion_limits_mongod(self, attempts=2000):
+        """
+        Race redeem_promotion against a real mongod (TEST_MONGO_URL) with motor, whose
+        operations run on driver threads, so the attempts genuinely overlap at the server.
+        An in-memory database never yields and would run them one after another.
+        """
+        mongo_url = os.environ.get('TEST_MONGO_URL')
+        if not mongo_url:
+            print("⏭️  Promotion limits against mongod - SKIPPED (set TEST_MONGO_URL)")
+            return None
+        sys.path.insert(0, str(BACKEND_DIR))
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from promotion_limits import PromotionLimitReached, redeem_promotion
+
+        async def race(promotion, user_ids):
+            client = AsyncIOMotorClient(mongo_url, maxPoolSize=200)
+            db = client[f"promotion_limits_check_{datetime.now().strftime('%H%M%S%f')}"]
+            in_flight = max_in_flight = 0
+
+            async def attempt(stored, user_id):
+                nonlocal in_flight, max_in_flight
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+                try:
+                    await redeem_promotion(db, stored, user_id)
+                    return user_id
+                except PromotionLimitReached:
+                    return None
+                finally:
+                    in_flight -= 1
+
+            try:
+                await db.promotions.insert_one({**promotion, "redemption_count": 0})
+                stored = await db.promotions.find_one({"id": promotion["id"]})
+                results = await asyncio.gather(*[attempt(stored, user_id) for user_id in user_ids])
+                counter = (await db.promotions.find_one({"id": promotion["id"]}))["redemption_count"]
+            finally:
+                await client.drop_database(db.name)
+                client.close()
+            per_user = {}
+            for user_id in filter(None, results):
+                per_user[user_id] = per_user.get(user_id, 0) + 1
+            return per_user, counter, max_in_flight
+
+        users = [f"user-{i % 3}" for i in range(attempts)]
+        # Global cap binds: three users could take 30 between them
+        per_user, counter, overlap = asyncio.run(race(
+            {"id": "global", "max_redemptions": 20, "max_redemptions_per_user": 10}, users))
+        self.log_test(f"mongod: Global Limit Holds Under {attempts} Concurrent Redemptions",
+                      sum(per_user.values()) == 20 and counter == 20 and overlap > 1,
+                      f"Redeemed: {sum(per_user.values())}, Counter: {counter}, Max in flight: {overlap}")
+        # Per-user cap binds: the global cap leaves room for everyone
+        per_user, counter, overlap = asyncio.run(race(
+            {"id": "per-user", "max_redemptions": 100, "max_redemptions_per_user": 5}, users))
+        self.log_test(f"mongod: Per-User Limit Holds Under {attempts} Concurrent Redemptions",
+                      sorted(per_user.values()) == [5, 5, 5] and counter == 15 and overlap > 1,
+                      f"Per-user: {sorted(per_user.values())}, Counter: {counter}, Max in flight: {overlap}")
+        # A single customer hammering an otherwise unlimited code
+        per_user, counter, overlap = asyncio.run(race(
+            {"id": "once", "max_redemptions": None, "max_redemptions_per_user": 1}, ["user-0"] * attempts))
+        self.log_test("mongod: Per-User Limit Holds For A Single Customer",
+                      per_user == {"user-0": 1} and counter == 1 and overlap > 1,
+                      f"Per-user: {per_user}, Counter: {counter}, Max in flight: {overlap}")
+
+    def test_promotion_redemption_limits(self, product_id, attempts=60, concurrency=8):
+        """
+        A small burst of simultaneous checkouts at a capped promotion on the shared server.
+        429s (rate limit) and 503s (admission control) are counted apart from redemptions;
+        exact counts under thousands of concurrent attempts come from test_promotion_limits_mongod.
+        """
+        if not self.admin_token:
+            self.log_test("Promotion Redemption Limits", False, "No admin token available")
+            return False
+
+        admin_headers = {'Authorization': f'Bearer {self.admin_token}'}
+        stamp = datetime.now().strftime('%H%M%S%f')
+        global_limit, per_user_limit = 20, 10
+        promotion_data = {
+            "name": "Flash Sale Limit Test",
+            "code": f"FLASH{stamp}",
+            "discount_amount": 100,
+            "max_redemptions": global_limit,
+            "max_redemptions_per_user": per_user_limit,
+            "start_date": (datetime.now() - timedelta(days=1)).isoformat() + 'Z',
+            "end_date": (datetime.now() + timedelta(days=1)).isoformat() + 'Z'
+        }
+        success, promotion = self.run_test(
+            "Create Capped Promotion",
+            "POST",
+            "admin/promotions",
+            200,
+            data=promotion_data,
+            headers=admin_headers
+        )
+        if not success:
+            return False
+
+        # Three customers can redeem 30 times between them, so the global cap of 20 is what binds
+        user_tokens = []
+        for i in range(3):
+            success, response = self.run_test(
+                f"Register Promotion Test User {i + 1}",
+                "POST",
+                "auth/register",
+                200,
+                data={
+                    "full_name": f"Promotion Test User {i + 1}",
+                    "email": f"promo_{stamp}_{i}@test.com",
+                    "phone": "9876543210",
+                    "password": "testpass123"
+                }
+            )
+            if not success:
+                return False
+            user_tokens.append(response['access_token'])
+
+        order_data = {
+            "items": [{"product_id": product_id, "quantity": 1}],
+            "shipping_address": "123 Test Address, Test City, 123456",
+            "phone": "9876543210",
+            "promotion_code": promotion_data["code"]
+        }
+
+        def checkout(token):
+            response = requests.post(f"{self.api_url}/orders", json=order_data,
+                                     headers={'Authorization': f'Bearer {token}'})
+            return token, response.status_code, response.json() if response.status_code == 200 else None
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(checkout, [user_tokens[i % len(user_tokens)] for i in range(attempts)]))
+
+        placed = [(token, order) for token, status, order in results if status == 200]
+        rejected = sum(1 for _, status, _ in results if status == 400)
+        throttled = sum(1 for _, status, _ in results if status in (429, 503))
+        other = attempts - len(placed) - rejected - throttled
+        per_user = {token: sum(1 for placed_token, _ in placed if placed_token == token) for token in user_tokens}
+        # Throttled checkouts never reached the promotion, so they may leave the cap unfilled
+        self.log_test(
+            f"Global Limit Holds Under {attempts} Concurrent Checkouts",
+            other == 0 and (len(placed) == global_limit or (throttled and len(placed) < global_limit)),
+            f"Placed: {len(placed)}, Rejected: {rejected}, Throttled: {throttled}, Other: {other}"
+        )
+        self.log_test(
+            "Per-User Limit Holds Under Concurrency",
+            all(count <= per_user_limit for count in per_user.values()),
+            f"Per-user redemptions: {sorted(per_user.values())}"
+        )
+
+        success, promotions = self.run_test(
+            "Get Promotions After Flash Sale",
+            "GET",
+            "admin/promotions",
+            200,
+            headers=admin_headers
+        )
+        if success:
+            counted = next((p['redemption_count'] for p in promotions if p['id'] == promotion['id']), None)
+            self.log_test("Redemption Counter Matches Placed Orders", counted == len(placed),
+                          f"Counter: {counted}, Placed: {len(placed)}")
+
+        # Cancelling an order gives its redemption back, exactly once
+        if not placed:
+            return False
+        token, order = placed[0]
+        user_headers = {'Authorization': f'Bearer {token}'}
+        self.run_test("Cancel Redeemed Order", "PUT", f"orders/{order['id']}/cancel", 200, headers=user_headers)
+        self.run_test("Redeem Released Slot", "POST", "orders", 200, data=order_data, headers=user_headers)
+        success, _ = self.run_test("Promotion Exhausted Again", "POST", "orders", 400,
+                                   data=order_data, headers=user_headers)
+
+        # Per-user cap on its own: one customer hammering an otherwise unlimited code
+        promotion_data.update(code=f"ONCE{stamp}", max_redemptions=None, max_redemptions_per_user=1)
+        success, _ = self.run_test("Create Per-User Promotion", "POST", "admin/promotions", 200,
+                                   data=promotion_data, headers=admin_headers)
+        if not success:
+            return False
+        order_data["promotion_code"] = promotion_data["code"]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(checkout, [user_tokens[0]] * (attempts // 10)))
+        placed = sum(1 for _, status, _ in results if status == 200)
+        throttled = sum(1 for _, status, _ in results if status in (429, 503))
+        self.log_test("Per-User Limit Holds For A Single Customer", placed == 1 or (placed == 0 and throttled),
+                      f"Placed: {placed}, Throttled: {throttled}")
+        return placed <= 1
+
     def test_authentication_failures(self):
         """Test authentication failures for protected endpoints"""
         # Test without token
@@ -761,6 +952,219 @@ class ManiraAPITester:
         
         return True
 
+    async def test_local_media_upload(self, client, admin_headers):
+        """Upload a product image and fetch every resized variant"""
+        from PIL import Image
+        import io
+
+        source = io.BytesIO()
+        Image.new("RGB", (2000, 1000), "gold").save(source, "PNG")
+        response = await client.post("/api/admin/media", headers=admin_headers,
+                                      files={"file": ("ring.png", source.getvalue(), "image/png")})
+        upload = response.json() if response.status_code == 200 else {}
+        self.log_test("Local: Media Upload", bool(upload.get("image_id")) and set(upload.get("images", {})) == {"thumb", "card", "zoom"},
+                      f"Status: {response.status_code}, Variants: {sorted(upload.get('images', {}))}")
+        if not upload.get("image_id"):
+            return None
+
+        sizes = {}
+        for variant, url in upload["images"].items():
+            response = await client.get(url)
+            if response.status_code == 200 and response.headers.get("content-type") == "image/jpeg":
+                sizes[variant] = Image.open(io.BytesIO(response.content)).size
+        self.log_test("Local: Media Variants Served Resized",
+                      sizes == {"thumb": (160, 80), "card": (480, 240), "zoom": (1600, 800)}, f"Sizes: {sizes}")
+
+        oversized = await client.post("/api/admin/media", content=b"\0" * (16 * 1024 * 1024),
+                                      headers={**admin_headers, "Content-Type": "multipart/form-data; boundary=x"})
+        self.log_test("Local: Oversized Upload Rejected", oversized.status_code == 413,
+                      f"Status: {oversized.status_code}")
+        return upload["image_id"]
+
+    async def test_local_cache_invalidation(self, client, db, admin_headers, image_id):
+        """An admin edit must replace the cached product list on the next read"""
+        product = {"name": "Cache Ring", "description": "Cached listing", "price": 1200.0, "category": "rings",
+                   "material": "gold", "image_id": image_id, "inventory_count": 50}
+        response = await client.post("/api/admin/products", json=product, headers=admin_headers)
+        if response.status_code != 200:
+            self.log_test("Local: Cached Products Invalidated By Admin Edit", False, f"Create status: {response.status_code}")
+            return None
+        product_id = response.json()["id"]
+
+        await client.get("/api/products")
+        # Change the document behind the cache's back: a cached list keeps the old name
+        await db.products.update_one({"id": product_id}, {"$set": {"name": "Written Directly"}})
+        cached = [p["name"] for p in (await client.get("/api/products")).json() if p["id"] == product_id]
+        self.log_test("Local: Product List Served From Cache", cached == ["Cache Ring"], f"Names: {cached}")
+
+        response = await client.put(f"/api/admin/products/{product_id}", headers=admin_headers,
+                                    json={**product, "name": "Cache Ring II"})
+        fresh = [p["name"] for p in (await client.get("/api/products")).json() if p["id"] == product_id]
+        self.log_test("Local: Cached Products Invalidated By Admin Edit",
+                      response.status_code == 200 and fresh == ["Cache Ring II"],
+                      f"Status: {response.status_code}, Names: {fresh}")
+        return product_id
+
+    async def test_local_guest_cart_merge(self, client, product_id):
+        """A cart built while signed out is merged into the account on sign-up"""
+        response = await client.post("/api/guest-cart/add", json={"product_id": product_id, "quantity": 2})
+        token = response.json().get("guest_cart") if response.status_code == 200 else None
+        guest_items = (await client.get("/api/guest-cart", headers={"X-Guest-Cart": token or ""})).json()
+        self.log_test("Local: Guest Cart Holds Items", token is not None and len(guest_items) == 1,
+                      f"Status: {response.status_code}, Items: {len(guest_items) if isinstance(guest_items, list) else guest_items}")
+
+        response = await client.post("/api/auth/register", json={
+            "email": "guest.merge@test.com", "password": "guest123", "phone": "9876543210",
+            "full_name": "Guest Merge", "guest_cart": token,
+        })
+        if response.status_code != 200:
+            self.log_test("Local: Guest Cart Merged On Sign-Up", False, f"Register status: {response.status_code}")
+            return None
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        cart = (await client.get("/api/cart", headers=headers)).json()
+        quantities = {line["product"]["id"]: line["quantity"] for line in cart}
+        self.log_test("Local: Guest Cart Merged On Sign-Up",
+                      response.json().get("guest_cart_merged") == 1 and quantities == {product_id: 2},
+                      f"Merged: {response.json().get('guest_cart_merged')}, Cart: {quantities}")
+        return headers
+
+    async def test_local_admission(self, client, headers, order_data):
+        """With every checkout slot taken, orders get 503 with a place in line, then go through"""
+        import time
+        from admission import checkout_gate
+
+        saved = checkout_gate.max_concurrent, checkout_gate.hold_seconds
+        checkout_gate.max_concurrent, checkout_gate.hold_seconds = 1, 0.2
+        await checkout_gate.acquire(time.time())
+        try:
+            response = await client.post("/api/orders", json=order_data, headers=headers)
+            detail = response.json().get("detail", {}) if response.status_code == 503 else {}
+            self.log_test("Local: Checkout Queued With 503",
+                          detail.get("position", 0) >= 1 and detail.get("eta_seconds", 0) >= 1
+                          and detail.get("ticket") == response.headers.get("x-queue-ticket")
+                          and response.headers.get("retry-after") == str(detail.get("eta_seconds")),
+                          f"Status: {response.status_code}, Detail: {detail}")
+            ticket = detail.get("ticket", "")
+            retry = await client.post("/api/orders", json=order_data, headers={**headers, "X-Queue-Ticket": ticket})
+            kept = retry.json().get("detail", {}).get("ticket") if retry.status_code == 503 else None
+            self.log_test("Local: Queue Ticket Keeps Place In Line", retry.status_code == 503 and kept == ticket,
+                          f"Status: {retry.status_code}")
+        finally:
+            checkout_gate.release()
+            checkout_gate.max_concurrent, checkout_gate.hold_seconds = saved
+
+        response = await client.post("/api/orders", json=order_data, headers={**headers, "X-Queue-Ticket": ticket})
+        self.log_test("Local: Checkout Admitted Once A Slot Frees", response.status_code == 200,
+                      f"Status: {response.status_code}")
+        return response.json().get("id") if response.status_code == 200 else None
+
+    async def test_local_archived_pagination(self, client, db, headers, order_data, order_ids):
+        """Cursor pages over hot and archived orders return every order once, newest first"""
+        from order_archive import archive_orders
+
+        for _ in range(5 - len(order_ids)):
+            response = await client.post("/api/orders", json=order_data, headers=headers)
+            if response.status_code == 200:
+                order_ids.append(response.json()["id"])
+        long_ago = datetime.now() - timedelta(days=400)
+        for age, order_id in enumerate(order_ids[:3]):
+            await db.orders.update_one({"id": order_id}, {"$set": {
+                "status": "delivered", "created_at": long_ago + timedelta(minutes=age), "updated_at": None}})
+        summary = await archive_orders(db, older_than_days=30, pause=0)
+
+        hot = [o["id"] for o in (await client.get("/api/orders", headers=headers)).json()]
+        pages, seen, cursor = 0, [], None
+        while pages < 10:
+            params = {"limit": 2, "include_archived": "true", **({"cursor": cursor} if cursor else {})}
+            response = await client.get("/api/orders", params=params, headers=headers)
+            seen += [o["id"] for o in response.json()]
+            pages += 1
+            cursor = response.headers.get("x-next-cursor")
+            if not cursor:
+                break
+        # Orders placed back to back can share a stored millisecond, so only the hot set is fixed
+        self.log_test("Local: Archived Orders Paginated",
+                      summary["archived"] == 3 and sorted(hot) == sorted(order_ids[3:])
+                      and sorted(seen[:2]) == sorted(hot) and seen[2:] == order_ids[2::-1],
+                      f"Archived: {summary['archived']}, Hot: {len(hot)}, Paged: {len(seen)} in {pages} pages")
+
+    async def test_local_rate_limits(self, client, email):
+        """Repeated failed logins for one account are cut off with 429 and Retry-After"""
+        statuses = []
+        for _ in range(8):
+            response = await client.post("/api/auth/login", json={"email": email, "password": "wrong-password"})
+            statuses.append(response.status_code)
+            if response.status_code == 429:
+                break
+        self.log_test("Local: Login Rate Limited",
+                      statuses[-1] == 429 and set(statuses[:-1]) == {401} and response.headers.get("retry-after"),
+                      f"Statuses: {statuses}, Retry-After: {response.headers.get('retry-after')}")
+
+    def run_local_tests(self):
+        """
+        Behaviour checks that need a controlled server: the app runs in this process
+        on an in-memory database (mongomock-motor) and is driven over ASGI with httpx.
+        """
+        print("🧪 Starting In-Process Behaviour Tests...")
+        print("=" * 50)
+        import shutil
+        import tempfile
+
+        media_root = tempfile.mkdtemp(prefix="manira_media_")
+        os.environ["MEDIA_ROOT"] = media_root
+        os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+        os.environ.setdefault("DB_NAME", "manira_local_tests")
+        sys.path.insert(0, str(BACKEND_DIR))
+        import httpx
+        from mongomock_motor import AsyncMongoMockClient
+        import server
+
+        server.client = AsyncMongoMockClient()
+        server.db = server.ProfiledDatabase(server.client[os.environ["DB_NAME"]])
+
+        async def run():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://local") as client:
+                response = await client.post("/api/auth/register", json={
+                    "email": "local.admin@test.com", "password": "admin123",
+                    "phone": "9876543210", "full_name": "Local Admin",
+                })
+                admin = response.json()
+                await server.db.users.update_one({"id": admin["user"]["id"]}, {"$set": {"is_admin": True}})
+                admin_headers = {"Authorization": f"Bearer {admin['access_token']}"}
+
+                image_id = await self.test_local_media_upload(client, admin_headers)
+                if not image_id:
+                    return
+                product_id = await self.test_local_cache_invalidation(client, server.db, admin_headers, image_id)
+                if not product_id:
+                    return
+                headers = await self.test_local_guest_cart_merge(client, product_id)
+                if headers:
+                    order_data = {"items": [{"product_id": product_id, "quantity": 1}],
+                                  "shipping_address": "123 Test Street, Test City", "phone": "9876543210"}
+                    order_id = await self.test_local_admission(client, headers, order_data)
+                    await self.test_local_archived_pagination(
+                        client, server.db, headers, order_data, [order_id] if order_id else [])
+                await self.test_local_rate_limits(client, "guest.merge@test.com")
+
+        try:
+            asyncio.run(run())
+        finally:
+            server.shutdown_media_pool()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        print("\n" + "=" * 50)
+        print(f"📊 In-Process Test Results: {self.tests_passed}/{self.tests_run} passed")
+        if self.tests_passed == self.tests_run:
+            print("🎉 All in-process tests passed!")
+            return 0
+        print("❌ Some in-process tests failed!")
+        for result in self.test_results:
+            if not result['success']:
+                print(f"  - {result['test']}: {result['details']}")
+        return 1
+
     def run_all_tests(self):
         """Run all API tests"""
         print("🚀 Starting Manira API Tests...")
@@ -793,6 +1197,11 @@ class ManiraAPITester:
         if admin_success:
             self.test_admin_orders()
 
+        # Test promotion limits under concurrent checkouts
+        self.test_promotion_limits_mongod()
+        if admin_success and product_id:
+            self.test_promotion_redemption_limits(product_id)
+
         # Print results
         print("\n" + "=" * 50)
         print(f"📊 Test Results: {self.tests_passed}/{self.tests_run} passed")
@@ -849,6 +1258,8 @@ class ManiraAPITester:
 
 def main():
     tester = ManiraAPITester()
+    if "--local" in sys.argv:
+        return tester.run_local_tests()
     # Run focused tests for the specific features mentioned in the review request
     return tester.run_focused_tests()
 
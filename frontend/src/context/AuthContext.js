@@ -1,11 +1,15 @@
 import React, { createContext, useContext, useState, useEffect } from 'react';
 import axios from 'axios';
+import { clearCausalToken, installCausalToken } from '../lib/causalToken';
+import { clearGuestCart, getGuestCart } from '../lib/guestCart';
 
 const AuthContext = createContext();
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+installCausalToken();
+
 export const useAuth = () => {
   const context = useContext(AuthContext);
   if (!context) {
@@ -44,12 +48,15 @@ export const AuthProvider = ({ children }) => {
 
   const login = async (email, password) => {
     try {
+      // The server merges the guest cart into the account as part of login
       const response = await axios.post(`${API}/auth/login`, {
         email,
-        password
+        password,
+        guest_cart: getGuestCart()
       });
 
       const { access_token, user: userData } = response.data;
+      clearGuestCart();
       
       setToken(access_token);
       setUser(userData);
@@ -71,9 +78,10 @@ export const AuthProvider = ({ children }) => {
 
   const register = async (userData) => {
     try {
-      const response = await axios.post(`${API}/auth/register`, userData);
+      const response = await axios.post(`${API}/auth/register`, { ...userData, guest_cart: getGuestCart() });
       
       const { access_token, user: newUser } = response.data;
+      clearGuestCart();
       
       setToken(access_token);
       setUser(newUser);
@@ -98,6 +106,7 @@ export const AuthProvider = ({ children }) => {
     setToken(null);
     localStorage.removeItem('token');
     localStorage.removeItem('user');
+    clearCausalToken();
     delete axios.defaults.headers.common['Authorization'];
   };
 
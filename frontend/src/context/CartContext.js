@@ -2,6 +2,7 @@ import React, { createContext, useContext, useState, useEffect } from 'react';
 import axios from 'axios';
 import { useAuth } from './AuthContext';
 import { toast } from 'sonner';
+import { guestCartHeaders, setGuestCart } from '../lib/guestCart';
 
 const CartContext = createContext();
 
@@ -21,21 +22,24 @@ export const CartProvider = ({ children }) => {
   const [loading, setLoading] = useState(false);
   const { user } = useAuth();
 
-  // Fetch cart items when user logs in
+  // Signed-in carts live on the server; guests use the signed cart token
   useEffect(() => {
-    if (user) {
-      fetchCartItems();
-    } else {
-      setCartItems([]);
-    }
+    fetchCartItems();
   }, [user]);
 
   const fetchCartItems = async () => {
     try {
       setLoading(true);
-      const response = await axios.get(`${API}/cart`);
+      const response = user
+        ? await axios.get(`${API}/cart`)
+        : await axios.get(`${API}/guest-cart`, { headers: guestCartHeaders() });
       setCartItems(response.data);
     } catch (error) {
+      if (!user && error.response?.status === 400) {
+        // Expired or tampered guest cart: start a fresh one
+        setGuestCart(null);
+        setCartItems([]);
+      }
       console.error('Error fetching cart:', error);
     } finally {
       setLoading(false);
@@ -43,16 +47,19 @@ export const CartProvider = ({ children }) => {
   };
 
   const addToCart = async (productId, quantity = 1) => {
-    if (!user) {
-      toast.error('Please login to add items to cart');
-      return;
-    }
-
     try {
-      await axios.post(`${API}/cart/add`, {
-        product_id: productId,
-        quantity: quantity
-      });
+      if (user) {
+        await axios.post(`${API}/cart/add`, {
+          product_id: productId,
+          quantity: quantity
+        });
+      } else {
+        const response = await axios.post(`${API}/guest-cart/add`, {
+          product_id: productId,
+          quantity: quantity
+        }, { headers: guestCartHeaders() });
+        setGuestCart(response.data.guest_cart);
+      }
       
       await fetchCartItems(); // Refresh cart
       toast.success('Item added to cart');
@@ -64,8 +71,12 @@ export const CartProvider = ({ children }) => {
 
   const removeFromCart = async (productId) => {
     try {
-      // This endpoint needs to be implemented in backend
-      await axios.delete(`${API}/cart/${productId}`);
+      if (user) {
+        await axios.delete(`${API}/cart/${productId}`);
+      } else {
+        const response = await axios.delete(`${API}/guest-cart/${productId}`, { headers: guestCartHeaders() });
+        setGuestCart(response.data.guest_cart);
+      }
       await fetchCartItems(); // Refresh cart
       toast.success('Item removed from cart');
     } catch (error) {
@@ -81,8 +92,12 @@ export const CartProvider = ({ children }) => {
     }
 
     try {
-      // This endpoint needs to be implemented in backend
-      await axios.put(`${API}/cart/${productId}`, { quantity });
+      if (user) {
+        await axios.put(`${API}/cart/${productId}`, { quantity });
+      } else {
+        const response = await axios.put(`${API}/guest-cart/${productId}`, { quantity }, { headers: guestCartHeaders() });
+        setGuestCart(response.data.guest_cart);
+      }
       await fetchCartItems(); // Refresh cart
     } catch (error) {
       console.error('Error updating quantity:', error);
@@ -92,6 +107,7 @@ export const CartProvider = ({ children }) => {
 
   const getCartTotal = () => {
     return cartItems.reduce((total, item) => {
+      if (item.available === false) return total;
       return total + (item.product.price * item.quantity);
     }, 0);
   };
@@ -0,0 +1,29 @@
+import axios from 'axios';
+
+const STORAGE_KEY = 'causalToken';
+const HEADER = 'X-Causal-Token';
+
+// Order, payment and admin list responses carry a token marking the writes
+// they made. Sending the latest one back lets the API read those writes even
+// from a lagging secondary or after a failover, so a just-placed order shows
+// up in the order history and an admin's review shows up in the admin lists.
+export function installCausalToken() {
+  axios.interceptors.request.use((config) => {
+    const token = sessionStorage.getItem(STORAGE_KEY);
+    if (token) {
+      config.headers[HEADER] = token;
+    }
+    return config;
+  });
+  axios.interceptors.response.use((response) => {
+    const token = response.headers[HEADER.toLowerCase()];
+    if (token) {
+      sessionStorage.setItem(STORAGE_KEY, token);
+    }
+    return response;
+  });
+}
+
+export function clearCausalToken() {
+  sessionStorage.removeItem(STORAGE_KEY);
+}
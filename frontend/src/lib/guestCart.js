@@ -0,0 +1,26 @@
+const STORAGE_KEY = 'guestCart';
+const HEADER = 'X-Guest-Cart';
+
+// Anonymous visitors keep their cart in a token signed by the API. Every
+// guest-cart call sends it back and gets an updated one; logging in or
+// registering hands it over once so the server merges it into the account.
+export function getGuestCart() {
+  return localStorage.getItem(STORAGE_KEY);
+}
+
+export function setGuestCart(token) {
+  if (token) {
+    localStorage.setItem(STORAGE_KEY, token);
+  } else {
+    localStorage.removeItem(STORAGE_KEY);
+  }
+}
+
+export function clearGuestCart() {
+  localStorage.removeItem(STORAGE_KEY);
+}
+
+export function guestCartHeaders() {
+  const token = getGuestCart();
+  return token ? { [HEADER]: token } : {};
+}
@@ -0,0 +1,35 @@
+import axios from 'axios';
+import { toast } from 'sonner';
+
+const MAX_ATTEMPTS = 40;
+const QUEUE_TOAST_ID = 'checkout-queue';
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// POST to a checkout endpoint, waiting in line while the server answers 503.
+// The queue ticket from each 503 is sent back so the place in line is kept,
+// and the customer sees their position and ETA while they wait.
+export async function postWithWaitingRoom(url, data) {
+  let ticket = null;
+  try {
+    for (let attempt = 1; ; attempt++) {
+      try {
+        return await axios.post(url, data, ticket ? { headers: { 'X-Queue-Ticket': ticket } } : undefined);
+      } catch (error) {
+        const queue = error.response?.status === 503 ? error.response.data?.detail : null;
+        if (!queue?.ticket || attempt >= MAX_ATTEMPTS) {
+          throw error;
+        }
+        ticket = queue.ticket;
+        toast.loading(
+          `Checkout is busy. You are number ${queue.position} in line (about ${queue.eta_seconds}s)...`,
+          { id: QUEUE_TOAST_ID }
+        );
+        const retryAfter = parseInt(error.response.headers['retry-after'], 10) || 1;
+        await sleep(retryAfter * 1000);
+      }
+    }
+  } finally {
+    toast.dismiss(QUEUE_TOAST_ID);
+  }
+}
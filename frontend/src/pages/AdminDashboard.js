@@ -3,9 +3,12 @@ import { Plus, Package, Users, ShoppingBag, Edit, Trash2, User, Download } from
 import axios from 'axios';
 import { toast } from 'sonner';
 import * as XLSX from 'xlsx';
+import { useAuth } from '../context/AuthContext';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const ORDER_FEED_URL = `${(BACKEND_URL || window.location.origin).replace(/^http/, 'ws')}/api/admin/orders/feed`;
+const FEED_RETRY_MS = 3000;
 
 const AdminDashboard = () => {
   const [activeTab, setActiveTab] = useState('products');
@@ -22,6 +25,7 @@ const AdminDashboard = () => {
   const [newCategory, setNewCategory] = useState('');
   const [showPartialModal, setShowPartialModal] = useState(false);
   const [selectedOrder, setSelectedOrder] = useState(null);
+  const { token } = useAuth();
   const [newPromotion, setNewPromotion] = useState({
     name: '',
     discount_percentage: '',
@@ -30,6 +34,8 @@ const AdminDashboard = () => {
     start_date: '',
     end_date: '',
     min_order_amount: '',
+    max_redemptions: '',
+    max_redemptions_per_user: '',
     code: ''
   });
   const [editingPromotion, setEditingPromotion] = useState(null);
@@ -78,16 +84,16 @@ const AdminDashboard = () => {
     size: '',
     weight: '',
     image_url: '',
+    image_id: null,
     inventory_count: '',
     sku: ''
   });
+  const [uploadingImage, setUploadingImage] = useState(false);
 
   useEffect(() => {
     if (activeTab === 'products') {
       fetchProducts();
       fetchCategories();
-    } else if (activeTab === 'orders') {
-      fetchOrders();
     } else if (activeTab === 'categories') {
       fetchCategories();
     } else if (activeTab === 'customers') {
@@ -99,6 +105,54 @@ const AdminDashboard = () => {
     }
   }, [activeTab]);
 
+  // Live order feed while the orders tab is open: a snapshot, then diffs applied in place.
+  // The feed only carries changes made on the worker it is connected to, so the admin's
+  // own reviews and deletes refetch the list instead of waiting for it
+  useEffect(() => {
+    if (activeTab !== 'orders' || !token) return undefined;
+    let socket = null;
+    let retryTimer = null;
+    let stopped = false;
+
+    const applyMessage = (message) => {
+      if (message.type === 'snapshot') {
+        setOrders(message.orders);
+        setLoading(false);
+      } else if (message.type === 'order.created') {
+        setOrders((current) => [message.order, ...current.filter((order) => order.id !== message.order.id)]);
+      } else if (message.type === 'order.updated') {
+        setOrders((current) => current.map((order) => (
+          order.id === message.order_id ? { ...order, ...message.changes } : order
+        )));
+      } else if (message.type === 'order.deleted') {
+        const deleted = new Set(message.order_ids);
+        setOrders((current) => current.filter((order) => !deleted.has(order.id)));
+      }
+    };
+
+    const connect = () => {
+      setLoading(true);
+      socket = new WebSocket(`${ORDER_FEED_URL}?token=${encodeURIComponent(token)}`);
+      socket.onmessage = (event) => applyMessage(JSON.parse(event.data));
+      socket.onclose = (event) => {
+        // 1008: bad token or not an admin, retrying will not help
+        if (stopped || event.code === 1008) {
+          setLoading(false);
+          return;
+        }
+        // Overflow (1013) or a dropped connection: reconnect for a fresh snapshot
+        retryTimer = setTimeout(connect, FEED_RETRY_MS);
+      };
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(retryTimer);
+      if (socket) socket.close();
+    };
+  }, [activeTab, token]);
+
   const fetchCategories = async () => {
     try {
       const response = await axios.get(`${API}/admin/categories`);
@@ -200,7 +254,7 @@ const AdminDashboard = () => {
       setShowAddProduct(false);
       setNewProduct({
         name: '', description: '', price: '', category: 'necklaces',
-        material: 'American Diamond', size: '', weight: '', image_url: '', inventory_count: '', sku: ''
+        material: 'American Diamond', size: '', weight: '', image_url: '', image_id: null, inventory_count: '', sku: ''
       });
       fetchProducts();
     } catch (error) {
@@ -209,6 +263,23 @@ const AdminDashboard = () => {
     }
   };
 
+  // Uploads go through the media store, which keeps the file and builds the thumb/card/zoom variants
+  const uploadProductImage = async (file) => {
+    const formData = new FormData();
+    formData.append('file', file);
+    setUploadingImage(true);
+    try {
+      const response = await axios.post(`${API}/admin/media`, formData);
+      const { image_id: imageId, images } = response.data;
+      setNewProduct((current) => ({ ...current, image_id: imageId, image_url: `${BACKEND_URL || ''}${images.zoom}` }));
+    } catch (error) {
+      console.error('Error uploading image:', error);
+      toast.error(error.response?.status === 413 ? 'Image is too large' : 'Failed to upload image');
+    } finally {
+      setUploadingImage(false);
+    }
+  };
+
   const startEditProduct = (product) => {
     setEditingProduct(product);
     setNewProduct({
@@ -220,6 +291,7 @@ const AdminDashboard = () => {
       size: product.size || '',
       weight: product.weight || '',
       image_url: product.image_url,
+      image_id: product.image_id || null,
       inventory_count: product.inventory_count.toString(),
       sku: product.sku || ''
     });
@@ -396,7 +468,9 @@ const AdminDashboard = () => {
         ...newPromotion,
         discount_percentage: newPromotion.discount_percentage ? parseFloat(newPromotion.discount_percentage) : null,
         discount_amount: newPromotion.discount_amount ? parseFloat(newPromotion.discount_amount) : null,
-        min_order_amount: newPromotion.min_order_amount ? parseFloat(newPromotion.min_order_amount) : null
+        min_order_amount: newPromotion.min_order_amount ? parseFloat(newPromotion.min_order_amount) : null,
+        max_redemptions: newPromotion.max_redemptions ? parseInt(newPromotion.max_redemptions) : null,
+        max_redemptions_per_user: newPromotion.max_redemptions_per_user ? parseInt(newPromotion.max_redemptions_per_user) : null
       };
       
       if (editingPromotion) {
@@ -413,7 +487,7 @@ const AdminDashboard = () => {
       setShowAddPromotion(false);
       setNewPromotion({
         name: '', discount_percentage: '', discount_amount: '', applicable_products: [],
-        start_date: '', end_date: '', min_order_amount: '', code: ''
+        start_date: '', end_date: '', min_order_amount: '', max_redemptions: '', max_redemptions_per_user: '', code: ''
       });
       fetchPromotions();
     } catch (error) {
@@ -445,6 +519,8 @@ const AdminDashboard = () => {
       start_date: new Date(promotion.start_date).toISOString().split('T')[0],
       end_date: new Date(promotion.end_date).toISOString().split('T')[0],
       min_order_amount: promotion.min_order_amount || '',
+      max_redemptions: promotion.max_redemptions || '',
+      max_redemptions_per_user: promotion.max_redemptions_per_user || '',
       code: promotion.code
     });
     setShowAddPromotion(true);
@@ -993,6 +1069,14 @@ const AdminDashboard = () => {
                         <span>Valid Until:</span>
                         <span>{new Date(promotion.end_date).toLocaleDateString()}</span>
                       </div>
+                      <div className="flex justify-between">
+                        <span>Redeemed:</span>
+                        <span>
+                          {promotion.redemption_count || 0}
+                          {promotion.max_redemptions ? ` / ${promotion.max_redemptions}` : ''}
+                          {promotion.max_redemptions_per_user ? ` (max ${promotion.max_redemptions_per_user} per customer)` : ''}
+                        </span>
+                      </div>
                     </div>
                     
                     <div className="flex space-x-2">
@@ -1570,7 +1654,7 @@ const AdminDashboard = () => {
                   <div className="space-y-2">
                     {order.items.map((item, index) => (
                       <div key={index} className="flex justify-between items-center text-sm">
-                        <span>Product ID: {item.product_id.slice(-8).toUpperCase()}</span>
+                        <span>{item.name || `Product ID: ${item.product_id.slice(-8).toUpperCase()}`}</span>
                         <span>Qty: {item.quantity} × ₹{item.price.toLocaleString()}</span>
                         {item.status && (
                           <span className={`px-2 py-1 rounded text-xs ${
@@ -1721,6 +1805,25 @@ const AdminDashboard = () => {
                   className="w-full p-3 border border-gray-300 rounded-lg focus:outline-none focus:ring-2 focus:ring-blue-500"
                 />
                 
+                <div className="grid grid-cols-2 gap-4">
+                  <input
+                    type="number"
+                    min="1"
+                    placeholder="Total Redemptions Limit (Optional)"
+                    value={newPromotion.max_redemptions}
+                    onChange={(e) => setNewPromotion({...newPromotion, max_redemptions: e.target.value})}
+                    className="w-full p-3 border border-gray-300 rounded-lg focus:outline-none focus:ring-2 focus:ring-blue-500"
+                  />
+                  <input
+                    type="number"
+                    min="1"
+                    placeholder="Per Customer Limit (Optional)"
+                    value={newPromotion.max_redemptions_per_user}
+                    onChange={(e) => setNewPromotion({...newPromotion, max_redemptions_per_user: e.target.value})}
+                    className="w-full p-3 border border-gray-300 rounded-lg focus:outline-none focus:ring-2 focus:ring-blue-500"
+                  />
+                </div>
+                
                 <div className="grid grid-cols-2 gap-4">
                   <div>
                     <label className="block text-sm font-medium text-gray-700 mb-2">Start Date</label>
@@ -1787,7 +1890,8 @@ const AdminDashboard = () => {
                       <div key={index} className="border border-gray-200 rounded-lg p-4">
                         <div className="flex justify-between items-start mb-3">
                           <div>
-                            <p className="font-medium">Product #{item.product_id.slice(-8).toUpperCase()}</p>
+                            <p className="font-medium">{item.name || `Product #${item.product_id.slice(-8).toUpperCase()}`}</p>
+                            {item.sku && <p className="text-xs text-gray-500">SKU: {item.sku}</p>}
                             <p className="text-sm text-gray-600">Price: ₹{item.price.toLocaleString()} × {item.quantity}</p>
                             <p className="text-sm text-gray-600">Subtotal: ₹{(item.price * item.quantity).toLocaleString()}</p>
                           </div>
@@ -2003,14 +2107,15 @@ const AdminDashboard = () => {
                       onChange={(e) => {
                         const file = e.target.files[0];
                         if (file) {
-                          // Create object URL for preview
-                          const imageUrl = URL.createObjectURL(file);
-                          setNewProduct({...newProduct, image_url: imageUrl, image_file: file});
+                          uploadProductImage(file);
                         }
                       }}
+                      disabled={uploadingImage}
                       className="w-full p-2 text-sm text-gray-600"
                     />
-                    <p className="text-xs text-gray-500 mt-1">Upload your own product image (JPG, PNG, WEBP)</p>
+                    <p className="text-xs text-gray-500 mt-1">
+                      {uploadingImage ? 'Uploading image...' : 'Upload your own product image (JPG, PNG, WEBP)'}
+                    </p>
                   </div>
                   
                   {/* URL Input Option */}
@@ -2019,7 +2124,7 @@ const AdminDashboard = () => {
                       type="url"
                       placeholder="Or paste image URL here..."
                       value={newProduct.image_url}
-                      onChange={(e) => setNewProduct({...newProduct, image_url: e.target.value})}
+                      onChange={(e) => setNewProduct({...newProduct, image_url: e.target.value, image_id: null})}
                       className="w-full p-3 border border-gray-300 rounded-lg focus:outline-none focus:ring-2 focus:ring-blue-500"
                     />
                   </div>
@@ -2031,7 +2136,7 @@ const AdminDashboard = () => {
                         <button
                           key={index}
                           type="button"
-                          onClick={() => setNewProduct({...newProduct, image_url: img})}
+                          onClick={() => setNewProduct({...newProduct, image_url: img, image_id: null})}
                           className={`border-2 rounded-lg p-1 hover:border-blue-300 transition-colors ${
                             newProduct.image_url === img ? 'border-blue-500 bg-blue-50' : 'border-gray-200'
                           }`}
@@ -2064,6 +2169,7 @@ const AdminDashboard = () => {
                 <div className="flex space-x-4 pt-4">
                   <button
                     type="submit"
+                    disabled={uploadingImage}
                     className="flex-1 manira-btn-primary py-3"
                   >
                     {editingProduct ? 'Update Product' : 'Add Product'}
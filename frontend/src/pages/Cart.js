@@ -130,6 +130,9 @@ const Cart = () => {
                         <p className="text-lg font-bold text-blue-600 mt-2">
                           ₹{item.product.price.toLocaleString()}
                         </p>
+                        {item.available === false && (
+                          <p className="text-sm text-red-600 mt-1">No longer available - please remove it to check out</p>
+                        )}
                       </div>
                       
                       <div className="flex items-center space-x-3">
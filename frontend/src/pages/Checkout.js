@@ -5,6 +5,7 @@ import { useAuth } from '../context/AuthContext';
 import { MapPin, CreditCard, Package, Tag } from 'lucide-react';
 import axios from 'axios';
 import { toast } from 'sonner';
+import { postWithWaitingRoom } from '../lib/waitingRoom';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -65,14 +66,15 @@ const Checkout = () => {
         final_amount: finalTotal
       };
 
-      const response = await axios.post(`${API}/orders`, orderData);
+      const response = await postWithWaitingRoom(`${API}/orders`, orderData);
       
       // Show UPI payment modal
       setShowUpiModal(true);
       
     } catch (error) {
       console.error('Error placing order:', error);
-      toast.error('Failed to place order');
+      const detail = error.response?.data?.detail;
+      toast.error(detail?.message || detail || 'Failed to place order');
       setLoading(false);
     }
   };
@@ -27,31 +27,25 @@ const Homepage = () => {
   });
 
   useEffect(() => {
-    fetchFeaturedProducts();
-    fetchSettings();
+    fetchStorefront();
   }, []);
 
-  const fetchFeaturedProducts = async () => {
+  const fetchStorefront = async () => {
     try {
-      const response = await axios.get(`${API}/products?limit=4`);
-      setFeaturedProducts(response.data.slice(0, 4));
-    } catch (error) {
-      console.error('Error fetching featured products:', error);
-    } finally {
-      setLoading(false);
-    }
-  };
-
-  const fetchSettings = async () => {
-    try {
-      const response = await axios.get(`${API}/admin/settings`);
+      // Settings, featured and trending products in a single request
+      const response = await axios.get(`${API}/storefront/bootstrap`);
+      const { settings: storeSettings, featured_products, trending } = response.data;
+      const bestsellers = trending.map(entry => entry.product);
+      setFeaturedProducts((bestsellers.length >= 4 ? bestsellers : featured_products).slice(0, 4));
       setSettings(prevSettings => ({
         ...prevSettings,
-        ...response.data
+        ...storeSettings
       }));
     } catch (error) {
-      console.error('Error fetching settings:', error);
+      console.error('Error fetching storefront:', error);
       // Continue with default settings if fetch fails
+    } finally {
+      setLoading(false);
     }
   };
 
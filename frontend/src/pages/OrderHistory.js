@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { Package, Calendar, MapPin, CreditCard } from 'lucide-react';
 import axios from 'axios';
 import { toast } from 'sonner';
+import { useAuth } from '../context/AuthContext';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -9,15 +10,41 @@ const API = `${BACKEND_URL}/api`;
 const OrderHistory = () => {
   const [orders, setOrders] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [summary, setSummary] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const { token } = useAuth();
 
   useEffect(() => {
     fetchOrders();
   }, []);
 
+  // Live status and payment updates; EventSource reconnects with Last-Event-ID by itself
+  useEffect(() => {
+    if (!token) return undefined;
+    const source = new EventSource(`${API}/orders/events?token=${encodeURIComponent(token)}`);
+    source.addEventListener('order.updated', (event) => {
+      const { order_id: orderId, ...changes } = JSON.parse(event.data);
+      setOrders((current) => current.map((order) => (order.id === orderId ? { ...order, ...changes } : order)));
+      if (changes.status) {
+        // Rejections and cancellations change the spend totals
+        axios.get(`${API}/orders/summary`).then((response) => setSummary(response.data)).catch(() => {});
+      }
+    });
+    // The server could not replay what we missed (restart or another worker): refetch once
+    source.addEventListener('resync', () => fetchOrders());
+    return () => source.close();
+  }, [token]);
+
   const fetchOrders = async () => {
     try {
-      const response = await axios.get(`${API}/orders`);
-      setOrders(response.data);
+      const [ordersResponse, summaryResponse] = await Promise.all([
+        axios.get(`${API}/orders`),
+        axios.get(`${API}/orders/summary`)
+      ]);
+      setOrders(ordersResponse.data);
+      setNextCursor(ordersResponse.headers['x-next-cursor'] || null);
+      setSummary(summaryResponse.data);
     } catch (error) {
       console.error('Error fetching orders:', error);
       toast.error('Failed to load orders');
@@ -26,6 +53,20 @@ const OrderHistory = () => {
     }
   };
 
+  const loadMoreOrders = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/orders`, { params: { cursor: nextCursor } });
+      setOrders((current) => [...current, ...response.data]);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Error loading more orders:', error);
+      toast.error('Failed to load more orders');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const getStatusColor = (status) => {
     switch (status) {
       case 'pending': return 'bg-yellow-100 text-yellow-800';
@@ -68,6 +109,25 @@ const OrderHistory = () => {
           Order History
         </h1>
         
+        {summary && summary.order_count > 0 && (
+          <div className="bg-white rounded-2xl shadow-lg p-6 mb-8 grid grid-cols-1 sm:grid-cols-3 gap-4 text-center">
+            <div>
+              <div className="text-sm text-gray-600">Orders</div>
+              <div className="text-2xl font-bold text-gray-900">{summary.order_count}</div>
+            </div>
+            <div>
+              <div className="text-sm text-gray-600">Total Spent</div>
+              <div className="text-2xl font-bold text-blue-600">₹{summary.lifetime_spend.toLocaleString()}</div>
+            </div>
+            <div>
+              <div className="text-sm text-gray-600">Last Order</div>
+              <div className="text-2xl font-bold text-gray-900">
+                {summary.last_order_at ? new Date(summary.last_order_at).toLocaleDateString() : '—'}
+              </div>
+            </div>
+          </div>
+        )}
+        
         {orders.length === 0 ? (
           <div className="bg-white rounded-2xl shadow-lg p-8 text-center">
             <Package className="h-24 w-24 text-gray-300 mx-auto mb-6" />
@@ -128,7 +188,7 @@ const OrderHistory = () => {
                       <div className="space-y-2">
                         {order.items.map((item, index) => (
                           <div key={index} className="flex justify-between text-sm">
-                            <span>Product ID: {item.product_id.slice(-8).toUpperCase()}</span>
+                            <span>{item.name || `Product ID: ${item.product_id.slice(-8).toUpperCase()}`}</span>
                             <span>Qty: {item.quantity} × ₹{item.price.toLocaleString()}</span>
                           </div>
                         ))}
@@ -194,6 +254,17 @@ const OrderHistory = () => {
                 )}
               </div>
             ))}
+            {nextCursor && (
+              <div className="text-center">
+                <button
+                  onClick={loadMoreOrders}
+                  disabled={loadingMore}
+                  className="px-6 py-2 bg-blue-600 text-white rounded-lg hover:bg-blue-700 disabled:opacity-50"
+                >
+                  {loadingMore ? 'Loading...' : 'Load More Orders'}
+                </button>
+              </div>
+            )}
           </div>
         )}
       </div>
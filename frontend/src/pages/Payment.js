@@ -4,6 +4,7 @@ import { CreditCard, CheckCircle, Clock, ArrowLeft } from 'lucide-react';
 import axios from 'axios';
 import { toast } from 'sonner';
 import { useAuth } from '../context/AuthContext';
+import { postWithWaitingRoom } from '../lib/waitingRoom';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -63,7 +64,7 @@ const Payment = () => {
     
     try {
       // Create Razorpay order
-      const orderResponse = await axios.post(`${API}/payment/create-order/${orderId}`);
+      const orderResponse = await postWithWaitingRoom(`${API}/payment/create-order/${orderId}`);
       const { razorpay_order_id, amount, currency, key_id } = orderResponse.data;
       
       // Initialize Razorpay
@@ -218,7 +219,7 @@ const Payment = () => {
                 {order.items.map((item, index) => (
                   <div key={index} className="flex justify-between items-center">
                     <div>
-                      <span className="text-gray-900">Product #{item.product_id.slice(-8).toUpperCase()}</span>
+                      <span className="text-gray-900">{item.name || `Product #${item.product_id.slice(-8).toUpperCase()}`}</span>
                       {item.status && (
                         <span className={`ml-2 px-2 py-1 rounded text-xs ${
                           item.status === 'accepted' ? 'bg-green-100 text-green-800' : 'bg-gray-100 text-gray-800'
@@ -0,0 +1,104 @@
+"""
+Backfill order line snapshots (name, SKU, image, unit price) on orders placed
+before checkout started storing them.
+
+Orders are scanned in batches; each batch resolves its products with one $in
+query and is written back with one unordered bulk_write. Lines keep the
+price and review status they already had. Lines whose product has since been
+deleted are labelled "Unavailable product". Each update is conditional on the
+order's updated_at, so an order edited mid-run is skipped and picked up by
+the next run. Safe to re-run: only orders with unsnapshotted lines match.
+
+Example:
+    python scripts/backfill_order_lines.py --batch-size 500 --dry-run
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+BACKEND_DIR = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+load_dotenv(BACKEND_DIR / '.env')
+
+from server import OrderLine, order_line  # noqa: E402
+
+NEEDS_BACKFILL = {"items": {"$elemMatch": {"name": {"$exists": False}}}}
+
+
+def snapshot_items(items, products):
+    lines = []
+    for item in items:
+        if "name" in item:
+            lines.append(item)
+            continue
+        product = products.get(item["product_id"])
+        if product:
+            line = order_line(product, item.get("quantity", 1))
+        else:
+            line = OrderLine(product_id=item["product_id"], name="Unavailable product",
+                             quantity=item.get("quantity", 1))
+        if "price" in item:
+            line.price = item["price"]
+        line.status = item.get("status")
+        lines.append(line.dict())
+    return lines
+
+
+async def backfill_batch(db, orders, dry_run):
+    product_ids = {item["product_id"] for order in orders for item in order["items"] if "name" not in item}
+    products = {
+        product["id"]: product
+        for product in await db.products.find({"id": {"$in": list(product_ids)}}).to_list(length=len(product_ids))
+    }
+    requests = [
+        UpdateOne(
+            {"id": order["id"], "updated_at": order.get("updated_at")},
+            {"$set": {"items": snapshot_items(order["items"], products)}}
+        )
+        for order in orders
+    ]
+    if dry_run:
+        return len(requests), len(product_ids) - len(products)
+    result = await db.orders.bulk_write(requests, ordered=False)
+    return result.modified_count, len(product_ids) - len(products)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Snapshot product details into existing order lines")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Count what would change without writing")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    started = time.perf_counter()
+    updated = missing = 0
+
+    batch = []
+    async for order in db.orders.find(NEEDS_BACKFILL, {"_id": 0, "id": 1, "items": 1, "updated_at": 1}):
+        batch.append(order)
+        if len(batch) >= args.batch_size:
+            changed, unavailable = await backfill_batch(db, batch, args.dry_run)
+            updated += changed
+            missing += unavailable
+            batch = []
+    if batch:
+        changed, unavailable = await backfill_batch(db, batch, args.dry_run)
+        updated += changed
+        missing += unavailable
+
+    action = "Would update" if args.dry_run else "Updated"
+    print(f"{action} {updated} orders in {time.perf_counter() - started:.1f}s "
+          f"({missing} referenced products no longer exist)")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
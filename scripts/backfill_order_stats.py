@@ -0,0 +1,83 @@
+"""
+Backfill the per-user order summary (order_stats) on the user records.
+
+Checkout and order updates keep order_stats current with atomic $inc, but
+users who ordered before the counters existed start from zero. This script
+recomputes every user's count, lifetime spend (orders not cancelled or
+rejected) and last order date with one $group aggregation per collection,
+hot orders and the archive, and writes them back with one unordered
+bulk_write per batch. The write replaces the counters outright, so run it
+before the release that starts incrementing them, or during a quiet period.
+
+Example:
+    python scripts/backfill_order_stats.py --batch-size 1000 --dry-run
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+BACKEND_DIR = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+load_dotenv(BACKEND_DIR / '.env')
+
+from order_archive import ARCHIVE_COLLECTION  # noqa: E402
+
+STATS_PIPELINE = [
+    {"$group": {
+        "_id": "$user_id",
+        "order_count": {"$sum": 1},
+        "lifetime_spend": {"$sum": {"$cond": [
+            {"$in": ["$status", ["cancelled", "rejected"]]}, 0, {"$ifNull": ["$total_amount", 0]}
+        ]}},
+        "last_order_at": {"$max": "$created_at"},
+    }},
+]
+
+
+async def collect_stats(db):
+    stats = {}
+    for collection in (db.orders, db[ARCHIVE_COLLECTION]):
+        async for row in collection.aggregate(STATS_PIPELINE):
+            current = stats.setdefault(row["_id"], {"order_count": 0, "lifetime_spend": 0, "last_order_at": None})
+            current["order_count"] += row["order_count"]
+            current["lifetime_spend"] += row["lifetime_spend"]
+            if current["last_order_at"] is None or (row["last_order_at"] and row["last_order_at"] > current["last_order_at"]):
+                current["last_order_at"] = row["last_order_at"]
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Recompute per-user order summary counters")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="Count what would change without writing")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    started = time.perf_counter()
+    stats = await collect_stats(db)
+
+    updated = 0
+    requests = [UpdateOne({"id": user_id}, {"$set": {"order_stats": values}}) for user_id, values in stats.items()]
+    for start in range(0, len(requests), args.batch_size):
+        batch = requests[start:start + args.batch_size]
+        if args.dry_run:
+            updated += len(batch)
+            continue
+        result = await db.users.bulk_write(batch, ordered=False)
+        updated += result.modified_count
+
+    action = "Would update" if args.dry_run else "Updated"
+    print(f"{action} order stats for {updated} users in {time.perf_counter() - started:.1f}s")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
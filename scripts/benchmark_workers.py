@@ -0,0 +1,172 @@
+"""
+Throughput of the production launcher at 1, 2, 4 and 8 workers.
+
+For each worker count this reseeds the --db-name database with the load
+generator's fixtures, starts `backend/serve.py` on a free port (after
+seeding, so the caches it primes at startup hold the real catalogue), waits
+for /readyz, drives it with scripts/load_test.py over HTTP, then stops the
+server and records throughput, latency percentiles and error rate.
+Results are written as JSON and as a Markdown table that includes the
+machine's CPU count, so numbers from different hosts are not compared by
+accident.
+
+Run it on the hardware you deploy to, with uvloop and httptools installed,
+and against a MongoDB that is not on the same box if production's is not.
+
+Example:
+    python scripts/benchmark_workers.py --mongo mongodb://localhost:27017 \\
+        --workers 1,2,4,8 --users 200 --duration 60 --output benchmark_workers.md
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT_DIR = Path(__file__).parent.parent
+BACKEND_DIR = ROOT_DIR / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(ROOT_DIR / 'scripts'))
+
+from serve import available_cpus, event_loop, http_protocol, pool_size_per_worker  # noqa: E402
+from load_test import build_products, seed  # noqa: E402
+
+
+async def reseed(args):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    def hash_password(password):
+        return hashlib.sha256(password.encode()).hexdigest()
+
+    client = AsyncIOMotorClient(args.mongo)
+    await seed(client[args.db_name], hash_password, build_products(args.products, random.Random(args.seed)))
+    client.close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(base_url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/readyz", timeout=2).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def run_one(workers, args):
+    asyncio.run(reseed(args))
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "WEB_CONCURRENCY": str(workers),
+        "SERVER_HOST": "127.0.0.1",
+        "SERVER_PORT": str(port),
+        "MONGO_URL": args.mongo,
+        "DB_NAME": args.db_name,
+        # The load generator spreads users over X-Forwarded-For addresses
+        "FORWARDED_ALLOW_IPS": "127.0.0.1",
+        # Shared buckets, so every worker count runs under the same effective rate limits
+        "RATE_LIMIT_BACKEND": "mongo",
+    }
+    server = subprocess.Popen([sys.executable, str(BACKEND_DIR / 'serve.py')], env=env)
+    try:
+        if not wait_ready(base_url, args.startup_timeout):
+            raise SystemExit(f"Server with {workers} worker(s) did not become ready")
+        # Let every worker finish its own startup before measuring
+        time.sleep(args.warmup)
+        with tempfile.NamedTemporaryFile(suffix=".json") as report_file:
+            subprocess.run([
+                sys.executable, str(ROOT_DIR / 'scripts' / 'load_test.py'),
+                "--target", base_url,
+                "--mongo", args.mongo,
+                "--db-name", args.db_name,
+                "--users", str(args.users),
+                "--duration", str(args.duration),
+                "--mix", args.mix,
+                "--seed", str(args.seed),
+                "--no-seed",
+                "--report", report_file.name,
+            ], check=True)
+            report = json.loads(Path(report_file.name).read_text())
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+    return {
+        "workers": workers,
+        "mongo_pool_per_worker": int(os.environ.get('MONGO_MAX_POOL_SIZE') or pool_size_per_worker(workers)),
+        "throughput_rps": report["throughput_rps"],
+        "latency_ms": report["latency_ms"],
+        "error_rate": report["error_rate"],
+        "total_requests": report["total_requests"],
+    }
+
+
+def markdown(results, args):
+    lines = [
+        "# Worker scaling benchmark",
+        "",
+        f"Host: {platform.node()} ({platform.machine()}), {available_cpus()} CPUs available, "
+        f"Python {platform.python_version()}, loop={event_loop()}, http={http_protocol()}",
+        f"Load: {args.users} virtual users for {args.duration:g}s, mix {args.mix}, seed {args.seed}",
+        "",
+        "| Workers | Mongo pool / worker | Requests | Req/s | p50 ms | p95 ms | p99 ms | Errors |",
+        "|--------:|--------------------:|---------:|------:|-------:|-------:|-------:|-------:|",
+    ]
+    for result in results:
+        latency = result["latency_ms"]
+        lines.append(
+            f"| {result['workers']} | {result['mongo_pool_per_worker']} | {result['total_requests']} | "
+            f"{result['throughput_rps']} | {latency['p50']} | {latency['p95']} | {latency['p99']} | "
+            f"{result['error_rate']:.2%} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serve.py at several worker counts")
+    parser.add_argument("--mongo", required=True, help="MongoDB connection string the servers will use")
+    parser.add_argument("--db-name", default="manira_benchmark")
+    parser.add_argument("--workers", default="1,2,4,8", help="Comma-separated worker counts")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--mix", default="browse=60,cart=25,checkout=10,admin=5")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--warmup", type=float, default=3.0, help="Seconds to wait after /readyz")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--output", default="benchmark_workers.md", help="Markdown table; JSON goes next to it")
+    args = parser.parse_args()
+
+    results = []
+    for workers in (int(count) for count in args.workers.split(",")):
+        print(f"Benchmarking {workers} worker(s)...", file=sys.stderr)
+        results.append(run_one(workers, args))
+        print(f"  {results[-1]['throughput_rps']} req/s, p95 {results[-1]['latency_ms']['p95']} ms", file=sys.stderr)
+
+    output = Path(args.output)
+    output.write_text(markdown(results, args))
+    output.with_suffix(".json").write_text(json.dumps(results, indent=2))
+    print(f"Results written to {output} and {output.with_suffix('.json')}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+"""
+Generate a large, deterministic synthetic dataset for scale testing.
+
+Products, users, promotions, orders and cart lines are produced with the
+same document shapes the API writes, in volumes far beyond the hand-written
+fixtures of populate_db.py, e.g.:
+
+    python scripts/generate_dataset.py --drop \\
+        --products 100000 --users 1000000 --orders 10000000 --carts 200000
+
+Everything is derived from --seed and --as-of: ids are uuid5 names, and
+each block of SEED_BLOCK documents draws from its own random stream, so
+the output is identical whatever the number of workers or chunk size.
+Distributions aim to look like a real store:
+- product popularity is Zipf-distributed;
+- a fifth of the customers place most orders;
+- most orders have one or two lines and quantity one;
+- order volume grows towards the present;
+- status, payment and review outcome depend on the order's age;
+- about one order in ten uses one of the uncapped promotions.
+
+Chunks of --chunk-size documents are spread over --workers processes,
+each inserting batches of --batch-size with unordered insert_many. The
+run reports documents per second for each collection. Indexes are built
+after loading, which is much faster than maintaining them during it.
+Counters the API keeps incrementally (users' order_stats, promotions'
+redemption_count) are left at zero; run backfill_order_stats.py afterwards.
+
+--drop empties the generated collections first. Without it, a re-run
+with the same seed skips documents that already exist.
+"""
+import argparse
+import asyncio
+import bisect
+import hashlib
+import itertools
+import os
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+
+BACKEND_DIR = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+load_dotenv(BACKEND_DIR / '.env')
+
+CATEGORIES = ["necklaces", "rings", "earrings", "bracelets", "pendants", "bangles"]
+CATEGORY_WEIGHTS = [24, 22, 20, 12, 12, 10]
+MATERIALS = ["American Diamond", "Cubic Zirconia", "Kundan", "Sterling Silver", "Rose Gold Plated"]
+ADJECTIVES = ["Classic", "Royal", "Delicate", "Radiant", "Vintage", "Floral", "Celestial", "Regal", "Minimal"]
+CITIES = ["Mumbai", "Delhi", "Bengaluru", "Hyderabad", "Chennai", "Kolkata", "Pune", "Jaipur", "Ahmedabad"]
+LINE_COUNTS, LINE_WEIGHTS = [1, 2, 3, 4, 5], [55, 25, 12, 5, 3]
+QUANTITIES, QUANTITY_WEIGHTS = [1, 2, 3], [82, 14, 4]
+PROMOTION_SHARE = 0.1
+REPEAT_CUSTOMER_SHARE = 0.2  # of users, who place REPEAT_ORDER_SHARE of the orders
+REPEAT_ORDER_SHARE = 0.7
+SEED_BLOCK = 1000
+USER_PASSWORD = "synthetic123"
+
+# (maximum age in days, [(status, weight)]); payment is completed once an order is confirmed
+STATUS_BY_AGE = [
+    (2, [("pending", 45), ("review", 10), ("accepted", 20), ("confirmed", 15), ("cancelled", 6), ("rejected", 4)]),
+    (14, [("accepted", 10), ("confirmed", 20), ("shipped", 40), ("delivered", 20), ("cancelled", 5),
+          ("rejected", 3), ("partially_accepted", 2)]),
+    (None, [("delivered", 84), ("cancelled", 8), ("rejected", 4), ("partially_accepted", 4)]),
+]
+PAID_STATUSES = {"confirmed", "shipped", "delivered"}
+GENERATED_COLLECTIONS = ("products", "promotions", "users", "orders", "cart")
+
+
+@dataclass
+class Config:
+    mongo_url: str
+    db_name: str
+    seed: int
+    as_of: datetime
+    days: int
+    counts: dict
+    batch_size: int
+    write_concern: int
+
+
+class Dataset:
+    """Everything a worker needs to generate any chunk; rebuilt identically in every process"""
+
+    def __init__(self, config):
+        self.config = config
+        self.counts = config.counts
+        self.namespace = uuid.uuid5(uuid.NAMESPACE_URL, f"manira-synthetic/{config.seed}")
+        self.password_hash = hashlib.sha256(USER_PASSWORD.encode()).hexdigest()
+        self.catalog = [self._product(index) for index in range(self.counts["products"])]
+
+        # Zipf popularity over a shuffled ranking, so bestsellers are spread across categories
+        rng = random.Random(f"{config.seed}:popularity")
+        ranking = list(range(len(self.catalog)))
+        rng.shuffle(ranking)
+        self.ranked_products = ranking
+        self.popularity_cdf = list(itertools.accumulate(1 / (rank + 1) ** 1.07 for rank in range(len(ranking))))
+
+        self.promotions = [self._promotion(index) for index in range(self.counts["promotions"])]
+        self.open_promotions = [promotion for promotion in self.promotions if promotion["max_redemptions"] is None]
+
+    def entity_id(self, kind, index):
+        return str(uuid.uuid5(self.namespace, f"{kind}:{index}"))
+
+    def _product(self, index):
+        rng = random.Random(f"{self.config.seed}:product:{index}")
+        category = rng.choices(CATEGORIES, CATEGORY_WEIGHTS)[0]
+        material = rng.choice(MATERIALS)
+        name = f"{rng.choice(ADJECTIVES)} {material} {category[:-1].title()} {index + 1}"
+        return {
+            "id": self.entity_id("product", index),
+            "name": name,
+            "description": f"{name}, handcrafted {material.lower()} jewellery.",
+            # Log-normal prices centred around ₹2,500, rounded like a real price list
+            "price": float(max(299, round(rng.lognormvariate(7.8, 0.6), -2) - 1)),
+            "category": category,
+            "material": material,
+            "size": rng.choice([None, "Small", "Medium", "Large"]),
+            "weight": f"{rng.randint(3, 60)}g",
+            "image_url": f"https://images.example.com/products/{index % 500}.jpg",
+            "image_id": None,
+            "images": None,
+            "inventory_count": rng.randint(0, 200),
+            "sku": f"SYN-{category[:3].upper()}-{index + 1:06d}",
+            "is_active": rng.random() > 0.03,
+            "deleted_at": None,
+            "created_at": self.config.as_of - timedelta(days=rng.uniform(0, self.config.days)),
+        }
+
+    def _promotion(self, index):
+        rng = random.Random(f"{self.config.seed}:promotion:{index}")
+        percentage = rng.random() < 0.6
+        capped = rng.random() < 0.3
+        start = self.config.as_of - timedelta(days=rng.uniform(0, self.config.days))
+        return {
+            "id": self.entity_id("promotion", index),
+            "name": f"Synthetic Sale {index + 1}",
+            "code": f"SYN{index + 1:04d}",
+            "discount_percentage": float(rng.choice([5, 10, 15, 20, 25])) if percentage else None,
+            "discount_amount": None if percentage else float(rng.choice([100, 200, 250, 500])),
+            "applicable_products": [],
+            "min_order_amount": float(rng.choice([0, 999, 1999])) or None,
+            "max_redemptions": rng.choice([100, 500, 1000]) if capped else None,
+            "max_redemptions_per_user": rng.choice([1, 2]) if capped else None,
+            "redemption_count": 0,
+            "start_date": start,
+            "end_date": start + timedelta(days=rng.choice([7, 30, 90, 365])),
+            "is_active": rng.random() > 0.2,
+            "created_at": start - timedelta(days=1),
+        }
+
+    def popular_product(self, rng):
+        rank = bisect.bisect_left(self.popularity_cdf, rng.random() * self.popularity_cdf[-1])
+        return self.catalog[self.ranked_products[min(rank, len(self.catalog) - 1)]]
+
+    def active_customer(self, rng):
+        users = self.counts["users"]
+        if rng.random() < REPEAT_ORDER_SHARE:
+            return rng.randrange(max(1, int(users * REPEAT_CUSTOMER_SHARE)))
+        return rng.randrange(users)
+
+    # Generators: documents for indexes [start, stop) of one collection
+    def products(self, rng, start, stop):
+        return (dict(self.catalog[index]) for index in range(start, stop))
+
+    def promotions_docs(self, rng, start, stop):
+        return (dict(self.promotions[index]) for index in range(start, stop))
+
+    def users(self, rng, start, stop):
+        for index in range(start, stop):
+            yield {
+                "id": self.entity_id("user", index),
+                "email": f"shopper{index + 1:08d}@example.com",
+                "phone": f"+91 9{rng.randrange(10 ** 9):09d}",
+                "full_name": f"Synthetic Shopper {index + 1}",
+                "address": f"{rng.randint(1, 999)} Market Road, {rng.choice(CITIES)}",
+                "is_admin": False,
+                "order_stats": {"order_count": 0, "lifetime_spend": 0.0, "last_order_at": None},
+                "created_at": self.config.as_of - timedelta(days=rng.uniform(0, self.config.days)),
+                "hashed_password": self.password_hash,
+            }
+
+    def orders(self, rng, start, stop):
+        for index in range(start, stop):
+            products = {}
+            for _ in range(rng.choices(LINE_COUNTS, LINE_WEIGHTS)[0]):
+                product = self.popular_product(rng)
+                products[product["id"]] = product
+            lines = [{
+                "product_id": product["id"],
+                "name": product["name"],
+                "sku": product["sku"],
+                "image": product["image_url"],
+                "price": product["price"],
+                "quantity": rng.choices(QUANTITIES, QUANTITY_WEIGHTS)[0],
+                "status": None,
+                "available": None,
+            } for product in products.values()]
+
+            # Squaring a uniform draw makes recent days busier than old ones
+            age = timedelta(days=self.config.days * rng.random() ** 2)
+            created_at = self.config.as_of - age
+            choices = next(weights for max_age, weights in STATUS_BY_AGE if max_age is None or age.days < max_age)
+            status = rng.choices([name for name, _ in choices], [weight for _, weight in choices])[0]
+
+            original_amount = None
+            if status in ("accepted", "confirmed", "shipped", "delivered"):
+                for line in lines:
+                    line["status"] = "accepted"
+            elif status == "rejected":
+                for line in lines:
+                    line["status"] = "rejected"
+            elif status == "partially_accepted":
+                for position, line in enumerate(lines):
+                    line["status"] = "rejected" if position == 0 and len(lines) > 1 else "accepted"
+                original_amount = sum(line["price"] * line["quantity"] for line in lines)
+            accepted_total = sum(line["price"] * line["quantity"] for line in lines if line["status"] != "rejected")
+
+            promotion = None
+            discount = 0.0
+            if self.open_promotions and rng.random() < PROMOTION_SHARE:
+                promotion = rng.choice(self.open_promotions)
+                if promotion["discount_percentage"]:
+                    discount = round(accepted_total * promotion["discount_percentage"] / 100, 2)
+                else:
+                    discount = min(promotion["discount_amount"], accepted_total)
+            if discount and original_amount is None:
+                original_amount = accepted_total
+
+            yield {
+                "id": self.entity_id("order", index),
+                "user_id": self.entity_id("user", self.active_customer(rng)),
+                "items": lines,
+                "total_amount": max(0, accepted_total - discount) if status != "rejected" else 0,
+                "original_amount": original_amount,
+                "status": status,
+                "shipping_address": f"{rng.randint(1, 999)} Market Road, {rng.choice(CITIES)}",
+                "phone": f"+91 9{rng.randrange(10 ** 9):09d}",
+                "payment_method": "UPI",
+                "payment_status": "completed" if status in PAID_STATUSES else "pending",
+                "admin_notes": None,
+                "promotion_code": promotion["code"] if promotion else None,
+                "promotion_id": promotion["id"] if promotion else None,
+                "discount_amount": discount,
+                "created_at": created_at,
+                "updated_at": None if status == "pending" else created_at + timedelta(hours=rng.uniform(1, 72)),
+            }
+
+    def cart(self, rng, start, stop):
+        carts, users = self.counts["cart"], self.counts["users"]
+        for index in range(start, stop):
+            # Spread carts evenly over distinct customers
+            user_id = self.entity_id("user", index * users // carts)
+            products = {self.popular_product(rng)["id"] for _ in range(rng.choices(LINE_COUNTS, LINE_WEIGHTS)[0])}
+            added_at = self.config.as_of - timedelta(days=rng.uniform(0, 20))
+            for product_id in products:
+                yield {
+                    "user_id": user_id,
+                    "product_id": product_id,
+                    "quantity": rng.choices(QUANTITIES, QUANTITY_WEIGHTS)[0],
+                    "added_at": added_at,
+                }
+
+
+GENERATORS = {
+    "products": Dataset.products,
+    "promotions": Dataset.promotions_docs,
+    "users": Dataset.users,
+    "orders": Dataset.orders,
+    "cart": Dataset.cart,
+}
+
+_worker = {}
+
+
+def init_worker(config):
+    _worker["dataset"] = Dataset(config)
+    _worker["db"] = MongoClient(config.mongo_url, w=config.write_concern)[config.db_name]
+
+
+def insert_batch(collection, documents):
+    try:
+        return len(collection.insert_many(documents, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        # Documents already present from an earlier run with the same seed
+        return e.details["nInserted"]
+
+
+def insert_chunk(task):
+    """Generate and insert one chunk; returns (collection, inserted, generated)"""
+    collection, start, stop = task
+    dataset = _worker["dataset"]
+    inserted = generated = 0
+    batch = []
+    blocks = (
+        GENERATORS[collection](dataset, random.Random(f"{dataset.config.seed}:{collection}:{block}"),
+                               block, min(block + SEED_BLOCK, stop))
+        for block in range(start, stop, SEED_BLOCK)
+    )
+    for document in itertools.chain.from_iterable(blocks):
+        batch.append(document)
+        if len(batch) >= dataset.config.batch_size:
+            inserted += insert_batch(_worker["db"][collection], batch)
+            generated += len(batch)
+            batch = []
+    if batch:
+        inserted += insert_batch(_worker["db"][collection], batch)
+        generated += len(batch)
+    return collection, inserted, generated
+
+
+async def build_indexes(config):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from indexes import ensure_indexes
+
+    client = AsyncIOMotorClient(config.mongo_url)
+    failed = await ensure_indexes(client[config.db_name])
+    client.close()
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load a deterministic synthetic dataset")
+    parser.add_argument("--mongo", default=os.environ.get('MONGO_URL'), help="Defaults to MONGO_URL")
+    parser.add_argument("--db-name", default=os.environ.get('DB_NAME'), help="Defaults to DB_NAME")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--orders", type=int, default=500000)
+    parser.add_argument("--carts", type=int, default=20000, help="Customers with a non-empty cart")
+    parser.add_argument("--promotions", type=int, default=50)
+    parser.add_argument("--days", type=int, default=730, help="History covered by orders and sign-ups")
+    parser.add_argument("--as-of", help="Date the history ends (YYYY-MM-DD); defaults to today, UTC")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documents per insert_many")
+    parser.add_argument("--chunk-size", type=int, default=50000,
+                        help=f"Documents per worker task, rounded up to a multiple of {SEED_BLOCK}")
+    parser.add_argument("--write-concern", type=int, default=1, help="w for the bulk inserts")
+    parser.add_argument("--drop", action="store_true", help="Empty the generated collections first")
+    parser.add_argument("--no-indexes", action="store_true", help="Skip building indexes after loading")
+    args = parser.parse_args()
+
+    if not args.mongo or not args.db_name:
+        raise SystemExit("Pass --mongo and --db-name or set MONGO_URL and DB_NAME")
+    if args.products < 1 or args.users < 1:
+        raise SystemExit("--products and --users must be at least 1")
+    # Chunks must start on a seed block so every document gets the same random stream
+    chunk_size = max(1, -(-args.chunk_size // SEED_BLOCK)) * SEED_BLOCK
+    as_of = (datetime.strptime(args.as_of, "%Y-%m-%d") if args.as_of
+             else datetime.now(timezone.utc).replace(tzinfo=None)).replace(
+        hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
+    counts = {
+        "products": args.products,
+        "promotions": args.promotions,
+        "users": args.users,
+        "orders": args.orders,
+        "cart": min(args.carts, args.users),
+    }
+    config = Config(args.mongo, args.db_name, args.seed, as_of, args.days, counts, args.batch_size, args.write_concern)
+
+    if args.drop:
+        db = MongoClient(args.mongo)[args.db_name]
+        for collection in GENERATED_COLLECTIONS:
+            db[collection].drop()
+        print(f"Dropped {', '.join(GENERATED_COLLECTIONS)} in {args.db_name}", file=sys.stderr)
+
+    print(f"Generating with seed {args.seed} as of {as_of.date()} on {args.workers} worker(s)", file=sys.stderr)
+    started = time.perf_counter()
+    total = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(config,)) as pool:
+        for collection in GENERATED_COLLECTIONS:
+            count = counts[collection]
+            if not count:
+                continue
+            tasks = [(collection, start, min(start + chunk_size, count))
+                     for start in range(0, count, chunk_size)]
+            collection_started = time.perf_counter()
+            inserted = generated = 0
+            for _, chunk_inserted, chunk_generated in pool.map(insert_chunk, tasks):
+                inserted += chunk_inserted
+                generated += chunk_generated
+            elapsed = time.perf_counter() - collection_started
+            total += inserted
+            skipped = f", {generated - inserted} already present" if generated > inserted else ""
+            print(f"{collection:>10}: {inserted:>11,} docs in {elapsed:8.1f}s "
+                  f"({generated / elapsed:,.0f} docs/s){skipped}", file=sys.stderr)
+    elapsed = time.perf_counter() - started
+    print(f"{'total':>10}: {total:>11,} docs in {elapsed:8.1f}s ({total / elapsed:,.0f} docs/s)", file=sys.stderr)
+
+    if not args.no_indexes:
+        index_started = time.perf_counter()
+        failed = asyncio.run(build_indexes(config))
+        print(f"Indexes built in {time.perf_counter() - index_started:.1f}s"
+              + (f" (failed: {', '.join(failed)})" if failed else ""), file=sys.stderr)
+    if counts["orders"]:
+        print("Run scripts/backfill_order_stats.py to fill in customers' order summaries", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+"""
+Load generator for the Manira API.
+
+Drives a weighted mix of shopper and admin journeys (browse, add-to-cart,
+checkout, admin review) with many concurrent virtual users and writes a JSON
+report with throughput, p50/p95/p99 latency per route and error rates.
+
+Targets:
+    --target asgi                  run the FastAPI app in-process (default)
+    --target http://127.0.0.1:8001 drive a local uvicorn over HTTP
+
+Storage (ASGI target only):
+    --mongo memory                 in-memory mongomock stand-in (default)
+    --mongo mongodb://localhost:27017
+                                   a local MongoDB; the database named by
+                                   --db-name is dropped and reseeded
+
+Example:
+    python scripts/load_test.py --users 50 --duration 30 --report load_report.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+
+CATEGORIES = ["necklaces", "rings", "earrings", "bracelets", "pendants", "bangles"]
+ADMIN_EMAIL = "loadtest-admin@manira.com"
+ADMIN_PASSWORD = "loadtest-admin"
+PROMO_CODE = "LOADTEST10"
+
+DEFAULT_MIX = "browse=60,cart=25,checkout=10,admin=5"
+
+
+class RouteStats:
+    """Latency samples and error counts for one route label"""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.status_codes = defaultdict(int)
+
+    def summary(self, elapsed):
+        samples = sorted(self.latencies)
+        count = len(samples)
+        return {
+            "count": count,
+            "errors": self.errors,
+            "error_rate": round(self.errors / count, 4) if count else 0.0,
+            "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {
+                "mean": round(sum(samples) / count, 2) if count else None,
+                "p50": percentile(samples, 50),
+                "p95": percentile(samples, 95),
+                "p99": percentile(samples, 99),
+                "max": round(samples[-1], 2) if count else None,
+            },
+            "status_codes": dict(self.status_codes),
+        }
+
+
+def percentile(sorted_samples, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_samples) + 0.5)))
+    return round(sorted_samples[min(rank, len(sorted_samples)) - 1], 2)
+
+
+class Recorder:
+    """Collects per-route and per-journey results across all virtual users"""
+
+    def __init__(self):
+        self.routes = defaultdict(RouteStats)
+        self.journeys = defaultdict(lambda: {"count": 0, "failed": 0})
+        self.user_journeys = {}  # virtual user index -> journeys completed
+        self.started_at = None
+        self.finished_at = None
+
+    def record(self, label, elapsed_ms, status_code, ok):
+        stats = self.routes[label]
+        stats.latencies.append(elapsed_ms)
+        stats.status_codes[str(status_code)] += 1
+        if not ok:
+            stats.errors += 1
+
+    def report(self, config):
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        total = sum(len(stats.latencies) for stats in self.routes.values())
+        errors = sum(stats.errors for stats in self.routes.values())
+        all_samples = sorted(lat for stats in self.routes.values() for lat in stats.latencies)
+        return {
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "config": config,
+            "duration_s": round(elapsed, 3),
+            "total_requests": total,
+            "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+            "errors": errors,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "latency_ms": {
+                "p50": percentile(all_samples, 50),
+                "p95": percentile(all_samples, 95),
+                "p99": percentile(all_samples, 99),
+            },
+            "routes": {label: stats.summary(elapsed) for label, stats in sorted(self.routes.items())},
+            "journeys": dict(self.journeys),
+            "virtual_users": {
+                "configured": config["users"],
+                "completed_a_journey": sum(1 for count in self.user_journeys.values() if count),
+            },
+        }
+
+
+class VirtualUser:
+    """One simulated shopper (or admin) with its own token, client IP and cart state"""
+
+    def __init__(self, client, recorder, rng, products, ip="127.0.0.1", token=None):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.products = products
+        self.ip = ip
+        self.token = token
+
+    async def call(self, label, method, url, expected=(200,), **kwargs):
+        headers = kwargs.pop("headers", {})
+        # Distinct client addresses so per-IP rate limits behave as in production
+        headers["X-Forwarded-For"] = self.ip
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=headers, **kwargs)
+        except httpx.HTTPError:
+            response = None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        # In-process ASGI with mongomock completes requests without ever suspending;
+        # yield so the other virtual users actually run concurrently
+        await asyncio.sleep(0)
+
+        if response is None:
+            self.recorder.record(label, elapsed_ms, "exception", False)
+            return None
+        ok = response.status_code in expected
+        self.recorder.record(label, elapsed_ms, response.status_code, ok)
+        return response if ok else None
+
+    async def sign_in(self, email, password, register=True):
+        if register:
+            response = await self.call("POST /api/auth/register", "POST", "/api/auth/register", json={
+                "email": email,
+                "password": password,
+                "phone": "9876543210",
+                "full_name": "Load Test Shopper",
+                "address": "1 Benchmark Lane, Mumbai",
+            })
+        else:
+            response = await self.call("POST /api/auth/login", "POST", "/api/auth/login", json={
+                "email": email,
+                "password": password,
+            })
+        if response is not None:
+            self.token = response.json()["access_token"]
+        return self.token is not None
+
+    def pick_product(self):
+        return self.rng.choice(self.products)
+
+    # Journeys
+    async def browse(self):
+        await self.call("GET /api/products", "GET", "/api/products")
+        category = self.rng.choice(CATEGORIES)
+        await self.call("GET /api/products?category", "GET", "/api/products", params={"category": category})
+        for _ in range(self.rng.randint(1, 3)):
+            await self.call("GET /api/products/{product_id}", "GET", f"/api/products/{self.pick_product()['id']}")
+        await self.call("GET /api/categories", "GET", "/api/categories")
+        return True
+
+    async def add_to_cart(self):
+        product = self.pick_product()
+        added = await self.call("POST /api/cart/add", "POST", "/api/cart/add", json={
+            "product_id": product["id"],
+            "quantity": self.rng.randint(1, 2),
+        })
+        cart = await self.call("GET /api/cart", "GET", "/api/cart")
+        if cart is not None and self.rng.random() < 0.3:
+            await self.call("PUT /api/cart/{product_id}", "PUT", f"/api/cart/{product['id']}", json={
+                "quantity": self.rng.randint(1, 3),
+            })
+        return added is not None and cart is not None
+
+    async def checkout(self):
+        for _ in range(self.rng.randint(1, 3)):
+            await self.call("POST /api/cart/add", "POST", "/api/cart/add", json={
+                "product_id": self.pick_product()["id"],
+                "quantity": 1,
+            })
+        cart = await self.call("GET /api/cart", "GET", "/api/cart")
+        if cart is None or not cart.json():
+            return False
+        lines = cart.json()
+        subtotal = sum(line["product"]["price"] * line["quantity"] for line in lines)
+
+        discount = 0
+        promo_code = None
+        if self.rng.random() < 0.5:
+            # Promotion checks are rate limited per user; a 429 just means no discount
+            promo = await self.call("POST /api/apply-promotion", "POST", "/api/apply-promotion", expected=(200, 429), json={
+                "code": PROMO_CODE,
+                "order_amount": subtotal,
+            })
+            if promo is not None and promo.status_code == 200:
+                promo_code = PROMO_CODE
+                discount = promo.json()["discount"]
+
+        order = await self.call("POST /api/orders", "POST", "/api/orders", json={
+            "items": [{
+                "product_id": line["product"]["id"],
+                "quantity": line["quantity"],
+                "price": line["product"]["price"],
+            } for line in lines],
+            "shipping_address": "1 Benchmark Lane, Mumbai",
+            "phone": "9876543210",
+            "promotion_code": promo_code,
+            "discount_amount": discount,
+            "original_amount": subtotal,
+            "final_amount": max(0, subtotal - discount),
+        })
+        history = await self.call("GET /api/orders", "GET", "/api/orders")
+        return order is not None and history is not None
+
+    async def admin_review(self):
+        orders = await self.call("GET /api/admin/orders", "GET", "/api/admin/orders")
+        if orders is None:
+            return False
+        pending = [order for order in orders.json() if order["status"] in ("pending", "review")]
+        if pending:
+            order = self.rng.choice(pending)
+            action = self.rng.choice(["accept", "accept", "accept", "reject"])
+            # Two admins can race for the same pending order; the loser gets a 400
+            await self.call(
+                "PUT /api/admin/orders/{order_id}/review", "PUT",
+                f"/api/admin/orders/{order['id']}/review",
+                expected=(200, 400),
+                json={"action": action, "admin_notes": "load test"},
+            )
+        await self.call("GET /api/admin/customers", "GET", "/api/admin/customers")
+        return True
+
+
+def parse_mix(spec):
+    """Parse 'browse=60,cart=25,...' into journey weights"""
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in JOURNEYS:
+            raise SystemExit(f"Unknown journey '{name}', expected one of {', '.join(JOURNEYS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+JOURNEYS = {
+    "browse": VirtualUser.browse,
+    "cart": VirtualUser.add_to_cart,
+    "checkout": VirtualUser.checkout,
+    "admin": VirtualUser.admin_review,
+}
+
+
+def build_products(count, rng):
+    now = datetime.now(timezone.utc)
+    products = []
+    for i in range(count):
+        category = CATEGORIES[i % len(CATEGORIES)]
+        products.append({
+            "id": str(uuid.uuid4()),
+            "name": f"Load Test {category.title()} {i + 1}",
+            "description": "Synthetic product used by the load generator.",
+            "price": float(rng.randrange(999, 24999, 100)),
+            "category": category,
+            "material": "American Diamond",
+            "size": None,
+            "weight": None,
+            "image_url": "https://example.com/loadtest.jpg",
+            "inventory_count": 1000,
+            "sku": f"LT-{i + 1:05d}",
+            "is_active": True,
+            "created_at": now,
+        })
+    return products
+
+
+async def seed(db, hash_password, products):
+    """Reset the load-test database and insert fixtures"""
+    for collection in ("users", "products", "cart", "orders", "promotions"):
+        await db[collection].delete_many({})
+
+    await db.products.insert_many([dict(product) for product in products])
+    await db.users.insert_one({
+        "id": str(uuid.uuid4()),
+        "email": ADMIN_EMAIL,
+        "hashed_password": hash_password(ADMIN_PASSWORD),
+        "phone": "+91 9876543210",
+        "full_name": "Load Test Admin",
+        "address": None,
+        "is_admin": True,
+        "created_at": datetime.now(timezone.utc),
+    })
+    now = datetime.now(timezone.utc)
+    await db.promotions.insert_one({
+        "id": str(uuid.uuid4()),
+        "name": "Load test 10%",
+        "code": PROMO_CODE,
+        "discount_percentage": 10.0,
+        "discount_amount": None,
+        "applicable_products": [],
+        "min_order_amount": None,
+        "start_date": now - timedelta(days=1),
+        "end_date": now + timedelta(days=30),
+        "is_active": True,
+        "created_at": now,
+    })
+
+
+def setup_asgi_target(args):
+    """Import the app in-process and point it at the requested database"""
+    os.environ.setdefault("MONGO_URL", args.mongo if args.mongo != "memory" else "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", args.db_name)
+    import server
+
+    if args.mongo == "memory":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("--mongo memory requires the mongomock-motor package")
+        server.client = AsyncMongoMockClient()
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        server.client = AsyncIOMotorClient(args.mongo)
+    server.db = server.ProfiledDatabase(server.client[args.db_name])
+
+    # server.py configures INFO logging; keep per-request client logs out of the run
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    # Behind uvicorn, proxy_headers turns X-Forwarded-For from a trusted peer into
+    # the client address; apply the same middleware so per-IP limits see each user
+    from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+    app = ProxyHeadersMiddleware(server.app, trusted_hosts="127.0.0.1")
+    transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 123))
+    client = httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout)
+    return client, server.db, server.hash_password
+
+
+def setup_http_target(args):
+    """Drive an already running server; seed through a direct Mongo connection"""
+    if args.mongo == "memory":
+        raise SystemExit("--mongo memory is only available with --target asgi; pass the server's MONGO_URL")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    import hashlib
+
+    def hash_password(password):
+        return hashlib.sha256(password.encode()).hexdigest()
+
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    client = httpx.AsyncClient(base_url=args.target.rstrip("/"), timeout=args.timeout, limits=limits)
+    return client, AsyncIOMotorClient(args.mongo)[args.db_name], hash_password
+
+
+def virtual_ip(index):
+    return f"10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+
+
+async def run_user(index, args, client, recorder, products, mix, deadline, admin_token):
+    rng = random.Random(args.seed * 100003 + index)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    shopper = VirtualUser(client, recorder, rng, products, ip=virtual_ip(index + 1))
+    admin = VirtualUser(client, recorder, rng, products, ip=virtual_ip(index + 1), token=admin_token)
+
+    run_id = uuid.uuid4().hex[:8]
+    if not await shopper.sign_in(f"loadtest_{run_id}_{index}@test.com", "loadtest123"):
+        return
+
+    iterations = 0
+    recorder.user_journeys[index] = 0
+    while time.perf_counter() < deadline and (not args.iterations or iterations < args.iterations):
+        name = rng.choices(names, weights)[0]
+        actor = admin if name == "admin" else shopper
+        ok = await JOURNEYS[name](actor)
+        recorder.journeys[name]["count"] += 1
+        recorder.user_journeys[index] += 1
+        if not ok:
+            recorder.journeys[name]["failed"] += 1
+        iterations += 1
+        if args.think_time:
+            await asyncio.sleep(rng.uniform(0, args.think_time))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Concurrent load generator for the Manira API")
+    parser.add_argument("--target", default="asgi", help="'asgi' or base URL of a running server")
+    parser.add_argument("--mongo", default="memory", help="'memory' or a MongoDB connection string")
+    parser.add_argument("--db-name", default="manira_loadtest")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds to run")
+    parser.add_argument("--iterations", type=int, default=0, help="Stop each user after N journeys (0 = no cap)")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--think-time", type=float, default=0.0, help="Max random pause between journeys (s)")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-seed", action="store_true", help="Use the data already in the database")
+    parser.add_argument("--report", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+
+    if args.target == "asgi":
+        client, db, hash_password = setup_asgi_target(args)
+    else:
+        client, db, hash_password = setup_http_target(args)
+
+    if args.no_seed:
+        products = await db.products.find({"is_active": True}, {"_id": 0, "id": 1, "price": 1}).to_list(length=None)
+        if not products:
+            raise SystemExit("No active products found; drop --no-seed to create fixtures")
+    else:
+        products = build_products(args.products, rng)
+        await seed(db, hash_password, products)
+
+    recorder = Recorder()
+    print(f"Running {args.users} virtual users for {args.duration}s against {args.target} ({args.mix})", file=sys.stderr)
+    recorder.started_at = time.perf_counter()
+    deadline = recorder.started_at + args.duration
+    async with client:
+        # One admin session shared by every virtual user, as a handful of staff would have
+        admin_token = None
+        if "admin" in mix:
+            admin = VirtualUser(client, recorder, rng, products, ip=virtual_ip(0))
+            if not await admin.sign_in(ADMIN_EMAIL, ADMIN_PASSWORD, register=False):
+                raise SystemExit("Admin login failed; is the database seeded?")
+            admin_token = admin.token
+        await asyncio.gather(*(
+            run_user(i, args, client, recorder, products, mix, deadline, admin_token)
+            for i in range(args.users)
+        ))
+    recorder.finished_at = time.perf_counter()
+
+    config = {key: value for key, value in vars(args).items() if key != "report"}
+    if config["mongo"] != "memory":
+        config["mongo"] = "mongodb"
+    report = recorder.report(config)
+    output = json.dumps(report, indent=2)
+    if args.report:
+        Path(args.report).write_text(output)
+        print(f"Report written to {args.report}", file=sys.stderr)
+    else:
+        print(output)
+
+    print(
+        f"{report['total_requests']} requests, {report['throughput_rps']} req/s, "
+        f"error rate {report['error_rate']:.2%}, p95 {report['latency_ms']['p95']} ms",
+        file=sys.stderr,
+    )
+    users = report["virtual_users"]
+    if users["completed_a_journey"] < users["configured"]:
+        # Fewer users than configured means the numbers above are not N-user numbers
+        raise SystemExit(f"Only {users['completed_a_journey']} of {users['configured']} virtual users "
+                         "completed a journey; increase --duration or check for errors")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
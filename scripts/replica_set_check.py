@@ -0,0 +1,335 @@
+"""
+Check the consistency profiles (backend/consistency.py) against a replica set.
+
+With --launch this starts a throwaway three-node replica set from the local
+`mongod` binary on ports --port..--port+2, runs the checks and shuts it down
+(--keep leaves it running and prints its connection string). Otherwise it
+uses an existing replica set given with --mongo. Either way it only touches
+the --db-name database, which is dropped at the end.
+
+Checks, each reported PASS/FAIL (exit status 1 if any fail):
+
+* catalog and analytics reads are served by a secondary, cart, orders and
+  payments reads by the primary;
+* the write concern each profile sends: w:1 for cart, majority for orders,
+  journaled majority for payments;
+* a causal token from one session lets a later session read that write
+  from a secondary (read-your-writes across requests);
+* end to end through the app: POST /api/orders returns X-Causal-Token, and
+  GET /api/orders sent with it lists the new order;
+* admin lists reloaded right after an admin write are causal, and so are
+  the writes, so the dashboard's X-Causal-Token gives read-your-writes on a
+  secondary: a deleted order is gone from the next GET /api/admin/orders,
+  read with afterClusterTime;
+* an admin product edit shows in the very next GET /api/products, whose
+  cache refill is served by the primary.
+
+Example:
+    python scripts/replica_set_check.py --launch
+    python scripts/replica_set_check.py --mongo "mongodb://h1,h2,h3/?replicaSet=rs0"
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from pymongo import MongoClient, ReadPreference, WriteConcern, monitoring
+from pymongo.errors import PyMongoError
+
+ROOT_DIR = Path(__file__).parent.parent
+BACKEND_DIR = ROOT_DIR / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+
+REPLICA_SET = "rs0"
+
+# Admin lists and the admin writes the dashboard reloads them after
+ADMIN_READ_BACK = {
+    "GET /api/admin/orders": (
+        "PUT /api/admin/orders/{order_id}/review",
+        "PUT /api/admin/orders/{order_id}/payment",
+        "DELETE /api/admin/orders/{order_id}",
+        "DELETE /api/admin/orders/bulk",
+    ),
+    "GET /api/admin/customers": ("DELETE /api/admin/customers/{user_id}",),
+}
+
+
+class CommandLog(monitoring.CommandListener):
+    """Every command sent, with the server that ran it"""
+
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        self.commands.append((event.command_name, event.connection_id, event.command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def last(self, command_name, collection=None):
+        for name, address, command in reversed(self.commands):
+            if name == command_name and (collection is None or command.get(command_name) == collection):
+                return address, command
+        return None, None
+
+
+def launch(port, data_dir):
+    mongod = shutil.which("mongod")
+    if mongod is None:
+        raise SystemExit("--launch needs the mongod binary on PATH")
+    ports = [port, port + 1, port + 2]
+    processes = []
+    for member_port in ports:
+        path = Path(data_dir) / str(member_port)
+        path.mkdir()
+        processes.append(subprocess.Popen([
+            mongod, "--replSet", REPLICA_SET, "--port", str(member_port), "--dbpath", str(path),
+            "--bind_ip", "127.0.0.1", "--logpath", str(path / "mongod.log"),
+        ]))
+    seed = MongoClient(f"mongodb://127.0.0.1:{ports[0]}", directConnection=True, serverSelectionTimeoutMS=30000)
+    seed.admin.command("ping")
+    seed.admin.command("replSetInitiate", {
+        "_id": REPLICA_SET,
+        "members": [{"_id": index, "host": f"127.0.0.1:{member_port}"} for index, member_port in enumerate(ports)],
+    })
+    seed.close()
+    uri = f"mongodb://{','.join(f'127.0.0.1:{member_port}' for member_port in ports)}/?replicaSet={REPLICA_SET}"
+    return uri, processes
+
+
+def wait_for_secondaries(uri, timeout=60):
+    """Block until there is a primary and two secondaries"""
+    client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            try:
+                states = [member["stateStr"] for member in client.admin.command("replSetGetStatus")["members"]]
+                if states.count("PRIMARY") == 1 and states.count("SECONDARY") >= 2:
+                    return
+            except PyMongoError:
+                pass
+            time.sleep(0.5)
+    finally:
+        client.close()
+    raise SystemExit("Replica set did not reach one primary and two secondaries")
+
+
+class Checks:
+    def __init__(self):
+        self.failures = 0
+
+    def report(self, name, ok, detail=""):
+        print(f"{'PASS' if ok else 'FAIL'}  {name}{f' ({detail})' if detail else ''}")
+        if not ok:
+            self.failures += 1
+
+
+async def check_profiles(checks, client, log, db_name):
+    from consistency import ProfiledDatabase, use_profile
+
+    db = ProfiledDatabase(client[db_name])
+    primary = (await client.admin.command("hello"))["primary"]
+    # Replicated everywhere first, so whichever member serves the read has it
+    await client[db_name].get_collection("probe", write_concern=WriteConcern(w=3)).insert_one({"_id": "probe"})
+
+    for profile, expect_secondary in (("catalog", True), ("analytics", True),
+                                      ("cart", False), ("orders", False), ("payments", False)):
+        with use_profile(profile):
+            await db.probe.find_one({"_id": "probe"})
+        address, _ = log.last("find")
+        served_by = f"{address[0]}:{address[1]}"
+        checks.report(f"{profile} reads go to the {'secondary' if expect_secondary else 'primary'}",
+                      (served_by != primary) == expect_secondary, served_by)
+
+    for profile, expected in (("cart", {"w": 1}), ("orders", {"w": "majority"}),
+                              ("payments", {"w": "majority", "j": True})):
+        with use_profile(profile):
+            await db.probe.insert_one({"profile": profile})
+        _, command = log.last("insert")
+        sent = command.get("writeConcern")
+        checks.report(f"{profile} writes use {expected}", sent == expected, f"sent {sent}")
+
+
+async def check_causal_token(checks, client, log, db_name):
+    from consistency import ProfiledDatabase, issue_causal_token, read_causal_token, use_profile
+
+    db = ProfiledDatabase(client[db_name])
+    secret = "replica-set-check"
+    order_id = str(uuid.uuid4())
+
+    # Request 1: an orders-profile write
+    session = await client.start_session(causal_consistency=True)
+    with use_profile("orders", session):
+        await db.orders.insert_one({"id": order_id})
+    token = issue_causal_token(session, secret)
+    await session.end_session()
+    checks.report("causal session produces a token", token is not None)
+
+    # Request 2: a fresh session resumed from the token, reading from a secondary
+    cluster_time, operation_time = read_causal_token(token, secret)
+    session = await client.start_session(causal_consistency=True)
+    session.advance_cluster_time(cluster_time)
+    session.advance_operation_time(operation_time)
+    with use_profile("catalog", session):
+        found = await db.orders.find_one({"id": order_id})
+    _, command = log.last("find")
+    await session.end_session()
+    after = command.get("readConcern", {}).get("afterClusterTime")
+    checks.report("resumed session reads after the token's operation time", after == operation_time, f"{after}")
+    checks.report("secondary read sees the earlier write", found is not None)
+    checks.report("token signed with another key is rejected", read_causal_token(token, "forged") is None)
+
+
+async def check_app(checks, client, db_name):
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", db_name)
+    import httpx
+    import server
+
+    server.client = client
+    server.db = server.ProfiledDatabase(client[db_name])
+    product = server.Product(name="Check ring", description="d", price=1000, category="rings",
+                             material="gold", image_url="https://example.com/ring.jpg", inventory_count=10)
+    user = server.User(email=f"rs-{uuid.uuid4().hex[:8]}@example.com", full_name="Check", phone="1")
+    await client[db_name].products.insert_one(product.dict())
+    await client[db_name].users.insert_one(user.dict())
+    headers = {"authorization": f"Bearer {server.create_access_token({'sub': user.id})}"}
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://check") as http:
+        response = await http.post("/api/orders", headers=headers, json={
+            "items": [{"product_id": product.id, "quantity": 1}], "shipping_address": "x", "phone": "1",
+        })
+        token = response.headers.get("x-causal-token")
+        checks.report("POST /api/orders returns a causal token", response.status_code == 200 and bool(token),
+                      f"status {response.status_code}")
+        if response.status_code != 200:
+            return
+        order_id = response.json()["id"]
+        response = await http.get("/api/orders", headers={**headers, "x-causal-token": token or ""})
+        listed = [order["id"] for order in response.json()] if response.status_code == 200 else []
+        checks.report("GET /api/orders with the token lists the order", order_id in listed)
+
+
+async def check_admin_read_back(checks, client, log, db_name):
+    import httpx
+    import server
+    from consistency import PROFILES
+
+    def causal_or_primary(route):
+        profile = PROFILES.get(server.ROUTE_CONSISTENCY.get(route))
+        if profile is None:
+            return False, None
+        read_preference = profile.options.get("read_preference")
+        return profile.causal or read_preference in (None, ReadPreference.PRIMARY), profile.name
+
+    for read, writes in ADMIN_READ_BACK.items():
+        for route in (read,) + writes:
+            ok, name = causal_or_primary(route)
+            checks.report(f"{route} gives read-your-writes", ok, f"profile {name}")
+
+    primary = (await client.admin.command("hello"))["primary"]
+    product = server.Product(name="Read-back ring", description="d", price=1000, category="rings",
+                             material="gold", image_url="https://example.com/ring.jpg", inventory_count=10)
+    admin = server.User(email=f"rs-admin-{uuid.uuid4().hex[:8]}@example.com", full_name="Admin", phone="1",
+                        is_admin=True)
+    await client[db_name].products.insert_one(product.dict())
+    await client[db_name].users.insert_one(admin.dict())
+    headers = {"authorization": f"Bearer {server.create_access_token({'sub': admin.id})}"}
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://check") as http:
+        # Warm the cache first, so the read after the edit is a refill following an invalidation
+        await http.get("/api/products")
+        renamed = f"Renamed {uuid.uuid4().hex[:6]}"
+        fields = {key: value for key, value in product.dict().items() if key in server.ProductCreate.model_fields}
+        response = await http.put(f"/api/admin/products/{product.id}", headers=headers,
+                                  json={**fields, "name": renamed})
+        checks.report("admin product edit succeeds", response.status_code == 200, f"status {response.status_code}")
+        response = await http.get("/api/products", headers=headers)
+        names = [item["name"] for item in response.json()] if response.status_code == 200 else []
+        address, _ = log.last("find", "products")
+        served_by = f"{address[0]}:{address[1]}" if address else None
+        checks.report("GET /api/products right after the edit shows it", renamed in names)
+        checks.report("GET /api/products refill is served by the primary", served_by == primary, f"{served_by}")
+
+        response = await http.post("/api/orders", headers=headers, json={
+            "items": [{"product_id": product.id, "quantity": 1}], "shipping_address": "x", "phone": "1",
+        })
+        if response.status_code != 200:
+            checks.report("admin test order is placed", False, f"status {response.status_code}")
+            return
+        order_id = response.json()["id"]
+        response = await http.delete(f"/api/admin/orders/{order_id}", headers=headers)
+        token = response.headers.get("x-causal-token")
+        checks.report("admin order delete returns a causal token", bool(token))
+        response = await http.get("/api/admin/orders", headers={**headers, "x-causal-token": token or ""})
+        listed = [order["id"] for order in response.json()] if response.status_code == 200 else [order_id]
+        _, command = log.last("find", "orders")
+        after = (command or {}).get("readConcern", {}).get("afterClusterTime")
+        checks.report("GET /api/admin/orders with the token reads after the delete", after is not None, f"{after}")
+        checks.report("GET /api/admin/orders right after a delete no longer lists it", order_id not in listed)
+
+
+async def run_checks(uri, db_name):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    log = CommandLog()
+    client = AsyncIOMotorClient(uri, event_listeners=[log])
+    checks = Checks()
+    try:
+        await check_profiles(checks, client, log, db_name)
+        await check_causal_token(checks, client, log, db_name)
+        await check_app(checks, client, db_name)
+        await check_admin_read_back(checks, client, log, db_name)
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+    return checks.failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check consistency profiles against a replica set")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--mongo", help="Connection string of an existing replica set")
+    target.add_argument("--launch", action="store_true", help="Start a local three-node replica set")
+    parser.add_argument("--port", type=int, default=27117, help="First port for --launch")
+    parser.add_argument("--keep", action="store_true", help="Leave the launched replica set running")
+    parser.add_argument("--db-name", default="manira_consistency_check")
+    args = parser.parse_args()
+
+    processes = []
+    data_dir = None
+    try:
+        if args.launch:
+            data_dir = tempfile.mkdtemp(prefix="manira-rs-")
+            uri, processes = launch(args.port, data_dir)
+        else:
+            uri = args.mongo
+        wait_for_secondaries(uri)
+        failures = asyncio.run(run_checks(uri, args.db_name))
+    finally:
+        if processes and not args.keep:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait(timeout=60)
+            shutil.rmtree(data_dir, ignore_errors=True)
+        elif processes:
+            print(f"Replica set left running: {uri} (data in {data_dir})")
+    print(f"{failures} check(s) failed" if failures else "All checks passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())